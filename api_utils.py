@@ -3,208 +3,1273 @@ API Utilities for caching, rate limiting, and quota management.
 Reduces API calls and prevents quota exhaustion.
 """
 
+import asyncio
+import datetime
 import json
 import os
+import re
 import time
 import hashlib
+import sqlite3
+import threading
+import zlib
 from pathlib import Path
-from typing import Any, Dict, Optional, Callable
-import random
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Awaitable, Dict, List, Optional, Callable, Tuple
+import atexit
+
+import perf_spans
+from pipeline_types import StepError
+
+
+# Bump when prompts, parsing or the stored format change so old answers stop matching.
+CACHE_SCHEMA_VERSION = 2
+
+# Per-api_name (ttl, stale window) in seconds. Within the stale window an
+# expired answer is still served immediately while it is refreshed in the
+# background (stale-while-revalidate).
+CACHE_TTLS = {
+    "gemini": (24 * 3600, 6 * 3600),
+    "gemini_image_prompt": (7 * 24 * 3600, 24 * 3600),
+    "gemini_story_package": (24 * 3600, 6 * 3600),
+}
+DEFAULT_CACHE_TTL = (24 * 3600, 0)
+
+# Payloads at least this large are zlib-compressed on disk.
+COMPRESS_MIN_BYTES = 512
+
+
+def cache_ttl(api_name: str) -> tuple:
+    """Return the (ttl, stale window) policy for ``api_name``."""
+    return CACHE_TTLS.get(api_name, DEFAULT_CACHE_TTL)
 
 
 class ResponseCache:
-    """Simple file-based cache for API responses to avoid duplicate calls."""
+    """
+    SQLite-backed cache for API responses to avoid duplicate calls.
 
-    def __init__(self, cache_dir: str = ".api_cache"):
+    All entries live in a single indexed database file (WAL mode) so lookups
+    are one primary-key read, writes are atomic and several step processes
+    can share the cache safely. The store is bounded by ``max_bytes``; the
+    least recently used entries are evicted once it grows past the cap.
+
+    Keys cover the schema version, model and system instruction as well as
+    the input, so switching model or instruction never reuses old answers.
+    Each entry expires after its api_name's TTL (see CACHE_TTLS).
+    """
+
+    DB_FILENAME = "cache.sqlite3"
+
+    def __init__(self, cache_dir: str = ".api_cache", max_bytes: int = 50 * 1024 * 1024,
+                 on_evict: Optional[Callable[[str], None]] = None):
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(exist_ok=True)
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.db_path = self.cache_dir / self.DB_FILENAME
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] < CACHE_SCHEMA_VERSION:
+            self._reset_schema()
+        self._discard_legacy_json_files()
+        self.sweep_expired()
 
-    def _get_cache_key(self, api_name: str, input_text: str) -> str:
-        """Generate a cache key from API name and input."""
-        hash_obj = hashlib.md5(input_text.encode())
-        return f"{api_name}_{hash_obj.hexdigest()}.json"
+    def _reset_schema(self) -> None:
+        """
+        Create the current schema. Rows from older versions are dropped: they
+        were keyed without model/system instruction and cannot be reused safely.
+        """
+        with self._lock:
+            self._conn.execute("DROP TABLE IF EXISTS responses")
+            self._conn.execute(
+                """CREATE TABLE responses (
+                       key TEXT PRIMARY KEY,
+                       api TEXT NOT NULL,
+                       payload BLOB NOT NULL,
+                       compressed INTEGER NOT NULL,
+                       size INTEGER NOT NULL,
+                       created REAL NOT NULL,
+                       expires REAL NOT NULL,
+                       stale_until REAL NOT NULL,
+                       last_access REAL NOT NULL
+                   )"""
+            )
+            self._conn.execute("CREATE INDEX idx_responses_access ON responses(last_access)")
+            self._conn.execute("CREATE INDEX idx_responses_stale_until ON responses(stale_until)")
+            self._conn.execute(f"PRAGMA user_version = {CACHE_SCHEMA_VERSION}")
 
-    def get(self, api_name: str, input_text: str) -> Optional[str]:
-        """Retrieve cached response if it exists."""
-        cache_file = self.cache_dir / self._get_cache_key(api_name, input_text)
-        if cache_file.exists():
+    def _get_cache_key(self, api_name: str, input_text: str, model: Optional[str] = None,
+                       system_instruction: Optional[str] = None) -> str:
+        """Generate a cache key from API name, schema version, model, system instruction and input."""
+        material = json.dumps([CACHE_SCHEMA_VERSION, model, system_instruction, input_text])
+        hash_obj = hashlib.md5(material.encode())
+        return f"{api_name}_{hash_obj.hexdigest()}"
+
+    def _discard_legacy_json_files(self) -> None:
+        """Remove entries left by the old one-JSON-file-per-key cache (keyed on input only)."""
+        legacy_files = list(self.cache_dir.glob("*.json"))
+        for cache_file in legacy_files:
             try:
-                with open(cache_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    # Check if cache is still valid (24 hour TTL)
-                    if time.time() - data['timestamp'] < 86400:
-                        print(f"[CACHE HIT] Using cached response for {api_name}")
-                        return data['response']
-                    else:
-                        cache_file.unlink()  # Delete expired cache
-            except Exception as e:
-                print(f"[CACHE ERROR] Could not read cache: {e}")
+                cache_file.unlink()
+            except OSError as e:
+                print(f"[CACHE ERROR] Could not remove {cache_file.name}: {e}")
+        if legacy_files:
+            print(f"[CACHE] Discarded {len(legacy_files)} legacy unversioned JSON entries")
+
+    @staticmethod
+    def _encode(response: str) -> tuple:
+        raw = response.encode('utf-8')
+        if len(raw) >= COMPRESS_MIN_BYTES:
+            compressed = zlib.compress(raw, 6)
+            if len(compressed) < len(raw):
+                return compressed, 1
+        return raw, 0
+
+    @staticmethod
+    def _decode(payload: bytes, compressed: int) -> str:
+        if compressed:
+            payload = zlib.decompress(payload)
+        return payload.decode('utf-8')
+
+    def lookup(self, api_name: str, input_text: str, model: Optional[str] = None,
+               system_instruction: Optional[str] = None) -> Optional[tuple]:
+        """
+        Return ``(response, expires, stale_until)`` for a fresh or still-servable
+        stale entry, or None if there is nothing usable.
+        """
+        key = self._get_cache_key(api_name, input_text, model, system_instruction)
+        now = time.time()
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT payload, compressed, expires, stale_until FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                payload, compressed, expires, stale_until = row
+                if now >= stale_until:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    return None
+                self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            state = "stale " if now >= expires else ""
+            print(f"[CACHE HIT] Using {state}cached response for {api_name}")
+            return self._decode(payload, compressed), expires, stale_until
+        except (sqlite3.Error, zlib.error) as e:
+            print(f"[CACHE ERROR] Could not read cache: {e}")
         return None
 
-    def set(self, api_name: str, input_text: str, response: str) -> None:
-        """Store response in cache."""
+    def get(self, api_name: str, input_text: str, model: Optional[str] = None,
+            system_instruction: Optional[str] = None) -> Optional[str]:
+        """Retrieve cached response if it exists and has not expired."""
+        hit = self.lookup(api_name, input_text, model, system_instruction)
+        if hit is None or time.time() >= hit[1]:
+            return None
+        return hit[0]
+
+    def set(self, api_name: str, input_text: str, response: str, model: Optional[str] = None,
+            system_instruction: Optional[str] = None) -> tuple:
+        """
+        Store response in cache, evicting least recently used entries if over the
+        byte cap. Returns the ``(expires, stale_until)`` assigned to the entry.
+        """
+        key = self._get_cache_key(api_name, input_text, model, system_instruction)
+        now = time.time()
+        ttl, stale_window = cache_ttl(api_name)
+        expires, stale_until = now + ttl, now + ttl + stale_window
         try:
-            cache_file = self.cache_dir / self._get_cache_key(api_name, input_text)
-            data = {
-                'timestamp': time.time(),
-                'response': response,
-                'api': api_name
-            }
-            with open(cache_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            payload, compressed = self._encode(response)
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses "
+                    "(key, api, payload, compressed, size, created, expires, stale_until, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, api_name, payload, compressed, len(payload), now, expires, stale_until, now),
+                )
+            self._evict_to_fit()
             print(f"[CACHE SAVED] Cached response for {api_name}")
-        except Exception as e:
+        except sqlite3.Error as e:
             print(f"[CACHE ERROR] Could not write cache: {e}")
+        return expires, stale_until
+
+    def sweep_expired(self) -> int:
+        """Delete every entry past its stale window in one statement. Returns the number removed."""
+        try:
+            with self._lock:
+                cursor = self._conn.execute(
+                    "DELETE FROM responses WHERE stale_until <= ?", (time.time(),)
+                )
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            print(f"[CACHE ERROR] Could not sweep expired entries: {e}")
+            return 0
+
+    def _evict_to_fit(self) -> None:
+        """Evict least recently used entries until the store fits in ``max_bytes``."""
+        with self._lock:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                evicted_apis = []
+                for key, api, size in self._conn.execute(
+                    "SELECT key, api, size FROM responses ORDER BY last_access ASC"
+                ).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    total -= size
+                    evicted_apis.append(api)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if self.on_evict:
+            for api in evicted_apis:
+                self.on_evict(api)
+        print(f"[CACHE] Evicted {len(evicted_apis)} least recently used entries to stay under {self.max_bytes} bytes")
 
     def clear(self) -> None:
         """Clear all cached responses."""
-        for file in self.cache_dir.glob("*.json"):
-            file.unlink()
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
         print("[CACHE] Cleared all cached responses")
 
 
+class CacheStats:
+    """Per-api_name hit/miss/eviction/latency counters for the cache tiers."""
+
+    FIELDS = ("memory_hits", "disk_hits", "misses", "memory_evictions", "disk_evictions",
+              "bytes_served", "lookups", "lookup_seconds", "max_lookup_seconds")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, float]] = {}
+
+    def _bucket(self, api_name: str) -> Dict[str, float]:
+        if api_name not in self._counters:
+            self._counters[api_name] = {field: 0 for field in self.FIELDS}
+        return self._counters[api_name]
+
+    def record_lookup(self, api_name: str, tier: Optional[str], latency: float, nbytes: int = 0) -> None:
+        """Record one lookup; ``tier`` is "memory", "disk" or None for a miss."""
+        with self._lock:
+            bucket = self._bucket(api_name)
+            bucket["lookups"] += 1
+            bucket["lookup_seconds"] += latency
+            bucket["max_lookup_seconds"] = max(bucket["max_lookup_seconds"], latency)
+            if tier is None:
+                bucket["misses"] += 1
+            else:
+                bucket[f"{tier}_hits"] += 1
+                bucket["bytes_served"] += nbytes
+
+    def record_eviction(self, api_name: str, tier: str) -> None:
+        with self._lock:
+            self._bucket(api_name)[f"{tier}_evictions"] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Return a copy of the counters, keyed by api_name."""
+        with self._lock:
+            return {api: dict(bucket) for api, bucket in self._counters.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+
+
+def merge_cache_stats(snapshots) -> Dict[str, Dict[str, float]]:
+    """Combine several ``CacheStats.snapshot()`` dicts (e.g. one per step process)."""
+    merged: Dict[str, Dict[str, float]] = {}
+    for snapshot in snapshots:
+        for api_name, bucket in snapshot.items():
+            target = merged.setdefault(api_name, {field: 0 for field in CacheStats.FIELDS})
+            for field, value in bucket.items():
+                if field == "max_lookup_seconds":
+                    target[field] = max(target[field], value)
+                else:
+                    target[field] = target.get(field, 0) + value
+    return merged
+
+
+def format_cache_stats(snapshot: Dict[str, Dict[str, float]]) -> str:
+    """Render a stats snapshot as one human-readable line per api_name."""
+    if not snapshot:
+        return "[CACHE STATS] no lookups recorded"
+    lines = []
+    for api_name, bucket in sorted(snapshot.items()):
+        lookups = bucket["lookups"] or 1
+        hits = bucket["memory_hits"] + bucket["disk_hits"]
+        lines.append(
+            f"[CACHE STATS] {api_name}: hits={int(hits)} (memory={int(bucket['memory_hits'])}, "
+            f"disk={int(bucket['disk_hits'])}) misses={int(bucket['misses'])} "
+            f"hit_rate={hits / lookups:.0%} evictions(memory={int(bucket['memory_evictions'])}, "
+            f"disk={int(bucket['disk_evictions'])}) bytes_served={int(bucket['bytes_served'])} "
+            f"avg_lookup={bucket['lookup_seconds'] / lookups * 1000:.2f}ms "
+            f"max_lookup={bucket['max_lookup_seconds'] * 1000:.2f}ms"
+        )
+    return "\n".join(lines)
+
+
+class MemoryCache:
+    """In-process LRU cache bounded by entry count and total bytes."""
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 8 * 1024 * 1024,
+                 on_evict: Optional[Callable[[str], None]] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: str) -> Optional[tuple]:
+        """Return ``(response, expires, stale_until)`` or None; entries past their stale window are dropped."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            api_name, response, size, expires, stale_until = entry
+            if time.time() >= stale_until:
+                del self._entries[key]
+                self._bytes -= size
+                return None
+            self._entries.move_to_end(key)
+            return response, expires, stale_until
+
+    def set(self, key: str, api_name: str, response: str, expires: float, stale_until: float) -> None:
+        size = len(response.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        evicted = []
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[key] = (api_name, response, size, expires, stale_until)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted_entry = self._entries.popitem(last=False)
+                self._bytes -= evicted_entry[2]
+                evicted.append(evicted_entry[0])
+        if self.on_evict:
+            for evicted_api in evicted:
+                self.on_evict(evicted_api)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+class TieredCache:
+    """
+    Two-tier cache: an in-process LRU in front of the persistent ResponseCache.
+
+    Exposes the same get/set/clear/lookup API as ResponseCache and records
+    per-api_name counters in ``self.stats``.
+    """
+
+    def __init__(self, disk: Optional[ResponseCache] = None, max_entries: int = 256,
+                 max_bytes: int = 8 * 1024 * 1024):
+        self.stats = CacheStats()
+        self.disk = disk or ResponseCache()
+        self.disk.on_evict = lambda api: self.stats.record_eviction(api, "disk")
+        self.memory = MemoryCache(max_entries=max_entries, max_bytes=max_bytes,
+                                  on_evict=lambda api: self.stats.record_eviction(api, "memory"))
+
+    def lookup(self, api_name: str, input_text: str, model: Optional[str] = None,
+               system_instruction: Optional[str] = None) -> Optional[tuple]:
+        """
+        Look up the memory tier, then disk; disk hits are promoted to memory.
+        Returns ``(response, expires, stale_until)`` like ResponseCache.lookup,
+        or None.
+        """
+        start = time.perf_counter()
+        key = self.disk._get_cache_key(api_name, input_text, model, system_instruction)
+        hit = self.memory.get(key)
+        tier = "memory"
+        if hit is not None:
+            print(f"[CACHE HIT] Using in-memory cached response for {api_name}")
+        else:
+            tier = "disk"
+            hit = self.disk.lookup(api_name, input_text, model, system_instruction)
+            if hit is not None:
+                self.memory.set(key, api_name, *hit)
+        latency = time.perf_counter() - start
+        if hit is None:
+            self.stats.record_lookup(api_name, None, latency)
+            perf_spans.record("cache_misses")
+            return None
+        self.stats.record_lookup(api_name, tier, latency, len(hit[0].encode('utf-8')))
+        perf_spans.record("cache_hits")
+        return hit
+
+    def get(self, api_name: str, input_text: str, model: Optional[str] = None,
+            system_instruction: Optional[str] = None) -> Optional[str]:
+        """Return a fresh cached response, or None."""
+        hit = self.lookup(api_name, input_text, model, system_instruction)
+        if hit is None or time.time() >= hit[1]:
+            return None
+        return hit[0]
+
+    def set(self, api_name: str, input_text: str, response: str, model: Optional[str] = None,
+            system_instruction: Optional[str] = None) -> None:
+        expires, stale_until = self.disk.set(api_name, input_text, response, model, system_instruction)
+        key = self.disk._get_cache_key(api_name, input_text, model, system_instruction)
+        self.memory.set(key, api_name, response, expires, stale_until)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        self.disk.clear()
+
+
+class ModelQuota:
+    """Per-model quota: requests/minute, input tokens/minute and requests/day."""
+
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None,
+                 rpd: Optional[float] = None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.rpd = rpd
+
+
+# Gemini free-tier limits (https://ai.google.dev/gemini-api/docs/rate-limits).
+# Override per deployment by passing ``quotas`` to RateLimiter.
+DEFAULT_MODEL_QUOTAS = {
+    "gemini-1.5-flash": ModelQuota(rpm=15, tpm=1_000_000, rpd=1500),
+    "gemini-2.0-flash": ModelQuota(rpm=15, tpm=1_000_000, rpd=200),
+    "gemini-2.0-flash-lite": ModelQuota(rpm=30, tpm=1_000_000, rpd=200),
+    "gemini-2.5-flash": ModelQuota(rpm=10, tpm=250_000, rpd=250),
+}
+
+
+class TokenBucket:
+    """
+    Token bucket that may go into debt: reservations always succeed and
+    return how long the caller must wait, so concurrent callers queue up
+    behind each other instead of all firing at once.
+
+    ``tokens``/``updated`` can be restored from and saved to the limiter
+    state store so the bucket survives across processes.
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float,
+                 tokens: Optional[float] = None, updated: Optional[float] = None):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity if tokens is None else tokens
+        self.updated = time.time() if updated is None else updated
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(0.0, now - self.updated)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_per_second)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Take ``amount`` tokens and return the seconds until they are actually available."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.refill_per_second
+
+    def to_state(self) -> list:
+        return [self.tokens, self.updated]
+
+
+class LocalLimiterState:
+    """In-process limiter state, guarded by a thread lock."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._state: Dict[str, Any] = {}
+
+    @contextmanager
+    def transaction(self, write: bool = True):
+        """Yield the mutable state dict; changes are kept when the block exits."""
+        with self._lock:
+            yield self._state
+
+
+class SharedLimiterState:
+    """
+    Limiter state persisted in SQLite and shared by every process on the host.
+
+    Each transaction takes SQLite's write lock (BEGIN IMMEDIATE), so the
+    read-modify-write of last-call times, buckets and "blocked until"
+    timestamps is atomic across step subprocesses and concurrent pipeline runs.
+    Read-only transactions (``write=False``) just read the last committed
+    state, which WAL mode allows without waiting for writers.
+    """
+
+    def __init__(self, path: str = os.path.join(".api_cache", "limiter.sqlite3")):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(self.path), timeout=60, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS limiter_state (id INTEGER PRIMARY KEY, state TEXT NOT NULL)")
+
+    @contextmanager
+    def transaction(self, write: bool = True):
+        """
+        Yield the state dict under the cross-process write lock and persist it
+        on exit. With ``write=False`` the state is only read; changes are dropped.
+        """
+        with self._lock:
+            if not write:
+                row = self._conn.execute("SELECT state FROM limiter_state WHERE id = 1").fetchone()
+                yield json.loads(row[0]) if row else {}
+                return
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT state FROM limiter_state WHERE id = 1").fetchone()
+                state = json.loads(row[0]) if row else {}
+                yield state
+                self._conn.execute("INSERT OR REPLACE INTO limiter_state (id, state) VALUES (1, ?)",
+                                   (json.dumps(state),))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+
+_RETRY_INFO_PATTERN = re.compile(r"""['"]retryDelay['"]\s*:\s*['"](\d+(?:\.\d+)?)s['"]""")
+_RETRY_MESSAGE_PATTERN = re.compile(r"retry in (\d+(?:\.\d+)?)\s*s", re.IGNORECASE)
+
+
+def parse_retry_delay(error: Any) -> Optional[float]:
+    """
+    Extract the server-requested retry delay (seconds) from a 429 error.
+
+    Prefers the precise "Please retry in 37.76s" message and falls back to
+    the google.rpc.RetryInfo ``retryDelay`` field.
+    """
+    text = str(error)
+    match = _RETRY_MESSAGE_PATTERN.search(text) or _RETRY_INFO_PATTERN.search(text)
+    if match:
+        return float(match.group(1))
+    return None
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough input token estimate (~4 characters per token) for TPM accounting."""
+    return len(text) // 4 + 1
+
+
+class QuotaWaitExceeded(StepError):
+    """
+    The limiter would have to wait longer than the caller allows (typically
+    a spent daily bucket). Classified as a quota failure, with the wait as
+    the retry-after.
+    """
+
+    def __init__(self, message: str, retry_after: float):
+        # "quota" is step_failures.QUOTA; step_failures imports this module.
+        super().__init__(message, failure_class="quota", retry_after=retry_after)
+
+
 class RateLimiter:
-    """Rate limiter with exponential backoff to prevent quota exhaustion."""
+    """
+    Quota-aware rate limiter.
 
-    def __init__(self, min_delay: float = 1.0, max_delay: float = 30.0):
+    Enforces a minimum spacing between calls to the same API plus token
+    buckets for each model's requests/minute, input tokens/minute and
+    requests/day. When the server answers 429 with a retry delay the model
+    is blocked for exactly that long; otherwise it falls back to exponential
+    backoff.
+
+    All state lives in ``state_store`` (LocalLimiterState by default, or a
+    SharedLimiterState so separate processes respect the same budget).
+    """
+
+    def __init__(self, min_delay: float = 1.0, max_delay: float = 30.0,
+                 quotas: Optional[Dict[str, ModelQuota]] = None, state_store=None):
         self.min_delay = min_delay
         self.max_delay = max_delay
-        self.last_call_time = {}
-        self.failure_count = {}
-
-    def wait(self, api_name: str) -> None:
-        """Wait appropriate time before making API call."""
-        if api_name in self.last_call_time:
-            elapsed = time.time() - self.last_call_time[api_name]
-            wait_time = self.min_delay - elapsed
-            if wait_time > 0:
-                print(f"[RATE LIMIT] Waiting {wait_time:.2f}s before next {api_name} call...")
-                time.sleep(wait_time)
-
-        # Add jitter to prevent thundering herd
-        jitter = random.uniform(0, 0.5)
-        time.sleep(jitter)
-        self.last_call_time[api_name] = time.time()
-
-    def handle_quota_error(self, api_name: str) -> float:
-        """Handle quota error with exponential backoff."""
-        failure_count = self.failure_count.get(api_name, 0) + 1
-        self.failure_count[api_name] = failure_count
-
-        # Exponential backoff: 1s, 2s, 4s, 8s, ... capped at max_delay
-        backoff_delay = min(2 ** (failure_count - 1), self.max_delay)
-        print(f"[QUOTA ERROR] {api_name} quota exceeded. Backoff attempt {failure_count}, waiting {backoff_delay}s...")
+        self.quotas = DEFAULT_MODEL_QUOTAS if quotas is None else quotas
+        self.state_store = state_store or LocalLimiterState()
+
+    def _bucket_specs(self, model: str) -> Dict[str, tuple]:
+        """Return {bucket name: (capacity, refill per second)} for the model's quota."""
+        quota = self.quotas.get(model)
+        specs = {}
+        if quota is not None:
+            if quota.rpm:
+                specs["rpm"] = (quota.rpm, quota.rpm / 60.0)
+            if quota.tpm:
+                specs["tpm"] = (quota.tpm, quota.tpm / 60.0)
+            if quota.rpd:
+                specs["rpd"] = (quota.rpd, quota.rpd / 86400.0)
+        return specs
+
+    def _compute_delay(self, state: Dict[str, Any], api_name: str, model: Optional[str],
+                       input_tokens: int, now: float, consume: bool) -> float:
+        last_call_time = state.setdefault("last_call_time", {})
+        blocked_until = state.setdefault("blocked_until", {})
+        delay = 0.0
+        if api_name in last_call_time:
+            delay = max(delay, self.min_delay - (now - last_call_time[api_name]))
+        delay = max(delay, blocked_until.get(model or api_name, 0) - now)
+        if model:
+            amounts = {"rpm": 1, "tpm": input_tokens, "rpd": 1}
+            model_buckets = state.setdefault("buckets", {}).setdefault(model, {})
+            for name, (capacity, rate) in self._bucket_specs(model).items():
+                bucket = TokenBucket(capacity, rate, *model_buckets.get(name, (None, None)))
+                delay = max(delay, bucket.reserve(amounts[name], now))
+                if consume:
+                    model_buckets[name] = bucket.to_state()
+        if consume:
+            last_call_time[api_name] = now + delay
+        return delay
+
+    def reserve(self, api_name: str, model: Optional[str] = None, input_tokens: int = 0,
+                max_wait: Optional[float] = None) -> float:
+        """
+        Reserve capacity for one call and return how long to wait before
+        making it. If that would be longer than ``max_wait`` seconds nothing
+        is reserved and QuotaWaitExceeded is raised.
+        """
+        with self.state_store.transaction() as state:
+            now = time.time()
+            if max_wait is not None:
+                delay = self._compute_delay(json.loads(json.dumps(state)), api_name, model, input_tokens, now,
+                                            consume=False)
+                if delay > max_wait:
+                    raise QuotaWaitExceeded(f"{api_name} ({model or 'any model'}) would have to wait {delay:.0f}s "
+                                            f"for quota, more than the {max_wait:.0f}s allowed", retry_after=delay)
+            return self._compute_delay(state, api_name, model, input_tokens, now, consume=True)
+
+    def peek(self, api_name: str, model: Optional[str] = None, input_tokens: int = 0) -> float:
+        """Return how long a call would have to wait right now, without reserving anything."""
+        with self.state_store.transaction(write=False) as state:
+            return self._compute_delay(json.loads(json.dumps(state)), api_name, model,
+                                       input_tokens, time.time(), consume=False)
+
+    def wait(self, api_name: str, model: Optional[str] = None, input_tokens: int = 0,
+             max_wait: Optional[float] = None) -> None:
+        """Wait appropriate time before making API call (at most ``max_wait``, see reserve)."""
+        wait_time = self.reserve(api_name, model, input_tokens, max_wait)
+        if wait_time > 0:
+            print(f"[RATE LIMIT] Waiting {wait_time:.2f}s before next {api_name} call...")
+            perf_spans.record("sleep_s", wait_time)
+            time.sleep(wait_time)
+
+    async def wait_async(self, api_name: str, model: Optional[str] = None, input_tokens: int = 0,
+                         max_wait: Optional[float] = None) -> None:
+        """
+        Async counterpart of ``wait``: the reservation (which may wait on the
+        shared state's lock) runs in a thread, and the sleep does not block
+        the event loop.
+        """
+        wait_time = await asyncio.to_thread(self.reserve, api_name, model, input_tokens, max_wait)
+        if wait_time > 0:
+            print(f"[RATE LIMIT] Waiting {wait_time:.2f}s before next {api_name} call...")
+            perf_spans.record("sleep_s", wait_time)
+            await asyncio.sleep(wait_time)
+
+    def handle_quota_error(self, api_name: str, error: Any = None, model: Optional[str] = None) -> float:
+        """
+        Record a quota error and return the delay before the next attempt.
+
+        Uses the server's retryDelay when the error carries one, otherwise
+        exponential backoff. The delay is also recorded so that the next
+        ``wait`` for this model, in any process, blocks until it has passed.
+        """
+        with self.state_store.transaction() as state:
+            failure_counts = state.setdefault("failure_count", {})
+            blocked_until = state.setdefault("blocked_until", {})
+            failure_count = failure_counts.get(api_name, 0) + 1
+            failure_counts[api_name] = failure_count
+
+            server_delay = parse_retry_delay(error) if error is not None else None
+            if server_delay is not None:
+                backoff_delay = server_delay
+                print(f"[QUOTA ERROR] {api_name} quota exceeded. Server asked to retry in {backoff_delay:.2f}s")
+            else:
+                # Exponential backoff: 1s, 2s, 4s, 8s, ... capped at max_delay
+                backoff_delay = min(2 ** (failure_count - 1), self.max_delay)
+                print(f"[QUOTA ERROR] {api_name} quota exceeded. Backoff attempt {failure_count}, waiting {backoff_delay}s...")
+            key = model or api_name
+            blocked_until[key] = max(blocked_until.get(key, 0), time.time() + backoff_delay)
         return backoff_delay
 
     def reset_failure_count(self, api_name: str) -> None:
         """Reset failure count after successful call."""
-        self.failure_count[api_name] = 0
+        with self.state_store.transaction(write=False) as state:
+            if not state.get("failure_count", {}).get(api_name):
+                return
+        with self.state_store.transaction() as state:
+            state.setdefault("failure_count", {})[api_name] = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return a copy of the current limiter state (for logging/inspection)."""
+        with self.state_store.transaction(write=False) as state:
+            return json.loads(json.dumps(state))
+
+
+def _next_quota_reset(now: float) -> float:
+    """Timestamp of the next daily quota reset (midnight US Pacific time for Gemini)."""
+    try:
+        from zoneinfo import ZoneInfo
+        tz = ZoneInfo("America/Los_Angeles")
+    except Exception:
+        tz = datetime.timezone(datetime.timedelta(hours=-8))
+    local_now = datetime.datetime.fromtimestamp(now, tz)
+    next_midnight = (local_now + datetime.timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return next_midnight.timestamp()
+
+
+def hard_quota_reset_time(error: Any, now: Optional[float] = None) -> Optional[float]:
+    """
+    If ``error`` is a hard quota exhaustion (``limit: 0`` or a per-day quota),
+    return the time it resets; otherwise None (per-minute limits are left to
+    the RateLimiter).
+    """
+    text = str(error)
+    now = time.time() if now is None else now
+    if re.search(r"limit:\s*0\b", text) or "PerDay" in text:
+        return _next_quota_reset(now)
+    return None
+
+
+def breaker_key(api_name: str, model: Optional[str]) -> str:
+    """Breaker key: API family (``gemini_image_prompt`` -> ``gemini``) plus model."""
+    return f"{api_name.split('_')[0]}:{model or '*'}"
+
+
+class CircuitBreaker:
+    """
+    Per-(API, model) circuit breaker for hard quota exhaustion.
+
+    Opens when a hard-quota signature is seen and stays open until the
+    quota's reset time, so callers go straight to their fallback path instead
+    of spending retries that cannot succeed. State lives in the same store as
+    the RateLimiter, so every process (and the orchestrator) sees it.
+    """
+
+    def __init__(self, state_store=None):
+        self.state_store = state_store or LocalLimiterState()
+
+    def is_open(self, api_name: str, model: Optional[str] = None) -> bool:
+        key = breaker_key(api_name, model)
+        with self.state_store.transaction(write=False) as state:
+            breaker = state.get("circuit_breakers", {}).get(key)
+            return breaker is not None and breaker["open_until"] > time.time()
+
+    def record_error(self, api_name: str, model: Optional[str], error: Any) -> bool:
+        """Open the breaker if ``error`` is a hard quota error. Returns True if it opened."""
+        reset_time = hard_quota_reset_time(error)
+        if reset_time is None:
+            return False
+        self.trip(api_name, model, reset_time, str(error))
+        return True
+
+    def trip(self, api_name: str, model: Optional[str], open_until: float, reason: str) -> None:
+        """Open the breaker until ``open_until``."""
+        key = breaker_key(api_name, model)
+        with self.state_store.transaction() as state:
+            state.setdefault("circuit_breakers", {})[key] = {
+                "open_until": open_until,
+                "opened_at": time.time(),
+                "reason": reason[:200],
+            }
+        reset_at = datetime.datetime.fromtimestamp(open_until).strftime("%Y-%m-%d %H:%M:%S")
+        print(f"[CIRCUIT OPEN] {key} quota exhausted, failing fast until {reset_at}")
+
+    def record_success(self, api_name: str, model: Optional[str] = None) -> None:
+        key = breaker_key(api_name, model)
+        with self.state_store.transaction(write=False) as state:
+            if key not in state.get("circuit_breakers", {}):
+                return
+        with self.state_store.transaction() as state:
+            state.get("circuit_breakers", {}).pop(key, None)
+
+    def open_breakers(self) -> Dict[str, Dict[str, Any]]:
+        """Return {key: state} for every breaker that is currently open."""
+        now = time.time()
+        with self.state_store.transaction(write=False) as state:
+            breakers = state.get("circuit_breakers", {})
+            return {key: dict(value) for key, value in breakers.items() if value["open_until"] > now}
+
+
+class _InFlightCall:
+    """
+    Result slot shared by the leader and followers of one coalesced call.
+    Sync followers block on ``done``; async followers get a future on their
+    own event loop that ``finish`` resolves, whichever kind the leader is.
+    """
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.loop = loop  # event loop of an async leader
+        self._lock = threading.Lock()
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, "asyncio.Future"]] = []
+
+    def finish(self, result: Any, error: Optional[BaseException]) -> None:
+        with self._lock:
+            self.result, self.error = result, error
+            self.done.set()
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve_waiter, future)
+            except RuntimeError:
+                pass  # the follower's loop has closed
+
+    async def wait_async(self) -> Any:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            waiter = None
+            if not self.done.is_set():
+                waiter = loop.create_future()
+                self._waiters.append((loop, waiter))
+        if waiter is not None:
+            await waiter
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def _resolve_waiter(future: "asyncio.Future") -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class SingleFlight:
+    """
+    Coalesce identical concurrent calls: the first caller for a key runs the
+    function, every other caller waits for and shares its result or exception.
+    Sync and async callers share one map, so a ``do`` and a ``do_async`` for
+    the same key coalesce too.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Any, _InFlightCall] = {}
+
+    def _join(self, key: Any, loop: Optional[asyncio.AbstractEventLoop] = None) -> Tuple[_InFlightCall, bool]:
+        """The in-flight call for ``key`` and whether this caller leads it."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                return call, False
+            call = self._calls[key] = _InFlightCall(loop)
+            return call, True
+
+    def _finish(self, key: Any, call: _InFlightCall, result: Any, error: Optional[BaseException]) -> None:
+        with self._lock:
+            del self._calls[key]
+        call.finish(result, error)
+
+    def do(self, key: Any, func: Callable[[], Any]) -> Any:
+        call, leader = self._join(key)
+        if not leader:
+            if call.loop is not None and call.loop is _running_loop():
+                # Blocking here would stall the event loop the leader runs on.
+                return func()
+            print(f"[SINGLE FLIGHT] Waiting for identical in-flight {key[0]} call")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            result = func()
+        except BaseException as e:
+            self._finish(key, call, None, e)
+            raise
+        self._finish(key, call, result, None)
+        return result
+
+    async def do_async(self, key: Any, coro_func: Callable[[], Awaitable[Any]]) -> Any:
+        call, leader = self._join(key, asyncio.get_running_loop())
+        if not leader:
+            print(f"[SINGLE FLIGHT] Waiting for identical in-flight {key[0]} call")
+            return await call.wait_async()
+
+        try:
+            result = await coro_func()
+        except BaseException as e:
+            self._finish(key, call, None, e)
+            raise
+        self._finish(key, call, result, None)
+        return result
+
+
+def _flight_key(api_name: str, input_text: str, model: Optional[str],
+                system_instruction: Optional[str] = None) -> tuple:
+    material = json.dumps([model, system_instruction, input_text])
+    return (api_name, model, hashlib.sha256(material.encode()).hexdigest())
+
+
+_single_flight = SingleFlight()
+
+
+def _retry_delay_after_error(
+    error: Exception,
+    api_name: str,
+    attempt: int,
+    max_retries: int,
+    rate_limiter: RateLimiter,
+    model: Optional[str],
+    max_quota_wait: float,
+    circuit_breaker: CircuitBreaker
+) -> Optional[float]:
+    """
+    Classify an API exception and decide what to do next.
+
+    Returns the seconds to sleep before the next attempt, or None to give up.
+    Quota errors return 0 because the limiter itself blocks the model until
+    the server's retry delay has passed.
+    """
+    error_str = str(error).lower()
+    print(f"[API EXCEPTION] {api_name} error: {type(error).__name__}: {error}")
+
+    # Check if it's a quota error (429)
+    if '429' in error_str or 'quota' in error_str or 'resource_exhausted' in error_str:
+        if circuit_breaker.record_error(api_name, model, error):
+            return None  # hard quota: retrying before the reset cannot succeed
+        if attempt < max_retries - 1:
+            backoff_delay = rate_limiter.handle_quota_error(api_name, error=error, model=model)
+            if backoff_delay > max_quota_wait:
+                print(f"[ERROR] {api_name} retry delay {backoff_delay:.0f}s exceeds {max_quota_wait:.0f}s, giving up")
+                return None
+            return 0.0  # the next wait() sleeps until the quota window reopens
+        print(f"[ERROR] {api_name} quota exhausted after {max_retries} attempts")
+        return None
+
+    # Check if it's a server overload error (503 UNAVAILABLE)
+    if '503' in error_str or 'unavailable' in error_str or 'high demand' in error_str:
+        if attempt < max_retries - 1:
+            backoff_delay = min(5 * (2 ** attempt), 60)  # 5s, 10s, 20s, 40s, 60s
+            print(f"[SERVER OVERLOAD] {api_name} server overloaded. Waiting {backoff_delay}s before retry...")
+            return backoff_delay
+        print(f"[ERROR] {api_name} server unavailable after {max_retries} attempts")
+        return None
+
+    # Other errors (network, auth, etc)
+    print(f"[RETRY] {api_name} failed (attempt {attempt + 1}/{max_retries}): {error}")
+    if attempt < max_retries - 1:
+        return 2 ** attempt  # Simple backoff for other errors
+    return None
+
+
+def _refresh_in_background(api_name: str, input_text: str, model: Optional[str],
+                           rate_limiter: RateLimiter, circuit_breaker: CircuitBreaker,
+                           refresh: Callable[[], Any]) -> None:
+    """Run ``refresh`` on a background thread, but only if quota allows a call right now."""
+    if circuit_breaker.is_open(api_name, model) or \
+            rate_limiter.peek(api_name, model, estimate_tokens(input_text)) > 0:
+        print(f"[CACHE] Serving stale {api_name} response; no quota to refresh it now")
+        return
+    print(f"[CACHE] Serving stale {api_name} response and refreshing it in the background")
+    threading.Thread(target=refresh, name=f"refresh-{api_name}").start()
 
 
 def call_with_cache_and_limits(
-    cache: ResponseCache,
+    cache: TieredCache,
     rate_limiter: RateLimiter,
     api_name: str,
     input_text: str,
     api_call_func: Callable,
-    max_retries: int = 3
+    max_retries: int = 3,
+    model: Optional[str] = None,
+    max_quota_wait: float = 300.0,
+    circuit_breaker: Optional[CircuitBreaker] = None,
+    system_instruction: Optional[str] = None,
+    stale_while_revalidate: bool = True
 ) -> Optional[str]:
     """
     Call an API with caching and rate limiting.
 
     Args:
-        cache: ResponseCache instance
+        cache: TieredCache (or ResponseCache) instance
         rate_limiter: RateLimiter instance
         api_name: Name of the API (for logging)
         input_text: Input to the API (used for cache key)
         api_call_func: Function that calls the API and returns response
         max_retries: Maximum number of retries on failure
+        model: Model name used to look up per-model quotas (also part of the cache key)
+        max_quota_wait: Give up instead of sleeping if the server asks for a longer retry delay;
+            a longer wait on the limiter's own buckets (e.g. a spent daily quota)
+            opens the circuit breaker and returns None, as an open breaker does
+        circuit_breaker: CircuitBreaker to consult (defaults to the global one)
+        system_instruction: System instruction sent with the prompt (part of the cache key)
+        stale_while_revalidate: Serve an entry inside its stale window immediately
+            and refresh it in the background when quota allows
 
     Returns:
         API response or None if failed
     """
+    circuit_breaker = circuit_breaker or get_circuit_breaker()
+    flight_key = _flight_key(api_name, input_text, model, system_instruction)
+
+    def call(retries):
+        return _call_with_retries(cache, rate_limiter, api_name, input_text, api_call_func,
+                                  retries, model, max_quota_wait, circuit_breaker, system_instruction)
 
     # Check cache first
-    cached_response = cache.get(api_name, input_text)
-    if cached_response:
-        return cached_response
+    hit = cache.lookup(api_name, input_text, model=model, system_instruction=system_instruction)
+    if hit is not None:
+        cached_response, expires, _ = hit
+        if time.time() < expires:
+            return cached_response
+        if stale_while_revalidate:
+            _refresh_in_background(api_name, input_text, model, rate_limiter, circuit_breaker,
+                                   lambda: _single_flight.do(flight_key, lambda: call(1)))
+            return cached_response
 
-    # Rate limit before call
-    rate_limiter.wait(api_name)
+    if circuit_breaker.is_open(api_name, model):
+        print(f"[CIRCUIT OPEN] {breaker_key(api_name, model)} quota exhausted, skipping {api_name} call")
+        return hit[0] if hit else None
+
+    # Identical concurrent misses share one call (and its failure)
+    return _single_flight.do(flight_key, lambda: call(max_retries))
+
+
+def _call_with_retries(cache, rate_limiter, api_name, input_text, api_call_func, max_retries,
+                       model, max_quota_wait, circuit_breaker, system_instruction) -> Optional[str]:
+    """Uncached part of call_with_cache_and_limits: rate limiting, the call and retries."""
+    input_tokens = estimate_tokens(input_text)
 
     # Try API call with retries
     for attempt in range(max_retries):
+        # Rate limit (and honour any server-requested retry delay) before each call
+        try:
+            rate_limiter.wait(api_name, model=model, input_tokens=input_tokens, max_wait=max_quota_wait)
+        except QuotaWaitExceeded as e:
+            circuit_breaker.trip(api_name, model, time.time() + e.retry_after, str(e))
+            return None
         try:
             print(f"[API CALL] {api_name} (attempt {attempt + 1}/{max_retries})")
+            perf_spans.record("api_calls")
+            if attempt:
+                perf_spans.record("api_retries")
             response = api_call_func()
 
             if response:
                 # Cache successful response
-                cache.set(api_name, input_text, response)
+                cache.set(api_name, input_text, response, model=model,
+                          system_instruction=system_instruction)
                 rate_limiter.reset_failure_count(api_name)
+                circuit_breaker.record_success(api_name, model)
                 print(f"[API SUCCESS] {api_name} call successful")
                 return response
             else:
                 # Response is empty/None from API
                 print(f"[WARNING] {api_name} returned empty response on attempt {attempt + 1}")
                 if attempt < max_retries - 1:
+                    perf_spans.record("sleep_s", 1)
                     time.sleep(1)
                     continue
 
         except Exception as e:
-            error_str = str(e).lower()
-            print(f"[API EXCEPTION] {api_name} error: {type(e).__name__}: {e}")
+            delay = _retry_delay_after_error(e, api_name, attempt, max_retries, rate_limiter,
+                                             model, max_quota_wait, circuit_breaker)
+            if delay is None:
+                return None
+            perf_spans.record("sleep_s", delay)
+            time.sleep(delay)
 
-            # Check if it's a quota error (429)
-            if '429' in error_str or 'quota' in error_str or 'resource_exhausted' in error_str:
-                if attempt < max_retries - 1:
-                    backoff_delay = rate_limiter.handle_quota_error(api_name)
-                    time.sleep(backoff_delay)
-                    continue
-                else:
-                    print(f"[ERROR] {api_name} quota exhausted after {max_retries} attempts")
-                    return None
+    print(f"[ERROR] {api_name} exhausted all retries")
+    return None
 
-            # Check if it's a server overload error (503 UNAVAILABLE)
-            elif '503' in error_str or 'unavailable' in error_str or 'high demand' in error_str:
-                if attempt < max_retries - 1:
-                    backoff_delay = min(5 * (2 ** attempt), 60)  # 5s, 10s, 20s, 40s, 60s
-                    print(f"[SERVER OVERLOAD] {api_name} server overloaded. Waiting {backoff_delay}s before retry...")
-                    time.sleep(backoff_delay)
-                    continue
-                else:
-                    print(f"[ERROR] {api_name} server unavailable after {max_retries} attempts")
-                    return None
 
-            # Other errors (network, auth, etc)
-            else:
-                print(f"[RETRY] {api_name} failed (attempt {attempt + 1}/{max_retries}): {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(2 ** attempt)  # Simple backoff for other errors
-                    continue
-                else:
-                    return None
+async def async_call_with_cache_and_limits(
+    cache: TieredCache,
+    rate_limiter: RateLimiter,
+    api_name: str,
+    input_text: str,
+    api_call_func: Callable[[], Awaitable[Optional[str]]],
+    max_retries: int = 3,
+    model: Optional[str] = None,
+    max_quota_wait: float = 300.0,
+    circuit_breaker: Optional[CircuitBreaker] = None,
+    system_instruction: Optional[str] = None,
+    stale_while_revalidate: bool = True
+) -> Optional[str]:
+    """
+    Asyncio variant of call_with_cache_and_limits.
+
+    ``api_call_func`` is a coroutine function. Rate-limit and backoff sleeps
+    use ``asyncio.sleep`` so independent calls overlap while still drawing
+    from the same shared RateLimiter budget. Background refreshes of stale
+    entries run ``api_call_func`` on their own event loop in a worker thread.
+    """
+    circuit_breaker = circuit_breaker or get_circuit_breaker()
+    flight_key = _flight_key(api_name, input_text, model, system_instruction)
+
+    def call(retries):
+        return _async_call_with_retries(cache, rate_limiter, api_name, input_text, api_call_func,
+                                        retries, model, max_quota_wait, circuit_breaker,
+                                        system_instruction)
+
+    # The cache may be SQLite-backed; keep its I/O off the event loop.
+    hit = await asyncio.to_thread(cache.lookup, api_name, input_text, model=model,
+                                  system_instruction=system_instruction)
+    if hit is not None:
+        cached_response, expires, _ = hit
+        if time.time() < expires:
+            return cached_response
+        if stale_while_revalidate:
+            await asyncio.to_thread(_refresh_in_background, api_name, input_text, model, rate_limiter,
+                                    circuit_breaker,
+                                    lambda: _single_flight.do(flight_key, lambda: asyncio.run(call(1))))
+            return cached_response
+
+    if await asyncio.to_thread(circuit_breaker.is_open, api_name, model):
+        print(f"[CIRCUIT OPEN] {breaker_key(api_name, model)} quota exhausted, skipping {api_name} call")
+        return hit[0] if hit else None
+
+    return await _single_flight.do_async(flight_key, lambda: call(max_retries))
+
+
+async def _async_call_with_retries(cache, rate_limiter, api_name, input_text, api_call_func, max_retries,
+                                   model, max_quota_wait, circuit_breaker, system_instruction) -> Optional[str]:
+    """Uncached part of async_call_with_cache_and_limits."""
+    input_tokens = estimate_tokens(input_text)
+
+    for attempt in range(max_retries):
+        try:
+            await rate_limiter.wait_async(api_name, model=model, input_tokens=input_tokens, max_wait=max_quota_wait)
+        except QuotaWaitExceeded as e:
+            await asyncio.to_thread(circuit_breaker.trip, api_name, model, time.time() + e.retry_after, str(e))
+            return None
+        try:
+            print(f"[API CALL] {api_name} (attempt {attempt + 1}/{max_retries})")
+            perf_spans.record("api_calls")
+            if attempt:
+                perf_spans.record("api_retries")
+            response = await api_call_func()
+
+            if response:
+                await asyncio.to_thread(cache.set, api_name, input_text, response, model=model,
+                                        system_instruction=system_instruction)
+                await asyncio.to_thread(rate_limiter.reset_failure_count, api_name)
+                await asyncio.to_thread(circuit_breaker.record_success, api_name, model)
+                print(f"[API SUCCESS] {api_name} call successful")
+                return response
+            print(f"[WARNING] {api_name} returned empty response on attempt {attempt + 1}")
+            if attempt < max_retries - 1:
+                perf_spans.record("sleep_s", 1)
+                await asyncio.sleep(1)
+
+        except Exception as e:
+            delay = await asyncio.to_thread(_retry_delay_after_error, e, api_name, attempt, max_retries,
+                                            rate_limiter, model, max_quota_wait, circuit_breaker)
+            if delay is None:
+                return None
+            perf_spans.record("sleep_s", delay)
+            await asyncio.sleep(delay)
 
     print(f"[ERROR] {api_name} exhausted all retries")
     return None
 
 
+async def gather_bounded(awaitables, limit: int = 4) -> list:
+    """Await ``awaitables`` concurrently, at most ``limit`` at a time, preserving order."""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(awaitable):
+        async with semaphore:
+            return await awaitable
+
+    return await asyncio.gather(*(run(awaitable) for awaitable in awaitables))
+
+
 # Global instances (singleton pattern)
 _cache = None
 _rate_limiter = None
+_circuit_breaker = None
 
 
-def get_cache() -> ResponseCache:
+def get_cache() -> TieredCache:
     """Get or create global cache instance."""
     global _cache
     if _cache is None:
-        _cache = ResponseCache()
+        _cache = TieredCache()
+        atexit.register(dump_cache_stats)
     return _cache
 
 
+def current_cache_stats() -> Dict[str, Dict[str, float]]:
+    """Return this process's cache counters (empty if the cache was never used)."""
+    return _cache.stats.snapshot() if _cache is not None else {}
+
+
+def reset_cache_stats() -> None:
+    """Zero this process's cache counters, e.g. at the start of each run of a long-lived daemon."""
+    if _cache is not None:
+        _cache.stats.reset()
+
+
+def dump_cache_stats(stats_file: Optional[str] = None) -> None:
+    """
+    Print this process's cache counters and, if a stats file is given (or the
+    API_CACHE_STATS_FILE environment variable is set), append them to it as one
+    JSON line so the orchestrator can aggregate them across step processes.
+    """
+    if _cache is None:
+        return
+    snapshot = _cache.stats.snapshot()
+    if not snapshot:
+        return
+    print(format_cache_stats(snapshot))
+    stats_file = stats_file or os.getenv("API_CACHE_STATS_FILE")
+    if not stats_file:
+        return
+    try:
+        with open(stats_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'pid': os.getpid(), 'timestamp': time.time(), 'stats': snapshot}) + "\n")
+    except OSError as e:
+        print(f"[CACHE ERROR] Could not write cache stats: {e}")
+
+
+def load_cache_stats(stats_file: str) -> Dict[str, Dict[str, float]]:
+    """Read and merge every snapshot appended to ``stats_file`` by dump_cache_stats."""
+    if not os.path.exists(stats_file):
+        return {}
+    snapshots = []
+    with open(stats_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                snapshots.append(json.loads(line)['stats'])
+    return merge_cache_stats(snapshots)
+
+
 def get_rate_limiter() -> RateLimiter:
     """Get or create global rate limiter instance."""
     global _rate_limiter
     if _rate_limiter is None:
-        _rate_limiter = RateLimiter(min_delay=2.0, max_delay=30.0)  # 2-30s delays
+        # Shared across processes so every step (and every pipeline run on the
+        # host) draws from one budget. Set API_LIMITER_STATE=local to opt out.
+        state_path = os.getenv("API_LIMITER_STATE", os.path.join(".api_cache", "limiter.sqlite3"))
+        state_store = LocalLimiterState() if state_path == "local" else SharedLimiterState(state_path)
+        _rate_limiter = RateLimiter(min_delay=2.0, max_delay=30.0, state_store=state_store)  # 2-30s delays
     return _rate_limiter
+
+
+def get_circuit_breaker() -> CircuitBreaker:
+    """Get or create the global circuit breaker (shares the rate limiter's state store)."""
+    global _circuit_breaker
+    if _circuit_breaker is None:
+        _circuit_breaker = CircuitBreaker(state_store=get_rate_limiter().state_store)
+    return _circuit_breaker
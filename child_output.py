@@ -0,0 +1,219 @@
+"""
+Streaming runner for step subprocesses.
+
+Instead of buffering a child's whole stdout/stderr with ``capture_output``,
+output is read incrementally by one thread per pipe, split into lines on
+``\\n`` *and* ``\\r`` (tqdm/moviepy and ffmpeg redraw progress bars with
+carriage returns), and handed to the caller through a bounded queue, so
+memory stays flat no matter how much a step prints. On the consuming side:
+
+- progress lines (tqdm bars, ffmpeg ``frame=... time=...`` status, a
+  percentage ending a short status line) become structured
+  ProgressEvents, logged at most every few seconds or percent;
+- runs of identical lines are collapsed into one "repeated N times" line;
+- overlong lines (e.g. raw 429 payloads) are truncated;
+- if the child prints nothing for ``stall_after`` seconds a [STALL]
+  warning is logged, so a hung step is visible while it happens.
+
+Only the last ``tail_lines`` lines of each stream are retained, for the
+failure report.
+"""
+
+import json
+import logging
+import queue
+import re
+import subprocess
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Deque, Dict, List, Optional
+
+_LINE_BREAK = re.compile(rb"[\r\n]")
+# tqdm (used by moviepy and whisperx): "t:  45%|#####     | 650/1440 [00:12<00:14, 55.0it/s]"
+_TQDM = re.compile(r"(\d{1,3})%\|.*?\|\s*(\d+)/(\d+)")
+# ffmpeg status line: "frame=  123 fps= 30 q=28.0 size= 512kB time=00:00:04.10 bitrate=..."
+_FFMPEG = re.compile(r"frame=\s*(\d+).*?time=(\d+):(\d+):(\d+(?:\.\d+)?)")
+# Bare status lines ending in a percentage: "Downloading model: 42%"
+_PERCENT = re.compile(r"^.{0,60}?(?<![\d.])(\d{1,3}(?:\.\d+)?)\s?%\s*$")
+
+
+@dataclass
+class ProgressEvent:
+    step: str
+    stream: str
+    percent: Optional[float] = None
+    current: Optional[int] = None
+    total: Optional[int] = None
+    media_seconds: Optional[float] = None
+    elapsed: float = 0.0
+
+
+def parse_progress(line: str) -> Optional[Dict[str, float]]:
+    """Extract progress fields from one output line, or None if it is not a progress line."""
+    match = _TQDM.search(line)
+    if match:
+        return {"percent": float(match.group(1)), "current": int(match.group(2)), "total": int(match.group(3))}
+    match = _FFMPEG.search(line)
+    if match:
+        hours, minutes, seconds = int(match.group(2)), int(match.group(3)), float(match.group(4))
+        return {"current": int(match.group(1)), "media_seconds": hours * 3600 + minutes * 60 + seconds}
+    match = _PERCENT.search(line)
+    if match and float(match.group(1)) <= 100:
+        return {"percent": float(match.group(1))}
+    return None
+
+
+@dataclass
+class StreamResult:
+    """Outcome of a streamed child process; ``stdout``/``stderr`` hold only the tails."""
+    returncode: int
+    stdout: str
+    stderr: str
+    lines: int = 0
+    suppressed: int = 0
+    progress: List[ProgressEvent] = field(default_factory=list)
+
+
+def _pump(pipe, stream: str, events: "queue.Queue", max_line_bytes: int) -> None:
+    pending = b""
+    try:
+        while True:
+            chunk = pipe.read1(65536) if hasattr(pipe, "read1") else pipe.read(65536)
+            if not chunk:
+                break
+            pending += chunk
+            parts = _LINE_BREAK.split(pending)
+            pending = parts.pop()
+            for part in parts:
+                if part.strip():
+                    events.put((stream, part))
+            if len(pending) > max_line_bytes:
+                events.put((stream, pending))
+                pending = b""
+        if pending.strip():
+            events.put((stream, pending))
+    finally:
+        pipe.close()
+        events.put((stream, None))
+
+
+class _LineFilter:
+    """Collapses consecutive duplicate lines and throttles progress logging."""
+
+    def __init__(self, step: str, logger: logging.Logger, progress_interval: float, progress_step: float):
+        self.step = step
+        self.logger = logger
+        self.progress_interval = progress_interval
+        self.progress_step = progress_step
+        self.last_line: Dict[str, Optional[str]] = {}
+        self.repeats: Dict[str, int] = {}
+        self.last_progress_log = 0.0
+        self.last_progress_percent: Optional[float] = None
+        self.suppressed = 0
+
+    def _flush_repeats(self, stream: str) -> None:
+        if self.repeats.get(stream):
+            self.logger.info(f"[{self.step}] (previous line repeated {self.repeats[stream]} more times)")
+            self.repeats[stream] = 0
+
+    def line(self, stream: str, text: str) -> None:
+        if text == self.last_line.get(stream):
+            self.repeats[stream] = self.repeats.get(stream, 0) + 1
+            self.suppressed += 1
+            return
+        self._flush_repeats(stream)
+        self.last_line[stream] = text
+        self.logger.info(f"[{self.step}] {text}")
+
+    def progress(self, event: ProgressEvent) -> None:
+        now = time.monotonic()
+        moved = (event.percent is not None and (self.last_progress_percent is None
+                                                or abs(event.percent - self.last_progress_percent) >= self.progress_step
+                                                or event.percent >= 100))
+        if not moved and now - self.last_progress_log < self.progress_interval:
+            self.suppressed += 1
+            return
+        self.last_progress_log = now
+        if event.percent is not None:
+            self.last_progress_percent = event.percent
+        fields = {k: v for k, v in asdict(event).items() if v is not None}
+        self.logger.info(f"[PROGRESS] {json.dumps(fields)}")
+
+    def close(self) -> None:
+        for stream in list(self.repeats):
+            self._flush_repeats(stream)
+
+
+def stream_process(command: List[str], step: str, env: Optional[Dict[str, str]] = None,
+                   logger: Optional[logging.Logger] = None, stall_after: float = 120.0,
+                   tail_lines: int = 200, max_line_chars: int = 2000, progress_interval: float = 5.0,
+                   progress_step: float = 10.0, queue_size: int = 1000) -> StreamResult:
+    """
+    Run ``command``, streaming and filtering its output as described in the
+    module docstring, and return a StreamResult once it exits.
+    """
+    logger = logger or logging.getLogger(__name__)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    events: "queue.Queue" = queue.Queue(maxsize=queue_size)
+    max_line_bytes = max_line_chars * 4
+    readers = [
+        threading.Thread(target=_pump, args=(process.stdout, "stdout", events, max_line_bytes), daemon=True),
+        threading.Thread(target=_pump, args=(process.stderr, "stderr", events, max_line_bytes), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+
+    tails: Dict[str, Deque[str]] = {"stdout": deque(maxlen=tail_lines), "stderr": deque(maxlen=tail_lines)}
+    line_filter = _LineFilter(step, logger, progress_interval, progress_step)
+    progress: Deque[ProgressEvent] = deque(maxlen=tail_lines)
+    started = time.monotonic()
+    last_output = started
+    next_stall_warning = started + stall_after
+    open_streams = 2
+    lines = 0
+
+    while open_streams:
+        try:
+            stream, raw = events.get(timeout=1.0)
+        except queue.Empty:
+            now = time.monotonic()
+            if now >= next_stall_warning:
+                logger.warning(f"[STALL] {step} has produced no output for {now - last_output:.0f}s "
+                               f"(pid {process.pid}, still running: {process.poll() is None})")
+                next_stall_warning = now + stall_after
+            continue
+        if raw is None:
+            open_streams -= 1
+            continue
+
+        now = time.monotonic()
+        last_output = now
+        next_stall_warning = now + stall_after
+        lines += 1
+        text = raw.decode("utf-8", errors="replace").rstrip()
+        if len(text) > max_line_chars:
+            text = text[:max_line_chars] + f"... [{len(text) - max_line_chars} chars truncated]"
+        tails[stream].append(text)
+
+        parsed = parse_progress(text)
+        if parsed is not None:
+            event = ProgressEvent(step=step, stream=stream, elapsed=round(now - started, 1), **parsed)
+            progress.append(event)
+            line_filter.progress(event)
+        else:
+            line_filter.line(stream, text)
+
+    line_filter.close()
+    returncode = process.wait()
+    for reader in readers:
+        reader.join()
+    return StreamResult(
+        returncode=returncode,
+        stdout="\n".join(tails["stdout"]),
+        stderr="\n".join(tails["stderr"]),
+        lines=lines,
+        suppressed=line_filter.suppressed,
+        progress=list(progress),
+    )
@@ -1,13 +1,31 @@
-import subprocess
 import sys
-import json
 import time
 import os
 import logging
+import argparse
+import importlib
+import traceback
+import tempfile
 from dotenv import load_dotenv
 import random
 import datetime
 
+import perf_spans
+from step_failures import (EXIT_CODES, PERMANENT, QUOTA, RESULT_FILE_ENV, StepFailure, decide,
+                           read_result_file)
+from child_output import stream_process
+from api_utils import (load_cache_stats, merge_cache_stats, current_cache_stats, format_cache_stats,
+                       get_circuit_breaker, reset_cache_stats)
+from pipeline_types import NewsPayload, StepError
+from pipeline_dag import DagScheduler, Stage, StageFailed, format_critical_path
+from stage_cache import DEFAULT_STAGE_CACHE_DIR, StageMemo, StageStore
+from job_queue import DEFAULT_QUEUE_DB, JobQueue
+from pipeline_daemon import DEFAULT_SCHEDULE, PIPELINE_QUEUE, CronSchedule, PipelineDaemon
+from stage_workers import (DEFAULT_TASK_QUEUE, STAGE_KINDS, ArtifactCodec, KeyRef, StageRunner, StageWorker,
+                           open_task_queue)
+from story_index import get_story_index
+from workspace import DEFAULT_WORKSPACE_ROOT, RunWorkspace, prune_workspaces, tmpfs_scratch_root
+
 load_dotenv()
 
 # --- LOGGING SETUP ---
@@ -21,54 +39,170 @@ logging.basicConfig(
     ]
 )
 
-def run_with_retries(command, step_name, max_retries=3, delay=5):
-    """Runs a command with a retry mechanism."""
-    for attempt in range(max_retries):
+# Every step process appends its API cache counters here (see api_utils.dump_cache_stats).
+CACHE_STATS_FILE = "cache_stats.jsonl"
+
+def open_breakers_for(apis):
+    """Return the open circuit breakers (see api_utils.CircuitBreaker) for the given API families."""
+    return {
+        key: state for key, state in get_circuit_breaker().open_breakers().items()
+        if key.split(":")[0] in apis
+    }
+
+def stop_if_breaker_open(step_name, breaker_apis):
+    """Exit instead of retrying when an API the step depends on has hit a hard quota."""
+    open_breakers = open_breakers_for(breaker_apis)
+    if open_breakers:
+        for key, state in open_breakers.items():
+            reset_at = datetime.datetime.fromtimestamp(state["open_until"]).strftime("%Y-%m-%d %H:%M:%S")
+            logging.error(f"Circuit breaker {key} is open until {reset_at}; skipping retries for {step_name}.")
+        sys.exit(EXIT_CODES[QUOTA])
+
+def next_action(failure, step_name, attempt, max_retries, delay, breaker_apis, can_failover):
+    """
+    Apply the failure-class retry policy (see step_failures.decide) and log
+    the decision. Exits the pipeline with the failure's exit code on abort.
+    """
+    logging.warning(f"--- {step_name} failed on attempt {attempt + 1} [{failure.failure_class}]: {failure.message} ---")
+    if failure.failure_class == QUOTA:
+        stop_if_breaker_open(step_name, breaker_apis)
+
+    decision = decide(failure, attempt, max_retries, base_delay=delay, can_failover=can_failover)
+    if decision.action == "abort":
+        if failure.failure_class == PERMANENT:
+            logging.error(f"{step_name} failed permanently; not retrying. Exiting pipeline.")
+        else:
+            logging.error(f"Giving up on {step_name} after {attempt + 1} attempts. Exiting pipeline.")
+        sys.exit(EXIT_CODES[failure.failure_class])
+    if decision.action == "failover":
+        logging.info(f"{step_name} hit a quota limit; failing over to the alternate credentials.")
+    elif decision.action == "retry":
+        logging.info(f"Retrying {step_name} in {decision.delay:.0f} seconds...")
+        perf_spans.record("sleep_s", decision.delay)
+        time.sleep(decision.delay)
+    return decision
+
+def run_with_retries(command, step_name, max_retries=3, delay=5, breaker_apis=(), failovers=()):
+    """
+    Runs a command with a retry mechanism.
+    The child's output is streamed into the log line by line as it runs (see
+    child_output.stream_process); only the last lines are kept in memory for
+    the failure report.
+    The step reports why it failed through its exit code and result file
+    (see step_failures): permanent failures abort at once, quota failures
+    back off or switch to the next command in ``failovers`` (the same step
+    with alternate credentials), transient ones retry with backoff, and
+    partial output is accepted. Quota failures while a circuit breaker for
+    one of ``breaker_apis`` is open abort as well.
+    """
+    failovers = list(failovers)
+    attempt = 0
+    # Every path out of the loop returns a result or exits via next_action.
+    while True:
         logging.info(f"--- Running {step_name}: Attempt {attempt + 1} of {max_retries} ---")
-        # Use utf-8 encoding for cross-platform compatibility
-        result = subprocess.run(command, capture_output=True, text=True, encoding='utf-8')
+        tracer = perf_spans.current_tracer()
+        env = tracer.child_env() if tracer else dict(os.environ)
+        fd, result_file = tempfile.mkstemp(prefix="step_result_", suffix=".json")
+        os.close(fd)
+        os.remove(result_file)
+        env[RESULT_FILE_ENV] = result_file
+        try:
+            result = stream_process(command, step_name.split(":")[0], env=env, logger=logging.getLogger())
+            failure = read_result_file(result_file, result.returncode) if result.returncode else None
+        finally:
+            if os.path.exists(result_file):
+                os.remove(result_file)
 
         if result.returncode == 0:
-            logging.info(f"--- {step_name} completed successfully. ---")
-            logging.info(result.stdout)
+            logging.info(f"--- {step_name} completed successfully "
+                         f"({result.lines} output lines, {result.suppressed} repeats/progress updates collapsed). ---")
+            return result
+
+        logging.warning(f"Last stderr lines:\n{result.stderr}")
+        decision = next_action(failure, step_name, attempt, max_retries, delay, breaker_apis, bool(failovers))
+        if decision.action == "accept":
+            logging.warning(f"--- {step_name} produced partial output; continuing with it. ---")
             return result
+        if decision.action == "failover":
+            # The alternate gets its own attempt budget.
+            command, attempt = failovers.pop(0), 0
+        else:
+            attempt += 1
 
-        logging.warning(f"--- {step_name} failed on attempt {attempt + 1}. Return code: {result.returncode} ---")
-        logging.warning(f"Stderr: {result.stderr}")
+def run_inprocess_with_retries(func, step_name, max_retries=3, delay=5, breaker_apis=(), failovers=()):
+    """
+    In-process counterpart of run_with_retries: calls ``func()`` (a step
+    module's ``run`` entry point) directly, so imported modules and loaded
+    models stay warm across steps and retries. Exceptions are classified
+    with step_failures.classify_exception; ``failovers`` are alternate
+    callables tried on quota failures.
+    """
+    failovers = list(failovers)
+    attempt = 0
+    while True:
+        logging.info(f"--- Running {step_name} (in-process): Attempt {attempt + 1} of {max_retries} ---")
+        try:
+            result = func()
+            if getattr(result, "partial", False):
+                logging.warning(f"--- {step_name} produced partial output; continuing with it. ---")
+            else:
+                logging.info(f"--- {step_name} completed successfully. ---")
+            return result
+        except Exception as e:
+            logging.debug(traceback.format_exc())
+            failure = StepFailure.from_exception(e)
 
-        if attempt < max_retries - 1:
-            logging.info(f"Retrying in {delay} seconds...")
-            time.sleep(delay)
+        decision = next_action(failure, step_name, attempt, max_retries, delay, breaker_apis, bool(failovers))
+        if decision.action == "failover":
+            func, attempt = failovers.pop(0), 0
         else:
-            logging.error(f"All {max_retries} attempts failed for {step_name}. Exiting pipeline.")
-            sys.exit(1)
+            attempt += 1
 
-def run_step1(gemini_api_key, newsdata_api_key, output_file="news_output.json"):
+def load_step(module_name):
+    """Import a step module once; later calls reuse the already-imported module."""
+    return importlib.import_module(module_name)
+
+def run_step1(gemini_api_key, newsdata_api_key, output_file="news_output.json", mode="inprocess"):
     step_name = "STEP 1: Generating Trending News"
+    if mode == "inprocess":
+        step1 = load_step("step1_news_gen")
+        return run_inprocess_with_retries(
+            lambda: step1.run(gemini_api_key, newsdata_api_key, output_file=output_file),
+            step_name, breaker_apis=("gemini",)
+        )
+
     command = [
         sys.executable, "step1_news_gen.py",
         "--gemini_api_key", gemini_api_key,
         "--newsdata_api_key", newsdata_api_key,
         "--output", output_file
     ]
-    run_with_retries(command, step_name)
+    run_with_retries(command, step_name, breaker_apis=("gemini",))
 
     if not os.path.exists(output_file):
         logging.error(f"Error: {output_file} not found after {step_name}")
         sys.exit(1)
-    with open(output_file, "r", encoding="utf-8") as f:
-        news_info = json.load(f)
-    return news_info
+    return NewsPayload.load(output_file)
 
-def run_step2(gemini_api_key, imagerouter_api_key, news_file="news_output.json", save_folder="generated_images"):
+def run_step2(gemini_api_key, imagerouter_api_key, news, news_file="news_output.json", save_folder="generated_images", mode="inprocess"):
     step_name = "STEP 2: Generating Images"
+    if mode == "inprocess":
+        step2 = load_step("step2_image_gen")
+        result = run_inprocess_with_retries(
+            lambda: step2.run(gemini_api_key, imagerouter_api_key, news, save_folder=save_folder),
+            step_name, breaker_apis=("gemini",)
+        )
+        logging.info(f"All images generated and saved to '{result.folder}'.")
+        return result.folder
+
     command = [
         sys.executable, "step2_image_gen.py",
         "--gemini_api_key", gemini_api_key,
         "--imagerouter_api_key", imagerouter_api_key,
-        "--news_file", news_file
+        "--news_file", news_file,
+        "--save_folder", save_folder
     ]
-    run_with_retries(command, step_name)
+    run_with_retries(command, step_name, breaker_apis=("gemini",))
 
     if not os.path.exists(save_folder) or not os.listdir(save_folder):
         logging.error(f"Error: No images found in '{save_folder}' after {step_name}")
@@ -76,8 +210,16 @@ def run_step2(gemini_api_key, imagerouter_api_key, news_file="news_output.json",
     logging.info(f"All images generated and saved to '{save_folder}'.")
     return save_folder
 
-def run_step3(image_folder, output_video="temp_video_without_audio.mp4", video_duration=60, segment_duration=10):
+def run_step3(image_folder, output_video="temp_video_without_audio.mp4", video_duration=60, segment_duration=10, mode="inprocess"):
     step_name = "STEP 3: Creating Video from Images"
+    if mode == "inprocess":
+        step3 = load_step("step3_video_gen")
+        result = run_inprocess_with_retries(
+            lambda: step3.run(image_folder, output_video, video_duration, segment_duration), step_name
+        )
+        logging.info(f"Video created and saved as '{result.path}'.")
+        return result.path
+
     command = [
         sys.executable, "step3_video_gen.py",
         "--image_folder", image_folder,
@@ -93,39 +235,107 @@ def run_step3(image_folder, output_video="temp_video_without_audio.mp4", video_d
     logging.info(f"Video created and saved as '{output_video}'.")
     return output_video
 
-def run_step4(input_video, description, output_video, elevenlabs_api_key):
-    step_name = "STEP 4: Adding Captions and Speech"
-    voices = {
-        # "Raju": "3gsg3cxXyFLcGIfNbM6C",  #first 3 voices are custom voices.
-        # "Akash": "gkYRuS6pUw0UJKhibzSx",
-        # "Kushi": "t0WUmKMVeMLJiTULHrF7",
-        "Aria": "9BWtsMINqrJLrRacOk9x",
-        "Charlie": "IKne3meq5aSn9XLyUdCD",
-        "Laura": "FGY2WhTYpPnrIDTdsKH5",
-        "Liam": "TX3LPaxmHKxFdv7VOQHJ",
-        "Jassica": "cgSgspJ2msm6clMCkdW9"
-    }
-    voice_name = random.choice(list(voices.keys()))
-    voice_id = voices[voice_name]
+VOICES = {
+    # "Raju": "3gsg3cxXyFLcGIfNbM6C",  #first 3 voices are custom voices.
+    # "Akash": "gkYRuS6pUw0UJKhibzSx",
+    # "Kushi": "t0WUmKMVeMLJiTULHrF7",
+    "Aria": "9BWtsMINqrJLrRacOk9x",
+    "Charlie": "IKne3meq5aSn9XLyUdCD",
+    "Laura": "FGY2WhTYpPnrIDTdsKH5",
+    "Liam": "TX3LPaxmHKxFdv7VOQHJ",
+    "Jassica": "cgSgspJ2msm6clMCkdW9"
+}
+
+def pick_voice():
+    voice_name = random.choice(list(VOICES.keys()))
+    voice_id = VOICES[voice_name]
     logging.info("Selected voice: %s (ID: %s)", voice_name, voice_id)
-    
-    command = [
+    return voice_id
+
+def run_step4(input_video, description, output_video, elevenlabs_api_key, voice_id, mode="inprocess",
+              fallback_api_key=None, work_dir=None):
+    step_name = "STEP 4: Adding Captions and Speech"
+    api_keys = [elevenlabs_api_key] + ([fallback_api_key] if fallback_api_key else [])
+
+    if mode == "inprocess":
+        step4 = load_step("step4_audio_caption")
+        calls = [lambda key=key: step4.run(input_video, description, output_video, key, voice_id, work_dir=work_dir)
+                 for key in api_keys]
+        result = run_inprocess_with_retries(calls[0], step_name, failovers=calls[1:])
+        return result.path
+
+    commands = [[
         sys.executable, "step4_audio_caption.py",
         "--video", input_video,
         "--text", description,
         "--output", output_video,
-        "--api_key", elevenlabs_api_key,
+        "--api_key", key,
         "--voice_id", voice_id
-    ]
-    run_with_retries(command, step_name)
+    ] + (["--work_dir", work_dir] if work_dir else []) for key in api_keys]
+    run_with_retries(commands[0], step_name, failovers=commands[1:])
 
     if not os.path.exists(output_video):
         logging.error("Error: %s not found after %s", output_video, step_name)
         sys.exit(2)
     return output_video
 
-def run_step5(final_video, title, description, tags, client_secret="client_secret.json"):
+# --- Step 4 sub-stages (in-process DAG only) ---
+# Speech synthesis and caption alignment only need step 1's description, so
+# they run alongside image generation and slideshow rendering.
+
+def run_tts(description, elevenlabs_api_key, voice_id, audio_path, fallback_api_key=None):
+    step4 = load_step("step4_audio_caption")
+    api_keys = [elevenlabs_api_key] + ([fallback_api_key] if fallback_api_key else [])
+    calls = [lambda key=key: step4.text_to_speech_elevenlabs(description, audio_path, key, voice_id)
+             for key in api_keys]
+    run_inprocess_with_retries(calls[0], "STEP 4a: Synthesizing Speech", failovers=calls[1:])
+    return audio_path
+
+def run_alignment(audio_path, srt_path):
+    step4 = load_step("step4_audio_caption")
+    run_inprocess_with_retries(
+        lambda: step4.generate_srt_with_whisperx(audio_path, srt_path),
+        "STEP 4b: Aligning Captions"
+    )
+    return srt_path
+
+def run_mux(video_path, audio_path, output_path):
+    step4 = load_step("step4_audio_caption")
+    run_inprocess_with_retries(
+        lambda: step4.add_audio_to_video(video_path, audio_path, output_path),
+        "STEP 4c: Adding Speech to Video"
+    )
+    return output_path
+
+def run_burn_captions(video_path, srt_path, output_path):
+    step4 = load_step("step4_audio_caption")
+    run_inprocess_with_retries(
+        lambda: step4.burn_captions_ffmpeg(video_path, srt_path, output_path),
+        "STEP 4d: Burning Captions"
+    )
+    return output_path
+
+def run_ending(video_path, output_video):
+    step4 = load_step("step4_audio_caption")
+    run_inprocess_with_retries(
+        lambda: step4.append_ending_image_to_video(video_path, step4.DEFAULT_ENDING_IMAGE, output_video, duration=2.5),
+        "STEP 4e: Appending Ending Image"
+    )
+    if not os.path.exists(output_video):
+        logging.error("Error: %s not found after STEP 4", output_video)
+        sys.exit(2)
+    return output_video
+
+def run_step5(final_video, title, description, tags, client_secret="client_secret.json", mode="inprocess"):
     step_name = "STEP 5: Uploading to YouTube"
+    if mode == "inprocess":
+        step5 = load_step("step5_final_upload")
+        result = run_inprocess_with_retries(
+            lambda: step5.run(final_video, title, description, tags, category="22", privacy="public"), step_name
+        )
+        logging.info("YouTube upload process completed.")
+        return result.video_id
+
     tags_str = ",".join(tags)
     command = [
         sys.executable, "step5_final_upload.py",
@@ -140,7 +350,352 @@ def run_step5(final_video, title, description, tags, client_secret="client_secre
     run_with_retries(command, step_name)
     logging.info("YouTube upload process completed.")
 
-def main():
+def run_image_prompt(news, gemini_api_key):
+    step2 = load_step("step2_image_gen")
+    return run_inprocess_with_retries(
+        lambda: step2.image_prompt_for(news, gemini_api_key), "STEP 2a: Building Image Prompt", breaker_apis=("gemini",)
+    )
+
+def run_images(prompt, imagerouter_api_key, save_folder="generated_images"):
+    step2 = load_step("step2_image_gen")
+    result = run_inprocess_with_retries(
+        lambda: step2.generate_images(prompt, imagerouter_api_key, save_folder), "STEP 2b: Generating Images"
+    )
+    logging.info(f"All images generated and saved to '{result.folder}'.")
+    return result.folder
+
+def story_paths(workspace, index=None):
+    """
+    Paths used by one story's stages inside the run's workspace (see
+    workspace.RunWorkspace): the news JSON and final video are kept, the
+    intermediates go to scratch. Batch stories get their own prefixed copies
+    so they can run side by side.
+    """
+    prefix = "" if index is None else f"story{index}_"
+    scratch = workspace.scratch if index is None else workspace.scratch_path(f"story{index}")
+    os.makedirs(scratch, exist_ok=True)
+    return {
+        "scratch": scratch,
+        "news_json": workspace.path(f"{prefix}news_output.json"),
+        "images": os.path.join(scratch, "generated_images"),
+        "slideshow": os.path.join(scratch, "temp_video_without_audio.mp4"),
+        "audio": os.path.join(scratch, "temp_speech.mp3"),
+        "srt": os.path.join(scratch, "temp_captions.srt"),
+        "with_speech": os.path.join(scratch, "temp_video_with_speech.mp4"),
+        "no_ending": os.path.join(scratch, "final_no_ending.mp4"),
+        "final": workspace.path("final_output.mp4" if index is None else f"final_output_{index}.mp4"),
+    }
+
+def run_stories(gemini_api_key, newsdata_api_key, count):
+    step1 = load_step("step1_news_gen")
+    return run_inprocess_with_retries(
+        lambda: step1.run_batch(gemini_api_key, newsdata_api_key, count),
+        "STEP 1: Generating Trending News (batch)", breaker_apis=("gemini",)
+    )
+
+def pick_story(stories, index, news_json):
+    if index >= len(stories):
+        raise StepError(f"Only {len(stories)} usable stories were fetched; story {index + 1} has none.")
+    news = stories[index]
+    news.save(news_json)
+    return news
+
+def record_covered_story(news, video_id):
+    """
+    Add an uploaded story to the story index (see story_index) so later runs
+    skip it. Only called once step 5 has succeeded, so a story whose video
+    never got published stays eligible.
+    """
+    source = news.source or {"title": news.title, "description": news.description}
+    get_story_index().add(source["title"], source.get("description", ""), url=source.get("url"))
+    return video_id
+
+# Stage runners by name, so stage workers on other machines can run them (see stage_workers).
+STAGE_OPS = {
+    "step1": run_step1,
+    "step2": run_step2,
+    "step3": run_step3,
+    "step4": run_step4,
+    "step5": run_step5,
+    "image_prompt": run_image_prompt,
+    "images": run_images,
+    "tts": run_tts,
+    "align": run_alignment,
+    "mux": run_mux,
+    "captions": run_burn_captions,
+    "ending": run_ending,
+    "stories": run_stories,
+}
+
+def build_story_stages(mode, keys, voice_id, paths, memo, news_stage, prefix="", runner=None):
+    """
+    Declare one story's stages as a dependency graph (see pipeline_dag),
+    starting from the already-declared ``news_stage``. In-process mode
+    splits steps 2 and 4 so TTS runs alongside image generation and caption
+    alignment alongside slideshow rendering:
+
+        news -> prompt -> images -> slideshow -> mux -> captions -> ending -> upload
+        news -> tts ----------------------------^          ^
+                tts -> align ------------------------------+
+
+    Subprocess mode keeps each step script whole, so its graph is a chain.
+    A successful upload records the story as covered (record_covered_story).
+    Every stage is memoized in ``memo`` (see stage_cache) under a hash of
+    its parameters and inputs. ``prefix`` namespaces the stage names so
+    several stories can share one graph. Stage runners are called through
+    ``runner`` (a stage_workers.StageRunner), which may hand them to
+    remote workers.
+    """
+    call = (runner or StageRunner(STAGE_OPS)).call
+    n = lambda name: prefix + name
+    as_file = lambda output: [output]
+    news = news_stage
+
+    stages = []
+    if mode == "inprocess":
+        stages += [
+            memo.wrap(Stage(n("prompt"), lambda i: call("image_prompt", i[news], keys["gemini"], kind="api"),
+                            deps=(news,), kind="api")),
+            memo.wrap(Stage(n("images"), lambda i: call("images", i[n("prompt")], keys["imagerouter"], paths["images"],
+                                                        kind="api"),
+                            deps=(n("prompt"),), kind="api"),
+                      params={"num_images": 5}, files=as_file),
+        ]
+    else:
+        stages.append(
+            memo.wrap(Stage(n("images"), lambda i: call("step2", keys["gemini"], keys["imagerouter"], i[news],
+                                                        news_file=paths["news_json"], save_folder=paths["images"],
+                                                        mode=mode, kind="api"),
+                            deps=(news,), kind="api"),
+                      params={"num_images": 5}, files=as_file)
+        )
+    stages.append(
+        memo.wrap(Stage(n("slideshow"), lambda i: call("step3", image_folder=i[n("images")],
+                                                       output_video=paths["slideshow"], mode=mode),
+                        deps=(n("images"),)),
+                  params={"video_duration": 60, "segment_duration": 10}, files=as_file)
+    )
+    if mode == "inprocess":
+        stages += [
+            memo.wrap(Stage(n("tts"), lambda i: call("tts", i[news].description, keys["elevenlabs"], voice_id, paths["audio"],
+                                                     fallback_api_key=keys.get("elevenlabs_fallback"), kind="api"),
+                            deps=(news,), kind="api"),
+                      params={"voice_id": voice_id}, files=as_file),
+            memo.wrap(Stage(n("align"), lambda i: call("align", i[n("tts")], paths["srt"]), deps=(n("tts"),)),
+                      files=as_file),
+            memo.wrap(Stage(n("mux"), lambda i: call("mux", i[n("slideshow")], i[n("tts")], paths["with_speech"]),
+                            deps=(n("slideshow"), n("tts"))),
+                      files=as_file),
+            memo.wrap(Stage(n("captions"), lambda i: call("captions", i[n("mux")], i[n("align")], paths["no_ending"]),
+                            deps=(n("mux"), n("align"))),
+                      files=as_file),
+            memo.wrap(Stage(n("ending"), lambda i: call("ending", i[n("captions")], paths["final"]), deps=(n("captions"),)),
+                      files=as_file),
+        ]
+        narrated = n("ending")
+    else:
+        stages.append(
+            memo.wrap(Stage(n("narration"), lambda i: call("step4", i[n("slideshow")], i[news].description, paths["final"],
+                                                           keys["elevenlabs"], voice_id, mode=mode,
+                                                           fallback_api_key=keys.get("elevenlabs_fallback"),
+                                                           work_dir=paths["scratch"], kind="api"),
+                            deps=(n("slideshow"), news), kind="api"),
+                      params={"voice_id": voice_id}, files=as_file)
+        )
+        narrated = n("narration")
+    stages.append(
+        memo.wrap(Stage(n("upload"), lambda i: record_covered_story(
+                            i[news], call("step5", i[narrated], i[news].title, i[news].description, i[news].tags,
+                                          mode=mode, kind="api")),
+                        deps=(narrated, news), kind="api"),
+                  params={"category": "22", "privacy": "public"})
+    )
+    return stages
+
+def build_stages(mode, keys, run_params, memo, runner=None):
+    """The single-story graph: step 1 picks the top-ranked story, then build_story_stages."""
+    call = (runner or StageRunner(STAGE_OPS)).call
+    paths = story_paths(RunWorkspace.from_dict(run_params["workspace"]))
+    news_stage = memo.wrap(
+        Stage("news", lambda i: call("step1", keys["gemini"], keys["newsdata"], output_file=paths["news_json"],
+                                     mode=mode, kind="api"),
+              kind="api"),
+        params={"seed": run_params["seed"]},
+        files=lambda news: [paths["news_json"]], encode=NewsPayload.to_dict, decode=NewsPayload.from_dict,
+    )
+    return [news_stage] + build_story_stages(mode, keys, run_params["voice_ids"][0], paths, memo, "news", runner=runner)
+
+def build_batch_stages(keys, run_params, memo, runner=None):
+    """
+    Batch graph: one step-1 stage fetches the news list and writes the top N
+    story packages, then every story gets its own prefixed copy of the
+    single-story stages. All of them share one scheduler, so stages of
+    different stories interleave within the per-kind concurrency limits.
+    """
+    call = (runner or StageRunner(STAGE_OPS)).call
+    voice_ids = run_params["voice_ids"]
+    workspace = RunWorkspace.from_dict(run_params["workspace"])
+    stages = [
+        memo.wrap(Stage("stories", lambda i: call("stories", keys["gemini"], keys["newsdata"], len(voice_ids), kind="api"),
+                        kind="api"),
+                  params={"seed": run_params["seed"], "count": len(voice_ids)},
+                  encode=lambda stories: [news.to_dict() for news in stories],
+                  decode=lambda data: [NewsPayload.from_dict(d) for d in data]),
+    ]
+    for index, voice_id in enumerate(voice_ids):
+        paths = story_paths(workspace, index + 1)
+        prefix = f"story{index + 1}."
+        stages.append(
+            memo.wrap(Stage(prefix + "news", lambda i, index=index, paths=paths: pick_story(i["stories"], index, paths["news_json"]),
+                            deps=("stories",)),
+                      files=lambda news, paths=paths: [paths["news_json"]],
+                      encode=NewsPayload.to_dict, decode=NewsPayload.from_dict)
+        )
+        stages += build_story_stages("inprocess", keys, voice_id, paths, memo, prefix + "news", prefix=prefix,
+                                     runner=runner)
+    return stages
+
+def resolve_run_params(store, mode, resume, batch=1, new_workspace=None, run_key=None):
+    """
+    Parameters that are chosen per run rather than derived from inputs: the
+    news seed (a fresh run always fetches fresh news), the narration voice
+    of each story and the run's workspace (made by ``new_workspace()``).
+    --resume reuses the previous run's values so its stage keys match again
+    and stored files are restored to the same paths. With ``run_key`` (the
+    daemon passes its job ID) the values are saved and resumed per key, so a
+    retried job never picks up another job's run.
+    """
+    previous = store.load_run_state(run_key) if resume else None
+    if (previous and previous.get("mode") == mode and len(previous.get("voice_ids", [])) == batch
+            and "workspace" in previous):
+        logging.info(f"Resuming run started at {previous['seed']} with voices {', '.join(previous['voice_ids'])}.")
+        RunWorkspace.from_dict(previous["workspace"]).ensure()
+        return previous
+    if resume:
+        logging.warning("--resume given but no previous run with the same mode and batch size was recorded; starting fresh.")
+    params = {
+        "seed": datetime.datetime.now().isoformat(timespec="seconds"),
+        "voice_ids": [pick_voice() for _ in range(batch)],
+        "mode": mode,
+        "workspace": new_workspace().to_dict(),
+    }
+    store.save_run_state(params, run_key)
+    return params
+
+def add_run_arguments(parser):
+    parser.add_argument("--mode", choices=["inprocess", "subprocess"], default="inprocess",
+                        help="inprocess (default) calls each step's run() directly and keeps modules/models warm; "
+                             "subprocess runs every step in a fresh interpreter for isolation")
+    parser.add_argument("--resume", action="store_true",
+                        help="Reuse stored outputs of the previous run for every stage whose inputs are unchanged")
+    parser.add_argument("--stage-cache-dir", default=DEFAULT_STAGE_CACHE_DIR,
+                        help=f"Where stage outputs are stored (default: {DEFAULT_STAGE_CACHE_DIR})")
+    parser.add_argument("--batch", type=int, default=1, metavar="N",
+                        help="Turn the top N stories into N videos in one process (in-process mode only)")
+    parser.add_argument("--max-workers", type=int, default=4,
+                        help="Maximum number of stages run concurrently (default: 4)")
+    parser.add_argument("--api-concurrency", type=int, default=3,
+                        help="Maximum concurrent API-bound stages: Gemini, ImageRouter, ElevenLabs, YouTube (default: 3)")
+    parser.add_argument("--cpu-concurrency", type=int, default=2,
+                        help="Maximum concurrent CPU-bound stages: rendering, alignment, ffmpeg (default: 2)")
+    parser.add_argument("--workspace-root", default=os.getenv("PIPELINE_WORKSPACE_ROOT", DEFAULT_WORKSPACE_ROOT),
+                        help=f"Directory holding one workspace per run (default: $PIPELINE_WORKSPACE_ROOT or {DEFAULT_WORKSPACE_ROOT})")
+    parser.add_argument("--tmpfs", action="store_true",
+                        help="Keep intermediate files (images, audio, temporary videos) on tmpfs (/dev/shm)")
+    parser.add_argument("--keep-runs", type=int, default=10,
+                        help="Number of most recent run workspaces to keep (default: 10)")
+    parser.add_argument("--task-queue", default=os.getenv("PIPELINE_TASK_QUEUE"),
+                        help="Run stages on stage workers fed from this task queue instead of in this process; "
+                             "--workspace-root must then be a directory shared with the workers "
+                             "(default: $PIPELINE_TASK_QUEUE, unset)")
+
+COMMANDS = ("run", "daemon", "worker", "report")
+
+def parse_args(argv=None):
+    """
+    ``final_pipeline.py [run] [options]`` runs the pipeline once (the
+    default, so plain ``python final_pipeline.py`` still works);
+    ``final_pipeline.py daemon [options]`` keeps running on a schedule.
+    """
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0] not in COMMANDS + ("-h", "--help"):
+        argv.insert(0, "run")
+
+    parser = argparse.ArgumentParser(description="Run the full news-to-YouTube-Shorts pipeline.")
+    commands = parser.add_subparsers(dest="command")
+    run_parser = commands.add_parser("run", help="Run the pipeline once (default)")
+    add_run_arguments(run_parser)
+
+    daemon_parser = commands.add_parser("daemon", help="Stay up and run the pipeline on a cron-like schedule")
+    add_run_arguments(daemon_parser)
+    daemon_parser.add_argument("--schedule", default=os.getenv("PIPELINE_SCHEDULE", DEFAULT_SCHEDULE),
+                               help=f"Five-field cron expression in local time (default: $PIPELINE_SCHEDULE or '{DEFAULT_SCHEDULE}')")
+    daemon_parser.add_argument("--queue-db", default=DEFAULT_QUEUE_DB,
+                               help=f"SQLite job queue file (default: {DEFAULT_QUEUE_DB})")
+    daemon_parser.add_argument("--max-attempts", type=int, default=3,
+                               help="Attempts per job before it is marked dead (default: 3)")
+    daemon_parser.add_argument("--run-now", action="store_true",
+                               help="Also enqueue one run immediately on startup")
+
+    worker_parser = commands.add_parser("worker", help="Run stage tasks dispatched by a coordinator's --task-queue")
+    worker_parser.add_argument("--task-queue", default=os.getenv("PIPELINE_TASK_QUEUE", DEFAULT_TASK_QUEUE),
+                               help=f"Task queue to lease stages from (default: $PIPELINE_TASK_QUEUE or {DEFAULT_TASK_QUEUE})")
+    worker_parser.add_argument("--kinds", default=",".join(STAGE_KINDS),
+                               help="Comma-separated stage kinds this worker runs: api, cpu (default: both)")
+    worker_parser.add_argument("--workspace-root", default=os.getenv("PIPELINE_WORKSPACE_ROOT", DEFAULT_WORKSPACE_ROOT),
+                               help="This node's mount of the shared workspace directory "
+                                    f"(default: $PIPELINE_WORKSPACE_ROOT or {DEFAULT_WORKSPACE_ROOT})")
+
+    report_parser = commands.add_parser("report", help="Summarise perf spans of one run or compare recent runs")
+    report_parser.add_argument("--file", default=perf_spans.DEFAULT_SPANS_FILE,
+                               help=f"Perf spans file (default: {perf_spans.DEFAULT_SPANS_FILE})")
+    report_parser.add_argument("--run", dest="run_id", help="Run ID to summarise (default: the latest run)")
+    report_parser.add_argument("--compare", type=int, metavar="N",
+                               help="Compare stage times of the N most recent runs instead")
+
+    args = parser.parse_args(argv)
+    if args.command == "report":
+        return args
+    if args.command == "worker":
+        args.kinds = [kind.strip() for kind in args.kinds.split(",") if kind.strip()]
+        if not args.kinds or set(args.kinds) - set(STAGE_KINDS):
+            parser.error(f"--kinds must list some of: {', '.join(STAGE_KINDS)}")
+        return args
+    if args.batch < 1:
+        parser.error("--batch must be at least 1")
+    for option in ("max_workers", "api_concurrency", "cpu_concurrency"):
+        if getattr(args, option) < 1:
+            parser.error(f"--{option.replace('_', '-')} must be at least 1")
+    if args.batch > 1 and args.mode != "inprocess":
+        parser.error("--batch requires --mode inprocess")
+    if args.task_queue and args.tmpfs:
+        parser.error("--tmpfs cannot be combined with --task-queue; workers need the scratch files on the shared directory")
+    if args.command == "daemon":
+        try:
+            CronSchedule(args.schedule)
+        except ValueError as e:
+            parser.error(str(e))
+    return args
+
+def run_daemon(args):
+    """Serve scheduled pipeline runs from the durable job queue until interrupted."""
+    queue = JobQueue(args.queue_db)
+    job_payload = {"batch": args.batch}
+
+    def run_job(payload, attempt):
+        job_args = argparse.Namespace(**{**vars(args), **payload})
+        return run_pipeline(job_args)
+
+    daemon = PipelineDaemon(queue, CronSchedule(args.schedule), run_job, job_payload,
+                            max_attempts=args.max_attempts, logger=logging.getLogger())
+    logging.info(f"Starting pipeline daemon; queue {args.queue_db} has {queue.counts(PIPELINE_QUEUE)}.")
+    try:
+        daemon.serve(run_now=args.run_now)
+    except KeyboardInterrupt:
+        logging.info("Pipeline daemon stopped.")
+
+def load_api_keys():
+    """API keys from the environment, with today's ElevenLabs key first."""
     # ---- API Key Loading ----
     NEWSDATA_API_KEY = os.getenv("NEWSDATA_API_KEY")
     GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")  
@@ -156,37 +711,141 @@ def main():
 
     current_day = datetime.datetime.now().day
     if 2 <= current_day <= 16:
-        active_elevenlabs_key = ELEVENLABS_API_KEY_2
+        active_elevenlabs_key, fallback_elevenlabs_key = ELEVENLABS_API_KEY_2, ELEVENLABS_API_KEY_1
         key_using = 2
         # logging.info("Using ElevenLabs Key that resets on the 2nd (for days 2-16).")
     else:
-        active_elevenlabs_key = ELEVENLABS_API_KEY_1
+        active_elevenlabs_key, fallback_elevenlabs_key = ELEVENLABS_API_KEY_1, ELEVENLABS_API_KEY_2
         key_using = 1
         # logging.info("Using ElevenLabs Key that resets on the 17th (for days 17-1).")
 
-    NEWS_JSON = "news_output.json"
-    FINAL_VIDEO = "final_output.mp4"
+    # Passing dynamically selected ElevenLabs key
+    logging.info(f"Using ElevenLabs Key {key_using} for this run.")
+    return {
+        "gemini": GEMINI_API_KEY,
+        "newsdata": NEWSDATA_API_KEY,
+        "imagerouter": IMAGEROUTER_API_KEY,
+        "elevenlabs": active_elevenlabs_key,
+        # Used only when the active key runs out of quota mid-run.
+        "elevenlabs_fallback": fallback_elevenlabs_key,
+    }
 
-    news_info = run_step1(GEMINI_API_KEY, NEWSDATA_API_KEY, output_file=NEWS_JSON)
-    time.sleep(2)
+API_KEY_NAMES = ("gemini", "newsdata", "imagerouter", "elevenlabs", "elevenlabs_fallback")
 
-    generated_images_folder = run_step2(GEMINI_API_KEY, IMAGEROUTER_API_KEY, news_file=NEWS_JSON)
-    time.sleep(2)
+def run_worker(args):
+    """Lease and run stage tasks until interrupted."""
+    codec = ArtifactCodec(args.workspace_root, load_api_keys())
+    worker = StageWorker(open_task_queue(args.task_queue), STAGE_OPS, codec, kinds=args.kinds,
+                         logger=logging.getLogger())
+    try:
+        worker.serve()
+    except KeyboardInterrupt:
+        logging.info("Stage worker stopped.")
 
-    generated_video = run_step3(image_folder=generated_images_folder)
+def run_pipeline(args):
+    """Run the pipeline once with parsed ``run`` options and return the uploaded video IDs."""
+    mode = args.mode
+    # In the daemon the in-process cache outlives runs; log only this run's counters.
+    reset_cache_stats()
+    if args.task_queue:
+        # Stages run on stage workers, which hold the keys themselves.
+        keys = {name: KeyRef(name) for name in API_KEY_NAMES}
+        runner = StageRunner(STAGE_OPS, open_task_queue(args.task_queue),
+                             ArtifactCodec(args.workspace_root), logger=logging.getLogger())
+        logging.info(f"Dispatching stages to workers through {args.task_queue}.")
+    else:
+        keys = load_api_keys()
+        runner = StageRunner(STAGE_OPS)
 
-    # Passing dynamically selected ElevenLabs key
-    logging.info(f"Using ElevenLabs Key {key_using} for this run.")
-    final_video = run_step4(generated_video, news_info["description"], FINAL_VIDEO, active_elevenlabs_key)
-    time.sleep(2)
-
-    run_step5(
-        final_video,
-        news_info["title"],
-        news_info["description"],
-        news_info["tags"]
+    for key, state in get_circuit_breaker().open_breakers().items():
+        reset_at = datetime.datetime.fromtimestamp(state["open_until"]).strftime("%Y-%m-%d %H:%M:%S")
+        logging.warning(f"Circuit breaker {key} is open until {reset_at}; those calls will use fallbacks.")
+
+    logging.info(f"Running steps in {mode} mode.")
+    store = StageStore(args.stage_cache_dir)
+    memo = StageMemo(store, resume=args.resume, logger=logging.getLogger())
+    tracer = perf_spans.Tracer()
+    scratch_root = tmpfs_scratch_root(logging.getLogger()) if args.tmpfs else None
+    run_params = resolve_run_params(
+        store, mode, args.resume, batch=args.batch,
+        new_workspace=lambda: RunWorkspace.create(tracer.run_id, args.workspace_root, scratch_root),
+        run_key=getattr(args, "run_key", None),
     )
+    workspace = RunWorkspace.from_dict(run_params["workspace"])
+    prune_workspaces(args.workspace_root, keep=args.keep_runs, exclude=workspace.run_id)
+
+    # Step processes of this run append their API cache counters here.
+    cache_stats_file = workspace.path(CACHE_STATS_FILE)
+    if os.path.exists(cache_stats_file):
+        os.remove(cache_stats_file)
+    os.environ["API_CACHE_STATS_FILE"] = cache_stats_file
+
+    if args.batch > 1:
+        stages = build_batch_stages(keys, run_params, memo, runner=runner)
+    else:
+        stages = build_stages(mode, keys, run_params, memo, runner=runner)
+    os.environ[perf_spans.RUN_ID_ENV] = tracer.run_id
+    logging.info(f"Run ID {tracer.run_id}; workspace {workspace.dir} (scratch {workspace.scratch}); "
+                 f"perf spans go to {tracer.path}.")
+    scheduler = DagScheduler(
+        stages, max_workers=args.max_workers, logger=logging.getLogger(),
+        limits={"api": args.api_concurrency, "cpu": args.cpu_concurrency},
+        fail_fast=args.batch == 1,
+        stage_context=lambda stage: tracer.span(stage.name, kind=stage.kind),
+    )
+    started = time.time()
+    status = "error"
+    try:
+        run = scheduler.run()
+        status = "partial" if run.failures else "ok"
+    except StageFailed as e:
+        logging.error(str(e))
+        if isinstance(e.error, SystemExit):
+            sys.exit(e.error.code)
+        sys.exit(EXIT_CODES.get(getattr(e.error, "failure_class", None), 1))
+    finally:
+        tracer.write_run(started, status, mode=mode, batch=args.batch, resume=args.resume)
+        workspace.cleanup()
+
+    if memo.hits:
+        logging.info(f"Reused stored outputs for: {', '.join(memo.hits)}")
+    for line in format_critical_path(run).splitlines():
+        logging.info(line)
+    log_cache_stats(cache_stats_file)
+
+    if args.batch > 1:
+        uploaded = [i + 1 for i in range(args.batch) if f"story{i + 1}.upload" in run.outputs]
+        logging.info(f"Batch finished: {len(uploaded)}/{args.batch} videos uploaded (stories {uploaded}).")
+        for name, error in run.failures.items():
+            logging.error(f"Stage '{name}' failed: {type(error).__name__}: {error}")
+        if run.failures:
+            sys.exit(1)
     logging.info("=== ALL STEPS COMPLETED SUCCESSFULLY ===")
+    return {"video_ids": [output for name, output in run.outputs.items() if name.endswith("upload")]}
+
+def log_cache_stats(path):
+    """Log the API cache counters aggregated across all step processes of this run."""
+    stats = merge_cache_stats([load_cache_stats(path), current_cache_stats()])
+    for line in format_cache_stats(stats).splitlines():
+        logging.info(line)
+
+def print_report(args):
+    records = perf_spans.load_records(args.file)
+    if args.compare:
+        print(perf_spans.compare_runs(records, last=args.compare))
+    else:
+        print(perf_spans.summarize_run(records, args.run_id))
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "report":
+        print_report(args)
+    elif args.command == "daemon":
+        run_daemon(args)
+    elif args.command == "worker":
+        run_worker(args)
+    else:
+        run_pipeline(args)
 
 if __name__ == "__main__":
     try:
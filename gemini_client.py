@@ -0,0 +1,132 @@
+"""
+Shared Gemini client registry.
+
+Every Gemini call site gets its client from here instead of building a new
+genai.Client (or re-running genai.configure) per call, so client setup and
+TLS handshakes are paid once per process and HTTP connections are reused
+across calls and retries.
+"""
+
+import asyncio
+import threading
+from typing import Any, Dict, Optional
+
+# --- Import Gemini API (try new SDK first, fallback to old) ---
+try:
+    # New SDK (0.8.5+)
+    from google import genai
+    from google.genai.types import GenerateContentConfig
+    GEMINI_SDK_VERSION = "new"
+except ImportError:
+    # Old SDK (0.8.5 and earlier)
+    import google.generativeai as genai
+    GenerateContentConfig = None
+    GEMINI_SDK_VERSION = "old"
+    print("[INFO] Using old Gemini SDK version")
+
+
+_lock = threading.Lock()
+_clients: Dict[tuple, Any] = {}
+_async_clients: Dict[tuple, tuple] = {}
+_models: Dict[tuple, Any] = {}
+_configured_key: Optional[str] = None
+
+
+def get_client(api_key: str):
+    """Return the shared new-SDK ``genai.Client`` for ``api_key``, creating it once."""
+    key = (GEMINI_SDK_VERSION, api_key)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = genai.Client(api_key=api_key)
+            _clients[key] = client
+        return client
+
+
+def get_async_client(api_key: str):
+    """
+    Return a client whose ``.aio`` surface is safe to use on the running event
+    loop. Async HTTP connections are bound to the loop that opened them, so
+    one client is kept per (api_key, loop) and dropped once its loop closes.
+    """
+    loop = asyncio.get_running_loop()
+    key = (GEMINI_SDK_VERSION, api_key, id(loop))
+    with _lock:
+        for stale_key in [k for k, (owner, _) in _async_clients.items() if owner.is_closed()]:
+            del _async_clients[stale_key]
+        entry = _async_clients.get(key)
+        if entry is None or entry[0] is not loop:
+            entry = (loop, genai.Client(api_key=api_key))
+            _async_clients[key] = entry
+        return entry[1]
+
+
+def get_model(api_key: str, model: str, system_instruction: Optional[str] = None):
+    """
+    Old SDK: return a shared ``GenerativeModel``. ``genai.configure`` is global
+    in that SDK, so it is only re-run when the API key actually changes.
+    """
+    global _configured_key
+    key = (GEMINI_SDK_VERSION, api_key, model, system_instruction)
+    with _lock:
+        if _configured_key != api_key:
+            genai.configure(api_key=api_key)
+            _configured_key = api_key
+            _models.clear()
+        model_obj = _models.get(key)
+        if model_obj is None:
+            model_obj = genai.GenerativeModel(model_name=model, system_instruction=system_instruction)
+            _models[key] = model_obj
+        return model_obj
+
+
+def _response_text(response) -> Optional[str]:
+    return response.text.strip() if response and hasattr(response, 'text') and response.text else None
+
+
+def _new_sdk_config(system_instruction: Optional[str], response_schema: Optional[dict]):
+    kwargs = {}
+    if system_instruction:
+        kwargs["system_instruction"] = system_instruction
+    if response_schema:
+        kwargs["response_mime_type"] = "application/json"
+        kwargs["response_schema"] = response_schema
+    return GenerateContentConfig(**kwargs) if kwargs else None
+
+
+def _old_sdk_generation_config(response_schema: Optional[dict]):
+    if not response_schema:
+        return None
+    return {"response_mime_type": "application/json", "response_schema": response_schema}
+
+
+def generate_text(api_key: str, model: str, contents, system_instruction: Optional[str] = None,
+                  response_schema: Optional[dict] = None) -> Optional[str]:
+    """
+    Run one generate_content call through the shared client and return the
+    stripped text. With ``response_schema`` the model is constrained to emit
+    JSON matching that schema.
+    """
+    if GEMINI_SDK_VERSION == "new":
+        response = get_client(api_key).models.generate_content(
+            model=model, contents=contents, config=_new_sdk_config(system_instruction, response_schema)
+        )
+    else:
+        response = get_model(api_key, model, system_instruction).generate_content(
+            contents, generation_config=_old_sdk_generation_config(response_schema)
+        )
+    return _response_text(response)
+
+
+async def generate_text_async(api_key: str, model: str, contents, system_instruction: Optional[str] = None,
+                              response_schema: Optional[dict] = None) -> Optional[str]:
+    """Async counterpart of generate_text."""
+    if GEMINI_SDK_VERSION == "new":
+        response = await get_async_client(api_key).aio.models.generate_content(
+            model=model, contents=contents, config=_new_sdk_config(system_instruction, response_schema)
+        )
+    else:
+        response = await get_model(api_key, model, system_instruction).generate_content_async(
+            contents, generation_config=_old_sdk_generation_config(response_schema)
+        )
+    return _response_text(response)
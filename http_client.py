@@ -0,0 +1,118 @@
+"""
+Shared HTTP client for every outbound REST call.
+
+Each endpoint (NewsData.io, NewsAPI, Google News, ImageRouter, image
+downloads) has a named EndpointPolicy: connect/read timeouts and a
+transport-level retry policy. Calls go through one pooled requests.Session
+per endpoint, so connections (and TLS sessions) are kept alive and reused
+per host, the CA bundle is resolved once at import, and responses are
+requested gzip-compressed.
+
+The retries here only cover connection errors and gateway-type 5xx
+responses; billed POSTs (ImageRouter) retry only when the connection was
+never made, since any response or read timeout may come after the image
+was generated. 429 and other quota errors are returned to the caller, which
+classifies them (see step_failures), because quota waits are a pipeline
+decision rather than a transport one.
+"""
+
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+
+import certifi
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+CA_BUNDLE = certifi.where()
+DEFAULT_HEADERS = {"Accept-Encoding": "gzip, deflate", "User-Agent": "news-shorts-pipeline/1.0"}
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    total: int = 2
+    backoff_factor: float = 0.5
+    status_forcelist: Tuple[int, ...] = (500, 502, 503, 504)
+    allowed_methods: Tuple[str, ...] = ("GET", "HEAD")
+    connect_only: bool = False  # retry connection errors only, never a sent request
+
+    def to_retry(self) -> Retry:
+        sent_retries = 0 if self.connect_only else self.total
+        return Retry(
+            total=self.total,
+            connect=self.total,
+            read=sent_retries,
+            status=sent_retries,
+            other=sent_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=self.status_forcelist,
+            allowed_methods=frozenset(self.allowed_methods),
+            raise_on_status=False,
+            respect_retry_after_header=False,
+        )
+
+
+@dataclass(frozen=True)
+class EndpointPolicy:
+    timeout: Tuple[float, float] = (5.0, 15.0)  # (connect, read) seconds
+    retry: RetryPolicy = field(default_factory=RetryPolicy)
+    pool_maxsize: int = 10
+
+
+ENDPOINTS: Dict[str, EndpointPolicy] = {
+    "newsdata": EndpointPolicy(timeout=(5.0, 10.0)),
+    "newsapi": EndpointPolicy(timeout=(5.0, 10.0)),
+    "google_news": EndpointPolicy(timeout=(5.0, 10.0)),
+    # Generation is slow and billed per image; retry a POST only when it never reached the server.
+    "imagerouter": EndpointPolicy(timeout=(5.0, 120.0),
+                                  retry=RetryPolicy(total=2, backoff_factor=2.0, status_forcelist=(),
+                                                    allowed_methods=("POST",), connect_only=True)),
+    "image_download": EndpointPolicy(timeout=(5.0, 60.0), retry=RetryPolicy(total=3)),
+}
+DEFAULT_ENDPOINT = EndpointPolicy()
+
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def _new_session(policy: EndpointPolicy) -> requests.Session:
+    session = requests.Session()
+    session.headers.update(DEFAULT_HEADERS)
+    session.verify = CA_BUNDLE
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=policy.pool_maxsize, max_retries=policy.retry.to_retry())
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def session_for(endpoint: str) -> requests.Session:
+    """The pooled session of ``endpoint``, created on first use."""
+    with _sessions_lock:
+        if endpoint not in _sessions:
+            _sessions[endpoint] = _new_session(ENDPOINTS.get(endpoint, DEFAULT_ENDPOINT))
+        return _sessions[endpoint]
+
+
+def request(endpoint: str, method: str, url: str, timeout: Optional[Any] = None, **kwargs: Any) -> requests.Response:
+    """
+    Send a request through ``endpoint``'s session. ``timeout`` overrides the
+    endpoint's (connect, read) default; a single number caps both.
+    """
+    policy = ENDPOINTS.get(endpoint, DEFAULT_ENDPOINT)
+    return session_for(endpoint).request(method, url, timeout=timeout or policy.timeout, **kwargs)
+
+
+def get(endpoint: str, url: str, **kwargs: Any) -> requests.Response:
+    return request(endpoint, "GET", url, **kwargs)
+
+
+def post(endpoint: str, url: str, **kwargs: Any) -> requests.Response:
+    return request(endpoint, "POST", url, **kwargs)
+
+
+def close_all() -> None:
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,241 @@
+"""
+Durable local job queue backed by SQLite.
+
+Jobs move through the states below; every transition is a single
+BEGIN IMMEDIATE transaction, so several worker processes on one host can
+share a queue file safely::
+
+    queued --claim--> running --complete--> succeeded
+                         |
+                         +--fail--> queued (retry after backoff) ... --> dead
+
+A claimed job carries a lease. Workers extend it while they run; if a worker
+crashes, its lease expires and recover_expired() puts the job back in the
+queue (counting the lost attempt).
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+DEFAULT_QUEUE_DB = os.path.join(".pipeline_jobs", "jobs.sqlite3")
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+DEAD = "dead"
+JOB_STATES = (QUEUED, RUNNING, SUCCEEDED, DEAD)
+
+
+@dataclass
+class Job:
+    id: int
+    queue: str
+    payload: Dict[str, Any]
+    state: str
+    attempts: int
+    max_attempts: int
+    run_after: float
+    lease_owner: Optional[str]
+    lease_until: Optional[float]
+    last_error: Optional[str]
+    result: Optional[Any]
+    created: float
+    updated: float
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "Job":
+        return cls(
+            id=row["id"],
+            queue=row["queue"],
+            payload=json.loads(row["payload"]),
+            state=row["state"],
+            attempts=row["attempts"],
+            max_attempts=row["max_attempts"],
+            run_after=row["run_after"],
+            lease_owner=row["lease_owner"],
+            lease_until=row["lease_until"],
+            last_error=row["last_error"],
+            result=json.loads(row["result"]) if row["result"] is not None else None,
+            created=row["created"],
+            updated=row["updated"],
+        )
+
+
+class JobQueue:
+    """SQLite-backed queue of JSON job payloads, partitioned by queue name."""
+
+    def __init__(self, path: str = DEFAULT_QUEUE_DB):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(self.path), timeout=60, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                queue TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                run_after REAL NOT NULL,
+                lease_owner TEXT,
+                lease_until REAL,
+                last_error TEXT,
+                result TEXT,
+                dedupe_key TEXT UNIQUE,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs (queue, state, run_after)")
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def enqueue(self, queue: str, payload: Dict[str, Any], max_attempts: int = 3,
+                run_after: Optional[float] = None, dedupe_key: Optional[str] = None) -> Optional[int]:
+        """
+        Add a job and return its id. With ``dedupe_key``, a second enqueue of
+        the same key is ignored and returns None (e.g. the same scheduled slot
+        after a daemon restart).
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO jobs (queue, payload, state, max_attempts, run_after, dedupe_key, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (queue, json.dumps(payload), QUEUED, max_attempts, run_after or now, dedupe_key, now, now),
+            )
+            return cursor.lastrowid if cursor.rowcount else None
+
+    def claim(self, queue: str, owner: str, lease_seconds: float = 600.0) -> Optional[Job]:
+        """Lease the oldest ready job of ``queue`` to ``owner``, or return None."""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE queue = ? AND state = ? AND run_after <= ? ORDER BY run_after, id LIMIT 1",
+                (queue, QUEUED, now),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET state = ?, attempts = attempts + 1, lease_owner = ?, lease_until = ?, updated = ? "
+                "WHERE id = ?",
+                (RUNNING, owner, now + lease_seconds, now, row["id"]),
+            )
+            return Job.from_row(conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+
+    def heartbeat(self, job_id: int, owner: str, lease_seconds: float = 600.0) -> bool:
+        """Extend the lease; False means the job is no longer ours (it was recovered)."""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_until = ?, updated = ? WHERE id = ? AND state = ? AND lease_owner = ?",
+                (now + lease_seconds, now, job_id, RUNNING, owner),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job_id: int, owner: str, result: Any = None) -> bool:
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET state = ?, result = ?, lease_owner = NULL, lease_until = NULL, updated = ? "
+                "WHERE id = ? AND state = ? AND lease_owner = ?",
+                (SUCCEEDED, json.dumps(result), now, job_id, RUNNING, owner),
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, job_id: int, owner: str, error: str, retry_delay: float = 0.0,
+             retryable: bool = True) -> Optional[str]:
+        """
+        Record a failed attempt. The job is re-queued after ``retry_delay``
+        while attempts remain and ``retryable`` is set, otherwise it is
+        marked dead. Returns the new state (None if the lease was lost).
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ? AND state = ? AND lease_owner = ?",
+                               (job_id, RUNNING, owner)).fetchone()
+            if row is None:
+                return None
+            state = QUEUED if retryable and row["attempts"] < row["max_attempts"] else DEAD
+            conn.execute(
+                "UPDATE jobs SET state = ?, last_error = ?, run_after = ?, lease_owner = NULL, lease_until = NULL, "
+                "updated = ? WHERE id = ?",
+                (state, error, now + retry_delay, now, job_id),
+            )
+            return state
+
+    def cancel(self, job_id: int, error: str) -> bool:
+        """Mark a job that no worker has claimed yet as dead. Returns False if it is no longer queued."""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET state = ?, last_error = ?, updated = ? WHERE id = ? AND state = ?",
+                (DEAD, error, time.time(), job_id, QUEUED),
+            )
+            return cursor.rowcount == 1
+
+    def recover_expired(self, now: Optional[float] = None) -> List[int]:
+        """
+        Crash recovery: return running jobs whose lease has expired to the
+        queue (or to dead if that was their last attempt).
+        """
+        now = time.time() if now is None else now
+        with self._transaction() as conn:
+            rows = conn.execute("SELECT id, attempts, max_attempts FROM jobs WHERE state = ? AND lease_until < ?",
+                                (RUNNING, now)).fetchall()
+            for row in rows:
+                state = QUEUED if row["attempts"] < row["max_attempts"] else DEAD
+                conn.execute(
+                    "UPDATE jobs SET state = ?, last_error = ?, run_after = ?, lease_owner = NULL, lease_until = NULL, "
+                    "updated = ? WHERE id = ?",
+                    (state, "lease expired (worker crashed or was stopped)", now, now, row["id"]),
+                )
+            return [row["id"] for row in rows]
+
+    def next_ready_time(self, queue: str) -> Optional[float]:
+        """When the earliest queued job of ``queue`` becomes claimable."""
+        with self._lock:
+            row = self._conn.execute("SELECT MIN(run_after) FROM jobs WHERE queue = ? AND state = ?",
+                                     (queue, QUEUED)).fetchone()
+        return row[0]
+
+    def get(self, job_id: int) -> Optional[Job]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job.from_row(row) if row else None
+
+    def counts(self, queue: Optional[str] = None) -> Dict[str, int]:
+        """Number of jobs per state, optionally for a single queue."""
+        query = "SELECT state, COUNT(*) FROM jobs"
+        params: tuple = ()
+        if queue is not None:
+            query += " WHERE queue = ?"
+            params = (queue,)
+        with self._lock:
+            rows = self._conn.execute(query + " GROUP BY state", params).fetchall()
+        counts = {state: 0 for state in JOB_STATES}
+        counts.update({row[0]: row[1] for row in rows})
+        return counts
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,372 @@
+"""
+Concurrent news ingestion for step 1.
+
+Every configured provider (NewsData.io, NewsAPI, Google News RSS) is queried
+at the same time, each with its own deadline. Results are normalised into
+Article records and merged as they arrive; gather_articles returns as soon
+as enough good candidates (articles with a real description) are in, so a
+slow or failing provider neither blocks nor kills step 1. Only when every
+provider fails is a StepError raised, classified from the providers'
+failures (see step_failures).
+
+With a news_store.NewsStore, NewsData.io is polled incrementally along its
+``nextPage`` cursors and every provider only hands on articles that no
+earlier run has selected from.
+"""
+
+import datetime
+import email.utils
+import html
+import re
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass, field
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+
+import http_client
+from pipeline_types import StepError
+from step_failures import PERMANENT, QUOTA, TRANSIENT, classify_exception, classify_http_status
+
+if TYPE_CHECKING:
+    from news_store import NewsStore
+
+NEWSDATA_URL = "https://newsdata.io/api/1/latest"
+NEWSAPI_URL = "https://newsapi.org/v2/top-headlines"
+GOOGLE_NEWS_RSS_URL = "https://news.google.com/rss"
+
+DEFAULT_SOURCE_TIMEOUT = 10.0
+# Pages an incremental NewsData.io poll follows before giving up on catching up.
+DEFAULT_MAX_PAGES = 5
+# Articles need at least this many description words to be worth a video.
+MIN_DESCRIPTION_WORDS = 20
+
+_TAG = re.compile(r"<[^>]+>")
+_NON_WORD = re.compile(r"\W+")
+
+
+@dataclass
+class Article:
+    """One news article, whichever provider it came from."""
+    title: str
+    description: str = ""
+    url: str = ""
+    source: str = ""
+    provider: str = ""
+    published_at: Optional[float] = None  # Unix timestamp
+    article_id: str = ""
+    categories: List[str] = field(default_factory=list)
+
+    @property
+    def description_words(self) -> int:
+        return len(self.description.split())
+
+    def is_good(self, min_words: int = MIN_DESCRIPTION_WORDS) -> bool:
+        return bool(self.title.strip()) and self.description_words >= min_words
+
+    def dedupe_key(self) -> str:
+        return _NON_WORD.sub(" ", self.title.lower()).strip()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Article":
+        return cls(**data)
+
+
+def _clean_text(text: Optional[str]) -> str:
+    return " ".join(html.unescape(_TAG.sub(" ", text or "")).split())
+
+
+def _parse_time(value: Optional[str]) -> Optional[float]:
+    """Timestamp of an ISO-8601, NewsData ("2025-01-01 10:00:00", UTC) or RFC 822 date."""
+    if not value:
+        return None
+    try:
+        moment = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        try:
+            moment = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.timestamp()
+
+
+def _raise_for_response(provider: str, resp: requests.Response, message: str) -> None:
+    raise StepError(f"{provider} request failed ({resp.status_code}): {message}",
+                    failure_class=classify_http_status(resp.status_code))
+
+
+def _json_body(provider: str, resp: requests.Response) -> Dict[str, Any]:
+    """
+    Decoded JSON body of ``resp``. Error pages that are not JSON (proxy 502s,
+    HTML rate-limit pages) are raised as classified StepErrors instead.
+    """
+    try:
+        data = resp.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        if resp.status_code != 200:
+            _raise_for_response(provider, resp, resp.text[:200])
+        raise StepError(f"{provider} returned a response that is not a JSON object: {resp.text[:200]}")
+    return data
+
+
+def fetch_newsdata_page(api_key: str, country: str = "in", language: str = "en", page: Optional[str] = None,
+                        timeout: float = DEFAULT_SOURCE_TIMEOUT) -> Tuple[List[Article], Optional[str]]:
+    """One page of the latest NewsData.io articles (newest first) and the ``nextPage`` cursor, if any."""
+    params = {"apikey": api_key, "country": country, "language": language}
+    if page:
+        params["page"] = page
+    resp = http_client.get("newsdata", NEWSDATA_URL, params=params, timeout=timeout)
+    data = _json_body("NewsData.io", resp)
+    if resp.status_code != 200 or data.get("status") == "error":
+        results = data.get("results")
+        _raise_for_response("NewsData.io", resp, results.get("message", resp.text) if isinstance(results, dict) else resp.text)
+    articles = [
+        Article(
+            title=_clean_text(item.get("title")),
+            description=_clean_text(item.get("description")),
+            url=item.get("link") or "",
+            source=item.get("source_name") or item.get("source_id") or "",
+            provider="newsdata",
+            published_at=_parse_time(item.get("pubDate")),
+            article_id=item.get("article_id") or "",
+            categories=item.get("category") or [],
+        )
+        for item in data.get("results") or []
+        if item.get("title")
+    ]
+    return articles, data.get("nextPage") or None
+
+
+def fetch_newsdata(api_key: str, country: str = "in", language: str = "en",
+                   timeout: float = DEFAULT_SOURCE_TIMEOUT) -> List[Article]:
+    return fetch_newsdata_page(api_key, country, language, timeout=timeout)[0]
+
+
+def poll_newsdata(api_key: str, store: "NewsStore", country: str = "in", language: str = "en",
+                  max_pages: int = DEFAULT_MAX_PAGES, timeout: float = DEFAULT_SOURCE_TIMEOUT) -> List[Article]:
+    """
+    Incremental NewsData.io poll. Follows ``nextPage`` cursors until a page
+    reaches the newest article of the previous poll (by ID or publish time),
+    ``max_pages`` pages have been read or ``timeout`` seconds have passed,
+    stores what it fetched in ``store`` (see news_store.NewsStore) and
+    returns the store's pending NewsData articles, i.e. the ones no finished
+    selection has seen yet. The first poll of a query reads a single page.
+    If a page after the first fails, the pages already read are still
+    stored and the cursor advanced, and the failure is reported as a
+    warning; only a failing first page raises.
+    """
+    query = f"newsdata:{country}:{language}"
+    cursor = store.get_cursor(query)
+    deadline = time.monotonic() + timeout
+    fetched: List[Article] = []
+    page: Optional[str] = None
+    pages_read = 0
+    for _ in range(max_pages if cursor else 1):
+        try:
+            articles, page = fetch_newsdata_page(api_key, country, language, page=page,
+                                                 timeout=max(deadline - time.monotonic(), 1.0))
+        except Exception as e:
+            if not pages_read:
+                raise
+            print(f"[WARNING] NewsData.io poll stopped after {pages_read} pages: {type(e).__name__}: {e}; "
+                  f"keeping the {len(fetched)} articles already fetched.")
+            break
+        pages_read += 1
+        caught_up = False
+        for article in articles:
+            if cursor and (article.article_id == cursor.newest_id or (
+                    article.published_at is not None and cursor.newest_published is not None
+                    and article.published_at < cursor.newest_published)):
+                caught_up = True
+                break
+            fetched.append(article)
+        if caught_up or not page or time.monotonic() >= deadline:
+            break
+
+    new = store.add(fetched)
+    if fetched:
+        # Pages run newest first, so the newest article is on a page that was read.
+        newest = max(fetched, key=lambda a: a.published_at or 0.0)
+        store.save_cursor(query, newest.article_id, newest.published_at)
+    print(f"NewsData.io poll: {len(fetched)} fetched from {pages_read} pages, {len(new)} new since the last poll.")
+    return store.pending(provider="newsdata")
+
+
+def fetch_newsapi(api_key: str, country: str = "in", page_size: int = 20,
+                  timeout: float = DEFAULT_SOURCE_TIMEOUT) -> List[Article]:
+    params = {"country": country, "apiKey": api_key, "pageSize": page_size}
+    resp = http_client.get("newsapi", NEWSAPI_URL, params=params, timeout=timeout)
+    data = _json_body("NewsAPI", resp)
+    if resp.status_code != 200 or data.get("status") == "error":
+        _raise_for_response("NewsAPI", resp, data.get("message", resp.text))
+    return [
+        Article(
+            title=_clean_text(item.get("title")),
+            description=_clean_text(item.get("description") or item.get("content")),
+            url=item.get("url") or "",
+            source=(item.get("source") or {}).get("name") or "",
+            provider="newsapi",
+            published_at=_parse_time(item.get("publishedAt")),
+            article_id=item.get("url") or "",
+        )
+        for item in data.get("articles") or []
+        if item.get("title")
+    ]
+
+
+def fetch_google_news(language: str = "en", country: str = "IN",
+                      timeout: float = DEFAULT_SOURCE_TIMEOUT) -> List[Article]:
+    """Top stories from the Google News RSS feed (headlines with short snippets)."""
+    params = {"hl": f"{language}-{country}", "gl": country, "ceid": f"{country}:{language}"}
+    resp = http_client.get("google_news", GOOGLE_NEWS_RSS_URL, params=params, timeout=timeout)
+    if resp.status_code != 200:
+        _raise_for_response("Google News", resp, resp.text[:200])
+    articles = []
+    for item in ET.fromstring(resp.content).iter("item"):
+        source = item.findtext("source") or ""
+        title = _clean_text(item.findtext("title"))
+        # Feed titles end in " - <publisher>"
+        if source and title.endswith(f" - {source}"):
+            title = title[:-len(source) - 3]
+        articles.append(Article(
+            title=title,
+            description=_clean_text(item.findtext("description")),
+            url=item.findtext("link") or "",
+            source=source,
+            provider="google_news",
+            published_at=_parse_time(item.findtext("pubDate")),
+            article_id=item.findtext("guid") or "",
+        ))
+    return articles
+
+
+@dataclass
+class NewsSource:
+    name: str
+    fetch: Callable[..., List[Article]]
+    timeout: float = DEFAULT_SOURCE_TIMEOUT
+
+
+def configured_sources(newsdata_api_key: Optional[str] = None, newsapi_key: Optional[str] = None,
+                       google_news: bool = True, timeout: float = DEFAULT_SOURCE_TIMEOUT,
+                       store: Optional["NewsStore"] = None) -> List[NewsSource]:
+    """
+    The providers that have credentials, in preference order. With a
+    ``store``, NewsData.io is polled incrementally (see poll_newsdata) and
+    every source returns only the articles still pending in the store.
+    """
+    def fetcher(name: str, fetch: Callable[[float], List[Article]]) -> Callable[[float], List[Article]]:
+        return fetch if store is None else _only_new(fetch, store, name)
+
+    sources = []
+    if newsdata_api_key and store is not None:
+        sources.append(NewsSource("newsdata", lambda t: poll_newsdata(newsdata_api_key, store, timeout=t), timeout))
+    elif newsdata_api_key:
+        sources.append(NewsSource("newsdata", lambda t: fetch_newsdata(newsdata_api_key, timeout=t), timeout))
+    if newsapi_key:
+        sources.append(NewsSource("newsapi", fetcher("newsapi", lambda t: fetch_newsapi(newsapi_key, timeout=t)),
+                                  timeout))
+    if google_news:
+        sources.append(NewsSource("google_news", fetcher("google_news", lambda t: fetch_google_news(timeout=t)),
+                                  timeout))
+    return sources
+
+
+def _only_new(fetch: Callable[..., List[Article]], store: "NewsStore", provider: str) -> Callable[..., List[Article]]:
+    """Wrap a non-incremental fetch so it stores its results and returns only the pending ones."""
+    def fetch_new(timeout: float) -> List[Article]:
+        store.add(fetch(timeout))
+        return store.pending(provider=provider)
+    return fetch_new
+
+
+def merge_articles(batches: List[List[Article]]) -> List[Article]:
+    """
+    Merge provider results, dropping repeats of the same headline. When a
+    story appears more than once the longer description wins.
+    """
+    merged: Dict[str, Article] = {}
+    for batch in batches:
+        for article in batch:
+            key = article.dedupe_key()
+            if not key:
+                continue
+            if key not in merged or article.description_words > merged[key].description_words:
+                merged[key] = article
+    return list(merged.values())
+
+
+def _failure_class(errors: Dict[str, BaseException]) -> str:
+    classes = [classify_exception(e) for e in errors.values()]
+    if classes and all(c == PERMANENT for c in classes):
+        return PERMANENT
+    if QUOTA in classes:
+        return QUOTA
+    return TRANSIENT
+
+
+def gather_articles(sources: List[NewsSource], want: int = 5, min_words: int = MIN_DESCRIPTION_WORDS,
+                    grace: float = 1.0, fetched: Optional[List[Article]] = None) -> List[Article]:
+    """
+    Query ``sources`` concurrently and return the merged articles as soon
+    as at least ``want`` good ones have arrived or every source has either
+    answered or run past its deadline (its timeout plus ``grace`` seconds).
+    Sources still running at that point are abandoned. Every article the
+    answering sources returned, including repeats dropped by the merge, is
+    appended to ``fetched`` if given.
+    """
+    if not sources:
+        raise StepError("No news sources are configured.", failure_class=PERMANENT)
+    started = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=len(sources), thread_name_prefix="news-source")
+    pending = {executor.submit(source.fetch, source.timeout): source for source in sources}
+    batches: List[List[Article]] = []
+    errors: Dict[str, BaseException] = {}
+    merged: List[Article] = []
+    enough = False
+    try:
+        while pending and not enough:
+            now = time.monotonic()
+            for future, source in list(pending.items()):
+                if now - started >= source.timeout + grace:
+                    del pending[future]
+                    print(f"[WARNING] News source {source.name} missed its {source.timeout:g}s deadline; "
+                          f"continuing without it.")
+            if not pending:
+                break
+            next_deadline = min(started + source.timeout + grace for source in pending.values())
+            done, _ = wait(pending, timeout=max(next_deadline - now, 0), return_when=FIRST_COMPLETED)
+            for future in done:
+                source = pending.pop(future)
+                try:
+                    articles = future.result()
+                except Exception as e:
+                    errors[source.name] = e
+                    print(f"[WARNING] News source {source.name} failed: {type(e).__name__}: {e}")
+                    continue
+                print(f"News source {source.name}: {len(articles)} articles in {time.monotonic() - started:.1f}s.")
+                batches.append(articles)
+                if fetched is not None:
+                    fetched.extend(articles)
+            merged = merge_articles(batches)
+            enough = sum(1 for article in merged if article.is_good(min_words)) >= want
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if pending:
+        print(f"Enough articles arrived; not waiting for {', '.join(source.name for source in pending.values())}.")
+    if not merged:
+        if errors:
+            summary = "; ".join(f"{name}: {e}" for name, e in errors.items())
+            raise StepError(f"All news sources failed: {summary}", failure_class=_failure_class(errors))
+        raise StepError("No news articles were returned by any source.")
+    return merged
@@ -0,0 +1,156 @@
+"""
+Local article store and poll cursors for incremental news fetching.
+
+Every article fetched by news_sources is kept in an indexed SQLite table,
+keyed by provider and article ID. Articles start out *pending*; once a
+step 1 run has finished selecting, the ones it passed over are marked
+*seen*, so a retried step 1 gets the same candidates again while the next
+run only gets articles that arrived since (plus a selected story whose
+video was never uploaded; uploaded ones are kept out by story_index). For cursor-based providers (NewsData.io) the
+store also remembers the newest article ID and publish time per query, so
+a poll can stop paging as soon as it reaches articles it already has.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+from news_sources import Article
+
+DEFAULT_NEWS_STORE_DB = os.path.join(".news_store", "articles.sqlite3")
+DEFAULT_PENDING_HOURS = 24
+DEFAULT_RETENTION_DAYS = 14
+
+
+def article_key(article: Article) -> str:
+    return f"{article.provider}:{article.article_id or article.url or article.title}"
+
+
+@dataclass
+class PollCursor:
+    query: str
+    newest_id: Optional[str]
+    newest_published: Optional[float]
+    updated: float
+
+
+class NewsStore:
+    """SQLite store of fetched articles with per-query poll cursors."""
+
+    def __init__(self, path: str = DEFAULT_NEWS_STORE_DB, retention_days: float = DEFAULT_RETENTION_DAYS):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.retention = retention_days * 86400
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS articles (
+                   key TEXT PRIMARY KEY,
+                   provider TEXT NOT NULL,
+                   published REAL,
+                   fetched REAL NOT NULL,
+                   seen INTEGER NOT NULL DEFAULT 0,
+                   data TEXT NOT NULL
+               )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_articles_pending ON articles(seen, provider, fetched)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_articles_published ON articles(published)")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS cursors (
+                   query TEXT PRIMARY KEY,
+                   newest_id TEXT,
+                   newest_published REAL,
+                   updated REAL NOT NULL
+               )"""
+        )
+        self.prune()
+
+    def add(self, articles: Iterable[Article]) -> List[Article]:
+        """Store ``articles`` and return the ones that were not stored before."""
+        now = time.time()
+        added = []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for article in articles:
+                    cursor = self._conn.execute(
+                        "INSERT OR IGNORE INTO articles (key, provider, published, fetched, data) VALUES (?, ?, ?, ?, ?)",
+                        (article_key(article), article.provider, article.published_at, now,
+                         json.dumps(article.to_dict(), ensure_ascii=False)),
+                    )
+                    if cursor.rowcount:
+                        added.append(article)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return added
+
+    def pending(self, provider: Optional[str] = None, max_age_hours: float = DEFAULT_PENDING_HOURS) -> List[Article]:
+        """Articles not yet handed to a finished selection, newest first; stale ones are left out."""
+        query = "SELECT data FROM articles WHERE seen = 0 AND fetched >= ?"
+        params: list = [time.time() - max_age_hours * 3600]
+        if provider is not None:
+            query += " AND provider = ?"
+            params.append(provider)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY published DESC", params).fetchall()
+        return [Article.from_dict(json.loads(row[0])) for row in rows]
+
+    def mark_seen(self, articles: Iterable[Article]) -> None:
+        keys = [(article_key(article),) for article in articles]
+        with self._lock:
+            self._conn.executemany("UPDATE articles SET seen = 1 WHERE key = ?", keys)
+
+    def recent(self, since: float, provider: Optional[str] = None) -> List[Article]:
+        """All stored articles published since ``since`` (a Unix timestamp)."""
+        query = "SELECT data FROM articles WHERE published >= ?"
+        params: list = [since]
+        if provider is not None:
+            query += " AND provider = ?"
+            params.append(provider)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [Article.from_dict(json.loads(row[0])) for row in rows]
+
+    def get_cursor(self, query: str) -> Optional[PollCursor]:
+        with self._lock:
+            row = self._conn.execute("SELECT query, newest_id, newest_published, updated FROM cursors WHERE query = ?",
+                                     (query,)).fetchone()
+        return PollCursor(*row) if row else None
+
+    def save_cursor(self, query: str, newest_id: Optional[str], newest_published: Optional[float]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO cursors (query, newest_id, newest_published, updated) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(query) DO UPDATE SET newest_id = excluded.newest_id, "
+                "newest_published = excluded.newest_published, updated = excluded.updated",
+                (query, newest_id, newest_published, time.time()),
+            )
+
+    def prune(self) -> int:
+        """Drop articles fetched longer ago than the retention period."""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM articles WHERE fetched < ?", (time.time() - self.retention,))
+        return cursor.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_news_store: Optional[NewsStore] = None
+
+
+def get_news_store() -> NewsStore:
+    """Process-wide store at $NEWS_STORE_DB (default .news_store/articles.sqlite3)."""
+    global _news_store
+    if _news_store is None:
+        _news_store = NewsStore(os.environ.get("NEWS_STORE_DB", DEFAULT_NEWS_STORE_DB))
+    return _news_store
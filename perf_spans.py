@@ -0,0 +1,383 @@
+"""
+Structured per-stage performance spans.
+
+Every pipeline stage runs inside a span that records wall and CPU time,
+peak RSS while the span was open (sampled, Linux only), bytes read/written and the API counters api_utils reports via
+``record()`` (calls, retries, cache hits/misses, sleep time). Spans are
+appended as JSON lines to ``perf_spans.jsonl`` (or $PERF_SPANS_FILE), all
+tagged with the run ID, so a slow run can be attributed to Gemini backoff,
+rendering or alignment after the fact. ``summarize_run`` and
+``compare_runs`` back the ``final_pipeline.py report`` subcommand.
+
+Step subprocesses inherit the run ID and stage name through the
+environment (see ``child_env``) and append their API counters as a
+"counters" record on exit, which the report folds into the parent's span.
+
+Process-wide figures (CPU, I/O, RSS) include every stage running at the
+same time; per-thread CPU is recorded separately. RSS covers this process
+and its direct children (step subprocesses).
+"""
+
+import atexit
+import contextvars
+import datetime
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_SPANS_FILE = "perf_spans.jsonl"
+RUN_ID_ENV = "PIPELINE_RUN_ID"
+STAGE_ENV = "PIPELINE_STAGE"
+SPANS_FILE_ENV = "PERF_SPANS_FILE"
+
+COUNTER_FIELDS = ("api_calls", "api_retries", "cache_hits", "cache_misses", "sleep_s")
+RSS_SAMPLE_INTERVAL = 0.25
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("perf_span", default=None)
+_process_counters: Dict[str, float] = {field: 0 for field in COUNTER_FIELDS}
+_counters_lock = threading.Lock()
+_write_lock = threading.Lock()
+
+
+def spans_file() -> str:
+    return os.environ.get(SPANS_FILE_ENV, DEFAULT_SPANS_FILE)
+
+
+def new_run_id() -> str:
+    return f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+
+
+def record(counter: str, amount: float = 1) -> None:
+    """Add to a counter of the active span (or of the process when no span is active)."""
+    span = _current_span.get()
+    with _counters_lock:
+        target = span.counters if span is not None else _process_counters
+        target[counter] = target.get(counter, 0) + amount
+
+
+def annotate(**fields: Any) -> None:
+    """Attach extra fields (e.g. ``resumed=True``) to the active span, if any."""
+    span = _current_span.get()
+    if span is not None:
+        span.fields.update(fields)
+
+
+def _read_proc_io() -> Dict[str, int]:
+    try:
+        with open("/proc/self/io", "r") as f:
+            values = dict(line.split(":", 1) for line in f)
+        return {"read": int(values["read_bytes"]), "write": int(values["write_bytes"])}
+    except (OSError, KeyError, ValueError):
+        return {}
+
+
+def _sample() -> Dict[str, float]:
+    """Snapshot of this process's resource counters."""
+    sample = {
+        "thread_cpu": time.thread_time(),
+        "process_cpu": time.process_time(),
+    }
+    if resource is not None:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        sample["children_cpu"] = children.ru_utime + children.ru_stime
+        sample["read_bytes"] = (own.ru_inblock + children.ru_inblock) * 512
+        sample["write_bytes"] = (own.ru_oublock + children.ru_oublock) * 512
+    proc_io = _read_proc_io()
+    if proc_io:
+        sample["read_bytes"] = proc_io["read"]
+        sample["write_bytes"] = proc_io["write"]
+    return sample
+
+
+def _statm_rss(pid: str) -> int:
+    with open(f"/proc/{pid}/statm", "r") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _current_rss() -> Optional[int]:
+    """Resident set size of this process plus its direct children, in bytes (None without /proc)."""
+    try:
+        total = _statm_rss("self")
+        tasks = os.listdir("/proc/self/task")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+    for task in tasks:
+        try:
+            with open(f"/proc/self/task/{task}/children", "r") as f:
+                children = f.read().split()
+        except OSError:
+            continue
+        for pid in children:
+            try:
+                total += _statm_rss(pid)
+            except (OSError, ValueError, IndexError):
+                continue  # the child exited meanwhile
+    return total
+
+
+class _RssSampler:
+    """
+    Samples RSS every RSS_SAMPLE_INTERVAL seconds while any span is open
+    and keeps each open span's peak. ru_maxrss cannot be used for this: it
+    is the peak over the whole process lifetime, so in a long-lived process
+    every stage after the heaviest one would report that stage's peak.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans: List["Span"] = []
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, span: "Span") -> None:
+        rss = _current_rss()
+        if rss is None:
+            return
+        with self._lock:
+            span.peak_rss = rss
+            self._spans.append(span)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="perf-rss", daemon=True)
+                self._thread.start()
+
+    def stop(self, span: "Span") -> None:
+        rss = _current_rss()
+        with self._lock:
+            if span in self._spans:
+                self._spans.remove(span)
+            if rss is not None and span.peak_rss is not None:
+                span.peak_rss = max(span.peak_rss, rss)
+
+    def _loop(self) -> None:
+        while True:
+            time.sleep(RSS_SAMPLE_INTERVAL)
+            rss = _current_rss()
+            with self._lock:
+                if not self._spans:
+                    self._thread = None
+                    return
+                if rss is not None:
+                    for span in self._spans:
+                        span.peak_rss = max(span.peak_rss, rss)
+
+
+_rss_sampler = _RssSampler()
+
+
+class Span:
+    def __init__(self, run_id: str, stage: str, fields: Dict[str, Any], path: Optional[str] = None):
+        self.run_id = run_id
+        self.stage = stage
+        self.path = path
+        self.fields = dict(fields)
+        self.counters: Dict[str, float] = {field: 0 for field in COUNTER_FIELDS}
+        self.peak_rss: Optional[int] = None
+
+    def to_record(self, start: float, wall: float, before: Dict[str, float], after: Dict[str, float],
+                  error: Optional[BaseException]) -> Dict[str, Any]:
+        delta = lambda key: round(after[key] - before[key], 4) if key in after and key in before else None
+        record_ = {
+            "type": "span",
+            "run_id": self.run_id,
+            "stage": self.stage,
+            "status": "ok" if error is None else "error",
+            "start": start,
+            "wall_s": round(wall, 4),
+            "cpu_thread_s": delta("thread_cpu"),
+            "cpu_process_s": delta("process_cpu"),
+            "cpu_children_s": delta("children_cpu"),
+            "peak_rss_mb": round(self.peak_rss / 2 ** 20, 1) if self.peak_rss is not None else None,
+            "bytes_read": delta("read_bytes"),
+            "bytes_written": delta("write_bytes"),
+        }
+        record_.update({field: round(value, 4) for field, value in self.counters.items()})
+        if error is not None:
+            record_["error"] = f"{type(error).__name__}: {error}"
+        record_.update(self.fields)
+        return record_
+
+
+def write_record(record_: Dict[str, Any], path: Optional[str] = None) -> None:
+    line = json.dumps(record_, default=str)
+    with _write_lock:
+        with open(path or spans_file(), "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class Tracer:
+    """Writes the spans of one pipeline run, all tagged with ``run_id``."""
+
+    def __init__(self, run_id: Optional[str] = None, path: Optional[str] = None):
+        self.run_id = run_id or new_run_id()
+        self.path = path or spans_file()
+
+    @contextmanager
+    def span(self, stage: str, **fields: Any) -> Iterator[Span]:
+        span = Span(self.run_id, stage, fields, self.path)
+        token = _current_span.set(span)
+        start, before = time.time(), _sample()
+        _rss_sampler.start(span)
+        perf_start = time.perf_counter()
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            wall = time.perf_counter() - perf_start
+            _rss_sampler.stop(span)
+            _current_span.reset(token)
+            write_record(span.to_record(start, wall, before, _sample(), error), self.path)
+
+    def write_run(self, started: float, status: str, **fields: Any) -> None:
+        """Write the run-level summary record."""
+        write_record({"type": "run", "run_id": self.run_id, "start": started,
+                      "wall_s": round(time.time() - started, 4), "status": status, **fields}, self.path)
+
+    def child_env(self) -> Dict[str, str]:
+        """Environment for a step subprocess so its API counters land in the current span."""
+        env = dict(os.environ)
+        env[RUN_ID_ENV] = self.run_id
+        env[SPANS_FILE_ENV] = os.path.abspath(self.path)
+        span = _current_span.get()
+        if span is not None:
+            env[STAGE_ENV] = span.stage
+        return env
+
+
+def current_stage() -> Optional[str]:
+    """Name of the stage whose span is active, if any."""
+    span = _current_span.get()
+    return span.stage if span is not None else None
+
+
+def current_tracer() -> Optional[Tracer]:
+    """The tracer of the active span, so step runners can build child environments."""
+    span = _current_span.get()
+    return Tracer(span.run_id, span.path) if span is not None else None
+
+
+def _dump_process_counters() -> None:
+    """Step subprocess exit hook: report counters recorded outside any span."""
+    with _counters_lock:
+        counters = dict(_process_counters)
+    if any(counters.values()):
+        write_record({"type": "counters", "run_id": os.environ[RUN_ID_ENV],
+                      "stage": os.environ[STAGE_ENV], **counters})
+
+
+if os.environ.get(RUN_ID_ENV) and os.environ.get(STAGE_ENV):
+    atexit.register(_dump_process_counters)
+
+
+# --- Reporting ---
+
+def load_records(path: Optional[str] = None) -> List[Dict[str, Any]]:
+    records = []
+    try:
+        with open(path or spans_file(), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    except OSError:
+        pass
+    return records
+
+
+def run_spans(records: List[Dict[str, Any]], run_id: str) -> List[Dict[str, Any]]:
+    """Spans of one run, with subprocess counter records folded into their stage's span."""
+    spans = [dict(r) for r in records if r.get("run_id") == run_id and r.get("type") == "span"]
+    by_stage = {span["stage"]: span for span in spans}
+    for r in records:
+        if r.get("run_id") == run_id and r.get("type") == "counters" and r.get("stage") in by_stage:
+            span = by_stage[r["stage"]]
+            for field in COUNTER_FIELDS:
+                span[field] = (span.get(field) or 0) + r.get(field, 0)
+    return sorted(spans, key=lambda span: span["start"])
+
+
+def run_ids(records: List[Dict[str, Any]]) -> List[str]:
+    """Run IDs in the order they first appear (oldest first)."""
+    seen: Dict[str, None] = {}
+    for r in records:
+        if r.get("run_id"):
+            seen.setdefault(r["run_id"], None)
+    return list(seen)
+
+
+def _fmt(value, spec="{:.1f}") -> str:
+    return "-" if value is None else spec.format(value)
+
+
+def summarize_run(records: List[Dict[str, Any]], run_id: Optional[str] = None) -> str:
+    """Per-stage table for one run (the latest by default)."""
+    ids = run_ids(records)
+    if not ids:
+        return "No perf spans recorded yet."
+    run_id = run_id or ids[-1]
+    spans = run_spans(records, run_id)
+    if not spans:
+        return f"No spans found for run {run_id}."
+
+    run_record = next((r for r in records if r.get("type") == "run" and r.get("run_id") == run_id), None)
+    lines = [f"Run {run_id}" + (f"  status={run_record['status']}  wall={run_record['wall_s']:.1f}s"
+                                if run_record else "")]
+    header = (f"{'stage':<22}{'status':>7}{'wall s':>9}{'cpu s':>8}{'child s':>9}{'rss MB':>8}"
+              f"{'read MB':>9}{'write MB':>9}{'calls':>6}{'retry':>6}{'hits':>6}{'sleep s':>8}")
+    lines += [header, "-" * len(header)]
+    mb = lambda value: None if value is None else value / 2 ** 20
+    for span in spans:
+        lines.append(
+            f"{span['stage']:<22}{span['status']:>7}{_fmt(span['wall_s']):>9}{_fmt(span.get('cpu_thread_s')):>8}"
+            f"{_fmt(span.get('cpu_children_s')):>9}{_fmt(span.get('peak_rss_mb'), '{:.0f}'):>8}"
+            f"{_fmt(mb(span.get('bytes_read'))):>9}{_fmt(mb(span.get('bytes_written'))):>9}"
+            f"{span.get('api_calls', 0):>6.0f}{span.get('api_retries', 0):>6.0f}"
+            f"{span.get('cache_hits', 0):>6.0f}{_fmt(span.get('sleep_s')):>8}"
+            + ("  (resumed)" if span.get("resumed") else "")
+        )
+    slowest = max(spans, key=lambda span: span["wall_s"])
+    sleep = sum(span.get("sleep_s") or 0 for span in spans)
+    lines.append(f"Slowest stage: {slowest['stage']} ({slowest['wall_s']:.1f}s); "
+                 f"total rate-limit/backoff sleep {sleep:.1f}s")
+    return "\n".join(lines)
+
+
+def compare_runs(records: List[Dict[str, Any]], last: int = 5) -> str:
+    """Stage wall times side by side for the ``last`` most recent runs."""
+    ids = run_ids(records)[-last:]
+    if not ids:
+        return "No perf spans recorded yet."
+    per_run = {run_id: {span["stage"]: span for span in run_spans(records, run_id)} for run_id in ids}
+    stages: List[str] = []
+    for spans in per_run.values():
+        stages += [stage for stage in spans if stage not in stages]
+
+    width = max(len(run_id) for run_id in ids) + 2
+    lines = [f"{'stage':<22}" + "".join(f"{run_id:>{width}}" for run_id in ids)]
+    lines.append("-" * len(lines[0]))
+    for stage in stages:
+        cells = []
+        for run_id in ids:
+            span = per_run[run_id].get(stage)
+            cells.append("-" if span is None else f"{span['wall_s']:.1f}" + ("*" if span["status"] != "ok" else ""))
+        lines.append(f"{stage:<22}" + "".join(f"{cell:>{width}}" for cell in cells))
+    for label, field in (("api calls", "api_calls"), ("sleep s", "sleep_s")):
+        totals = [sum(span.get(field) or 0 for span in per_run[run_id].values()) for run_id in ids]
+        lines.append(f"{label:<22}" + "".join(f"{total:>{width}.1f}" for total in totals))
+    runs = {r["run_id"]: r for r in records if r.get("type") == "run"}
+    lines.append(f"{'run wall s':<22}" + "".join(
+        f"{(_fmt(runs[run_id]['wall_s']) if run_id in runs else '-'):>{width}}" for run_id in ids))
+    lines.append("(* = stage failed)")
+    return "\n".join(lines)
@@ -0,0 +1,208 @@
+"""
+Long-running scheduler for final_pipeline.
+
+The daemon stays up between runs so imported step modules, Gemini clients,
+the API cache and WhisperX models stay loaded. A cron-like schedule
+enqueues pipeline jobs into a durable JobQueue (see job_queue); the daemon
+claims and runs them one at a time, retrying failures with backoff and
+recovering jobs left running by a crashed daemon.
+"""
+
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+from job_queue import DEAD, JobQueue
+from step_failures import EXIT_CODES, PERMANENT
+
+PIPELINE_QUEUE = "pipeline"
+DEFAULT_SCHEDULE = "0 */6 * * *"
+
+
+class CronSchedule:
+    """
+    Standard five-field cron expression (minute hour day-of-month month
+    day-of-week) evaluated in local time. Fields accept ``*``, numbers,
+    ranges ``a-b``, steps ``*/n`` or ``a-b/n`` and comma-separated lists.
+    As in cron, when both day fields are restricted a day matches if either
+    does. Day-of-week 0 and 7 are both Sunday.
+    """
+
+    _RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields, got {len(fields)}: '{expression}'")
+        self.expression = expression
+        parsed = [self._parse_field(field, lo, hi) for field, (lo, hi) in zip(fields, self._RANGES)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = {d % 7 for d in weekdays}
+        self.dom_restricted = fields[2] != "*"
+        self.dow_restricted = fields[4] != "*"
+
+    @staticmethod
+    def _parse_field(field: str, lo: int, hi: int) -> Set[int]:
+        values: Set[int] = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step_text = part.split("/", 1)
+                step = int(step_text)
+                if step < 1:
+                    raise ValueError(f"Invalid cron step in '{field}'")
+            if part == "*":
+                start, end = lo, hi
+            elif "-" in part:
+                start, end = (int(x) for x in part.split("-", 1))
+            else:
+                start = end = int(part)
+            if start < lo or end > hi or start > end:
+                raise ValueError(f"Cron field '{field}' out of range {lo}-{hi}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment: datetime.datetime) -> bool:
+        dom = moment.day in self.days
+        dow = (moment.isoweekday() % 7) in self.weekdays
+        if self.dom_restricted and self.dow_restricted:
+            return dom or dow
+        return dom and dow
+
+    def next_after(self, moment: datetime.datetime) -> datetime.datetime:
+        """First matching minute strictly after ``moment``."""
+        candidate = moment.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = candidate + datetime.timedelta(days=366 * 5)
+        while candidate < limit:
+            if candidate.month not in self.months or not self._day_matches(candidate):
+                candidate = (candidate + datetime.timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = (candidate + datetime.timedelta(hours=1)).replace(minute=0)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += datetime.timedelta(minutes=1)
+                continue
+            return candidate
+        raise ValueError(f"Cron expression '{self.expression}' never matches")
+
+
+def retry_delay_for(attempt: int, base: float = 300.0, cap: float = 3600.0) -> float:
+    """Exponential backoff between job attempts: 5 min, 10 min, 20 min, ... capped at an hour."""
+    return min(base * (2 ** (attempt - 1)), cap)
+
+
+class PipelineDaemon:
+    """
+    Enqueue a job at every schedule tick and run queued jobs in this process.
+
+    ``run_job(payload, attempt)`` runs one pipeline and returns a JSON-able
+    result; it raises (or exits) on failure. Every attempt gets
+    ``payload["run_key"]`` (``job-<id>``) to save its run parameters under,
+    and retries also set ``payload["resume"]`` so they pick up the stored
+    stage outputs of that job's failed attempt instead of starting over.
+    """
+
+    def __init__(self, queue: JobQueue, schedule: CronSchedule, run_job: Callable[[Dict, int], object],
+                 job_payload: Dict, max_attempts: int = 3, lease_seconds: float = 1800.0,
+                 poll_interval: float = 60.0, logger: Optional[logging.Logger] = None):
+        self.queue = queue
+        self.schedule = schedule
+        self.run_job = run_job
+        self.job_payload = dict(job_payload)
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.logger = logger or logging.getLogger(__name__)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def enqueue_run(self, slot: Optional[datetime.datetime] = None) -> Optional[int]:
+        """Queue one pipeline run; scheduled slots are deduplicated across restarts."""
+        dedupe_key = f"schedule:{slot.isoformat()}" if slot else None
+        job_id = self.queue.enqueue(PIPELINE_QUEUE, self.job_payload, max_attempts=self.max_attempts,
+                                    dedupe_key=dedupe_key)
+        if job_id is not None:
+            self.logger.info(f"[DAEMON] Enqueued job {job_id}" + (f" for slot {slot:%Y-%m-%d %H:%M}" if slot else ""))
+        return job_id
+
+    def _keep_lease(self, job_id: int, done: threading.Event) -> None:
+        while not done.wait(self.lease_seconds / 3):
+            if not self.queue.heartbeat(job_id, self.owner, self.lease_seconds):
+                self.logger.warning(f"[DAEMON] Lost the lease on job {job_id}.")
+                return
+
+    def run_one(self) -> bool:
+        """Claim and run one ready job. Returns False if none was ready."""
+        job = self.queue.claim(PIPELINE_QUEUE, self.owner, self.lease_seconds)
+        if job is None:
+            return False
+
+        payload = dict(job.payload, run_key=f"job-{job.id}")
+        if job.attempts > 1:
+            payload["resume"] = True
+        self.logger.info(f"[DAEMON] Running job {job.id} (attempt {job.attempts}/{job.max_attempts})")
+
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._keep_lease, args=(job.id, done), daemon=True)
+        heartbeat.start()
+        try:
+            result = self.run_job(payload, job.attempts)
+        except BaseException as e:
+            if isinstance(e, KeyboardInterrupt):
+                raise
+            if isinstance(e, SystemExit) and e.code in (0, None):
+                result = None
+            else:
+                error = f"{type(e).__name__}: {e}"
+                # A permanent step failure (bad credentials, invalid input) will fail again.
+                retryable = not (isinstance(e, SystemExit) and e.code == EXIT_CODES[PERMANENT])
+                state = self.queue.fail(job.id, self.owner, error, retry_delay=retry_delay_for(job.attempts),
+                                        retryable=retryable)
+                if state == DEAD:
+                    self.logger.error(f"[DAEMON] Job {job.id} failed permanently: {error}")
+                else:
+                    self.logger.warning(f"[DAEMON] Job {job.id} failed ({error}); "
+                                        f"retrying in {retry_delay_for(job.attempts):.0f}s.")
+                return True
+        finally:
+            done.set()
+            heartbeat.join()
+
+        self.queue.complete(job.id, self.owner, result)
+        self.logger.info(f"[DAEMON] Job {job.id} succeeded.")
+        return True
+
+    def serve(self, run_now: bool = False) -> None:
+        """Main loop: recover crashed jobs, then alternate between ticks and queued work."""
+        recovered = self.queue.recover_expired()
+        if recovered:
+            self.logger.warning(f"[DAEMON] Recovered jobs left running by a previous daemon: {recovered}")
+        if run_now:
+            self.enqueue_run()
+
+        next_slot = self.schedule.next_after(datetime.datetime.now())
+        self.logger.info(f"[DAEMON] Schedule '{self.schedule.expression}'; next run at {next_slot:%Y-%m-%d %H:%M}.")
+        while not self._stop.is_set():
+            now = datetime.datetime.now()
+            if now >= next_slot:
+                self.enqueue_run(next_slot)
+                next_slot = self.schedule.next_after(now)
+                self.logger.info(f"[DAEMON] Next scheduled run at {next_slot:%Y-%m-%d %H:%M}.")
+
+            self.queue.recover_expired()
+            if self.run_one():
+                continue
+
+            wake_times: List[float] = [next_slot.timestamp(), time.time() + self.poll_interval]
+            ready = self.queue.next_ready_time(PIPELINE_QUEUE)
+            if ready is not None:
+                wake_times.append(ready)
+            self._stop.wait(max(min(wake_times) - time.time(), 0.0))
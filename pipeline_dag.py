@@ -0,0 +1,243 @@
+"""
+Dependency-graph scheduler for the pipeline stages.
+
+final_pipeline declares each stage with the stages it depends on; the
+scheduler starts every stage as soon as its dependencies have finished, so
+independent branches (e.g. image generation and TTS) run concurrently on a
+thread pool. Per-stage timings are recorded so the critical path of a run
+can be reported afterwards.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Tuple
+
+
+@dataclass
+class Stage:
+    """
+    One node of the pipeline graph. ``func`` receives a dict mapping each
+    dependency's name to its output and returns this stage's output.
+    ``kind`` is "api" for stages bound by remote calls and "cpu" for local
+    rendering/inference work.
+    """
+    name: str
+    func: Callable[[Dict[str, Any]], Any]
+    deps: Tuple[str, ...] = ()
+    kind: str = "cpu"
+
+
+@dataclass
+class StageTiming:
+    name: str
+    deps: Tuple[str, ...]
+    start: float
+    end: float
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+@dataclass
+class DagRun:
+    """Outputs and timings of one scheduler run."""
+    outputs: Dict[str, Any] = field(default_factory=dict)
+    timings: Dict[str, StageTiming] = field(default_factory=dict)
+    failures: Dict[str, BaseException] = field(default_factory=dict)
+    skipped: List[str] = field(default_factory=list)
+    started: float = 0.0
+    finished: float = 0.0
+
+    @property
+    def wall_time(self) -> float:
+        return self.finished - self.started
+
+
+class StageFailed(Exception):
+    """Raised by DagScheduler.run when a stage raised; the original is chained."""
+
+    def __init__(self, stage: str, error: BaseException):
+        super().__init__(f"Stage '{stage}' failed: {type(error).__name__}: {error}")
+        self.stage = stage
+        self.error = error
+
+
+def topological_order(stages: List[Stage]) -> List[str]:
+    """Return stage names in dependency order, validating names and acyclicity."""
+    by_name: Dict[str, Stage] = {}
+    for stage in stages:
+        if stage.name in by_name:
+            raise ValueError(f"Duplicate stage name: {stage.name}")
+        by_name[stage.name] = stage
+    for stage in stages:
+        for dep in stage.deps:
+            if dep not in by_name:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dep}'")
+
+    order: List[str] = []
+    state: Dict[str, int] = {}  # 1 = visiting, 2 = done
+
+    def visit(name: str, path: Tuple[str, ...]):
+        if state.get(name) == 2:
+            return
+        if state.get(name) == 1:
+            raise ValueError(f"Dependency cycle: {' -> '.join(path + (name,))}")
+        state[name] = 1
+        for dep in by_name[name].deps:
+            visit(dep, path + (name,))
+        state[name] = 2
+        order.append(name)
+
+    for stage in stages:
+        visit(stage.name, ())
+    return order
+
+
+class DagScheduler:
+    """
+    Run a set of stages, each as soon as all of its dependencies are done.
+    ``limits`` caps how many stages of each ``kind`` run at once (e.g. a few
+    concurrent API calls but only one CPU-heavy render); kinds without a
+    limit are bounded only by ``max_workers``. ``stage_context(stage)``, if
+    given, returns a context manager entered around each stage (e.g. a
+    perf span).
+    """
+
+    def __init__(self, stages: List[Stage], max_workers: int = 4, logger: Optional[logging.Logger] = None,
+                 limits: Optional[Dict[str, int]] = None, fail_fast: bool = True,
+                 stage_context: Optional[Callable[[Stage], ContextManager]] = None):
+        self.order = topological_order(stages)
+        self.stages = {stage.name: stage for stage in stages}
+        if max_workers < 1:
+            raise ValueError(f"max_workers must be at least 1, got {max_workers}")
+        for kind, limit in (limits or {}).items():
+            if limit < 1:
+                raise ValueError(f"Concurrency limit for '{kind}' stages must be at least 1, got {limit}")
+        self.max_workers = max_workers
+        self.logger = logger or logging.getLogger(__name__)
+        self.limits = dict(limits or {})
+        self.fail_fast = fail_fast
+        self.stage_context = stage_context or (lambda stage: nullcontext())
+
+    def _dependents(self, name: str) -> List[str]:
+        """All stages that transitively depend on ``name``."""
+        found: List[str] = []
+        frontier = [name]
+        while frontier:
+            current = frontier.pop()
+            for other in self.order:
+                if current in self.stages[other].deps and other not in found:
+                    found.append(other)
+                    frontier.append(other)
+        return found
+
+    def _run_stage(self, stage: Stage, inputs: Dict[str, Any], run: DagRun, lock: threading.Lock):
+        start = time.time()
+        self.logger.info(f"[DAG] Starting stage '{stage.name}' ({stage.kind})")
+        try:
+            with self.stage_context(stage):
+                return stage.func(inputs)
+        finally:
+            end = time.time()
+            with lock:
+                run.timings[stage.name] = StageTiming(stage.name, stage.deps, start, end)
+            self.logger.info(f"[DAG] Stage '{stage.name}' finished in {end - start:.1f}s")
+
+    def run(self) -> DagRun:
+        """
+        Execute the graph. With ``fail_fast`` (the default), a failing stage
+        stops any further stages from starting, the ones already running are
+        allowed to finish, and StageFailed is raised for the first failure.
+        Otherwise only the failed stage's dependents are skipped, independent
+        branches run to completion, and failures are reported on the
+        returned DagRun.
+        """
+        run = DagRun(started=time.time())
+        lock = threading.Lock()
+        pending = list(self.order)
+        running = {}
+        active: Dict[str, int] = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="stage") as pool:
+            while pending or running:
+                if not (self.fail_fast and run.failures):
+                    for name in [n for n in pending if all(d in run.outputs for d in self.stages[n].deps)]:
+                        stage = self.stages[name]
+                        if active.get(stage.kind, 0) >= self.limits.get(stage.kind, self.max_workers):
+                            continue
+                        active[stage.kind] = active.get(stage.kind, 0) + 1
+                        inputs = {dep: run.outputs[dep] for dep in stage.deps}
+                        running[pool.submit(self._run_stage, stage, inputs, run, lock)] = name
+                        pending.remove(name)
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    active[self.stages[name].kind] -= 1
+                    error = future.exception()
+                    if error is None:
+                        run.outputs[name] = future.result()
+                        continue
+                    run.failures[name] = error
+                    if not self.fail_fast:
+                        for dependent in self._dependents(name):
+                            if dependent in pending:
+                                pending.remove(dependent)
+                                run.skipped.append(dependent)
+                        self.logger.error(f"[DAG] Stage '{name}' failed ({type(error).__name__}: {error}); "
+                                          f"skipping its dependents.")
+
+        run.finished = time.time()
+        if self.fail_fast and run.failures:
+            name, error = next(iter(run.failures.items()))
+            raise StageFailed(name, error) from error
+        if pending:
+            # Nothing left running yet stages remain: none of them could ever start.
+            raise RuntimeError(f"Stages never scheduled: {', '.join(pending)}")
+        return run
+
+
+def critical_path(timings: Dict[str, StageTiming]) -> Tuple[List[str], float]:
+    """
+    Return the chain of dependent stages with the largest summed duration,
+    i.e. the stages that bounded this run's wall time, and that sum.
+    """
+    best: Dict[str, Tuple[float, Optional[str]]] = {}
+
+    def longest(name: str) -> float:
+        if name not in best:
+            timing = timings[name]
+            prev, prev_total = None, 0.0
+            for dep in timing.deps:
+                if dep in timings and longest(dep) > prev_total:
+                    prev, prev_total = dep, longest(dep)
+            best[name] = (prev_total + timing.duration, prev)
+        return best[name][0]
+
+    if not timings:
+        return [], 0.0
+    tail = max(timings, key=longest)
+    path = []
+    node: Optional[str] = tail
+    while node is not None:
+        path.append(node)
+        node = best[node][1]
+    path.reverse()
+    return path, best[tail][0]
+
+
+def format_critical_path(run: DagRun) -> str:
+    """Human-readable critical-path report for the pipeline log."""
+    path, total = critical_path(run.timings)
+    chain = " -> ".join(f"{name} ({run.timings[name].duration:.1f}s)" for name in path)
+    lines = [f"[CRITICAL PATH] {total:.1f}s of {run.wall_time:.1f}s wall: {chain}"]
+    serial = sum(t.duration for t in run.timings.values())
+    lines.append(f"[CRITICAL PATH] Sum of stage times {serial:.1f}s; "
+                 f"overlap saved {max(serial - run.wall_time, 0.0):.1f}s")
+    return "\n".join(lines)
@@ -0,0 +1,88 @@
+"""
+Typed payloads passed between pipeline steps.
+
+Each step module exposes a ``run(...)`` entry point that takes and returns
+these objects, so final_pipeline can call the steps in-process instead of
+serialising everything through argv and files.
+"""
+
+import json
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+
+class StepError(Exception):
+    """
+    Raised by a step's ``run`` when it cannot produce its output.
+    ``failure_class`` is one of the step_failures classes (transient, quota,
+    permanent); None leaves classification to the orchestrator.
+    """
+
+    def __init__(self, message: str, failure_class: Optional[str] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.failure_class = failure_class
+        self.retry_after = retry_after
+
+
+@dataclass
+class NewsPayload:
+    """Step 1 output: the metadata for one video."""
+    title: str
+    description: str
+    tags: List[str]
+    hook: str
+    image_prompt: Optional[str] = None
+    # Title, description and URL of the news article the video is about
+    source: Optional[Dict[str, str]] = None
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        for optional in ("image_prompt", "source"):
+            if data[optional] is None:
+                del data[optional]
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "NewsPayload":
+        return cls(
+            title=data.get("title", ""),
+            description=data.get("description", ""),
+            tags=list(data.get("tags", [])),
+            hook=data.get("hook", ""),
+            image_prompt=data.get("image_prompt"),
+            source=data.get("source"),
+        )
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> "NewsPayload":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+
+@dataclass
+class ImagesResult:
+    """Step 2 output: the folder holding the generated images."""
+    folder: str
+    paths: List[str] = field(default_factory=list)
+    requested: int = 0
+
+    @property
+    def partial(self) -> bool:
+        """True if some of the requested images could not be generated."""
+        return 0 < len(self.paths) < self.requested
+
+
+@dataclass
+class VideoResult:
+    """Step 3/4 output: a rendered video file."""
+    path: str
+
+
+@dataclass
+class UploadResult:
+    """Step 5 output: the uploaded YouTube video ID."""
+    video_id: Optional[str]
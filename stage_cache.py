@@ -0,0 +1,243 @@
+"""
+Content-addressed memoization of pipeline stage outputs.
+
+Every stage's result is stored under a hash of the stage name, its
+parameters and the content digests of the stages it consumed. Files a stage
+produced (news JSON, images, slideshow, TTS audio, SRT, videos) are copied
+into the store, so a resumed run can restore them and skip the stage
+instead of re-billing Gemini, ImageRouter or ElevenLabs.
+
+Layout::
+
+    .stage_cache/
+        last_run.json               parameters of the most recent run (seed, voice, ...)
+        run_state/<run key>.json    parameters of a keyed run (e.g. one daemon job)
+        <stage>/<key>/manifest.json output value, digest and file list
+        <stage>/<key>/files/...     copies of the files the stage produced
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+import perf_spans
+from pipeline_dag import Stage
+
+# Bump when stage semantics change so old entries stop matching.
+STAGE_CACHE_VERSION = 1
+DEFAULT_STAGE_CACHE_DIR = ".stage_cache"
+RUN_STATE_FILE = "last_run.json"
+RUN_STATE_DIR = "run_state"
+KEEP_RUN_STATES = 50
+
+
+def _hash_file(path: str, digest) -> None:
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+
+def hash_paths(paths: List[str]) -> str:
+    """Content hash of files and (recursively) directories, independent of mtimes."""
+    digest = hashlib.sha256()
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    full = os.path.join(root, name)
+                    digest.update(os.path.relpath(full, path).encode("utf-8"))
+                    _hash_file(full, digest)
+        elif os.path.exists(path):
+            digest.update(os.path.basename(path).encode("utf-8"))
+            _hash_file(path, digest)
+    return digest.hexdigest()
+
+
+@dataclass
+class StageRecord:
+    """A stored stage result: the JSON-encoded output and its content digest."""
+    output: Any
+    digest: str
+
+
+class StageStore:
+    """On-disk store of stage results keyed by input hash."""
+
+    def __init__(self, root: str = DEFAULT_STAGE_CACHE_DIR, keep_per_stage: int = 5):
+        self.root = root
+        self.keep_per_stage = keep_per_stage
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def key(stage: str, params: Dict[str, Any], input_digests: Dict[str, str]) -> str:
+        payload = json.dumps(
+            {"v": STAGE_CACHE_VERSION, "stage": stage, "params": params, "inputs": input_digests},
+            sort_keys=True, default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _entry_dir(self, stage: str, key: str) -> str:
+        return os.path.join(self.root, stage, key)
+
+    def load(self, stage: str, key: str) -> Optional[StageRecord]:
+        """
+        Return the stored record for ``key`` and copy its files back to the
+        paths the stage originally wrote them to, or None on a miss.
+        """
+        entry = self._entry_dir(stage, key)
+        try:
+            with open(os.path.join(entry, "manifest.json"), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        for original, stored in manifest["files"].items():
+            stored = os.path.join(entry, "files", stored)
+            if os.path.isdir(stored):
+                shutil.copytree(stored, original, dirs_exist_ok=True)
+            else:
+                parent = os.path.dirname(original)
+                if parent:
+                    os.makedirs(parent, exist_ok=True)
+                shutil.copy2(stored, original)
+        os.utime(entry)  # mark as recently used for pruning
+        return StageRecord(output=manifest["output"], digest=manifest["digest"])
+
+    def save(self, stage: str, key: str, output: Any, paths: List[str]) -> StageRecord:
+        """Store ``output`` (JSON-serialisable) and copies of ``paths`` under ``key``."""
+        digest = hashlib.sha256()
+        digest.update(json.dumps(output, sort_keys=True, default=str).encode("utf-8"))
+        digest.update(hash_paths(paths).encode("utf-8"))
+        record = StageRecord(output=output, digest=digest.hexdigest())
+
+        stage_dir = os.path.join(self.root, stage)
+        os.makedirs(stage_dir, exist_ok=True)
+        tmp = os.path.join(stage_dir, f".tmp-{uuid.uuid4().hex}")
+        files = {}
+        try:
+            os.makedirs(os.path.join(tmp, "files"))
+            for i, path in enumerate(p for p in paths if os.path.exists(p)):
+                stored = f"{i}_{os.path.basename(os.path.normpath(path))}"
+                target = os.path.join(tmp, "files", stored)
+                if os.path.isdir(path):
+                    shutil.copytree(path, target)
+                else:
+                    shutil.copy2(path, target)
+                files[path] = stored
+            with open(os.path.join(tmp, "manifest.json"), "w", encoding="utf-8") as f:
+                json.dump({"stage": stage, "output": output, "digest": record.digest,
+                           "files": files, "created": time.time()}, f, ensure_ascii=False, indent=2)
+            entry = self._entry_dir(stage, key)
+            if os.path.exists(entry):
+                shutil.rmtree(entry)
+            os.replace(tmp, entry)
+        finally:
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp, ignore_errors=True)
+
+        self.prune(stage)
+        return record
+
+    def prune(self, stage: str) -> None:
+        """Keep only the ``keep_per_stage`` most recently used entries of ``stage``."""
+        stage_dir = os.path.join(self.root, stage)
+        entries = [os.path.join(stage_dir, name) for name in os.listdir(stage_dir) if not name.startswith(".")]
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for old in entries[self.keep_per_stage:]:
+            shutil.rmtree(old, ignore_errors=True)
+
+    def _run_state_path(self, run_key: Optional[str]) -> str:
+        if run_key is None:
+            return os.path.join(self.root, RUN_STATE_FILE)
+        return os.path.join(self.root, RUN_STATE_DIR, f"{run_key}.json")
+
+    def load_run_state(self, run_key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Parameters of the most recent run, or of the run saved under ``run_key``."""
+        try:
+            with open(self._run_state_path(run_key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_run_state(self, state: Dict[str, Any], run_key: Optional[str] = None) -> None:
+        path = self._run_state_path(run_key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp, path)
+        if run_key is not None:
+            self._prune_run_states()
+
+    def _prune_run_states(self) -> None:
+        """Keep only the ``KEEP_RUN_STATES`` most recently saved keyed run states."""
+        state_dir = os.path.join(self.root, RUN_STATE_DIR)
+        entries = [os.path.join(state_dir, name) for name in os.listdir(state_dir) if name.endswith(".json")]
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for old in entries[KEEP_RUN_STATES:]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+
+def _identity(value):
+    return value
+
+
+class StageMemo:
+    """
+    Wraps DAG stages so their outputs are stored in a StageStore and, when
+    ``resume`` is set, reused whenever the stage's key is already present.
+    Digests of finished stages are tracked here so downstream keys depend on
+    the content their inputs actually had.
+    """
+
+    def __init__(self, store: StageStore, resume: bool = False, logger: Optional[logging.Logger] = None):
+        self.store = store
+        self.resume = resume
+        self.logger = logger or logging.getLogger(__name__)
+        self.digests: Dict[str, str] = {}
+        self.hits: List[str] = []
+        self._lock = threading.Lock()
+
+    def wrap(self, stage: Stage, params: Optional[Dict[str, Any]] = None,
+             files: Callable[[Any], List[str]] = lambda output: [],
+             encode: Callable[[Any], Any] = _identity, decode: Callable[[Any], Any] = _identity) -> Stage:
+        """
+        Return a memoized copy of ``stage``. ``files(output)`` lists the paths
+        the stage produced; ``encode``/``decode`` convert its output to and
+        from JSON.
+        """
+        params = dict(params or {})
+
+        def func(inputs):
+            with self._lock:
+                input_digests = {dep: self.digests[dep] for dep in stage.deps}
+            key = self.store.key(stage.name, params, input_digests)
+
+            if self.resume:
+                record = self.store.load(stage.name, key)
+                if record is not None:
+                    self.logger.info(f"[RESUME] Stage '{stage.name}' inputs unchanged; reusing stored output.")
+                    perf_spans.annotate(resumed=True)
+                    with self._lock:
+                        self.digests[stage.name] = record.digest
+                        self.hits.append(stage.name)
+                    return decode(record.output)
+
+            output = stage.func(inputs)
+            record = self.store.save(stage.name, key, encode(output), files(output))
+            with self._lock:
+                self.digests[stage.name] = record.digest
+            return output
+
+        return Stage(stage.name, func, stage.deps, stage.kind)
@@ -0,0 +1,300 @@
+"""
+Distributed execution of pipeline stages.
+
+The coordinator (``final_pipeline.py run --task-queue ...``) still builds
+and schedules the stage graph, but instead of calling a stage's runner
+itself it submits a task naming the runner and its arguments to a
+TaskQueue and waits for the result. Stage workers
+(``final_pipeline.py worker --kinds api`` / ``--kinds cpu``) on any number
+of machines lease tasks of their kinds, run them and report back, so
+API-bound and CPU-bound stages can live on different worker pools.
+
+Files pass between nodes through a shared artifact directory (the
+workspace root, e.g. an NFS mount): paths under it travel as
+``{"__artifact__": <relative path>}`` and are re-rooted on each node, so
+the mount point may differ per machine. API keys never enter the queue;
+tasks refer to them by name (KeyRef) and every worker resolves them from
+its own environment. NewsPayload arguments and results are sent as dicts.
+
+TaskQueue is the backend interface; SQLiteTaskQueue implements it on top
+of job_queue.JobQueue for a single host or for testing (SQLite locking is
+not reliable on network filesystems, so a multi-host deployment needs a
+server-backed implementation of the same six methods).
+"""
+
+import abc
+import logging
+import os
+import re
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Sequence
+
+import perf_spans
+from job_queue import DEAD, RUNNING, SUCCEEDED, Job, JobQueue
+from pipeline_types import NewsPayload, StepError
+from step_failures import CLASS_BY_EXIT_CODE, TRANSIENT, StepFailure
+
+DEFAULT_TASK_QUEUE = os.path.join(".pipeline_jobs", "stages.sqlite3")
+STAGE_QUEUE_PREFIX = "stages."
+STAGE_KINDS = ("api", "cpu")
+DEFAULT_LEASE_SECONDS = 600.0
+TASK_MAX_ATTEMPTS = 2
+# Task errors are stored as "[<failure class>] <message>".
+_ERROR_PATTERN = re.compile(r"^\[(\w+)\] ")
+
+
+class KeyRef:
+    """Placeholder for an API key; workers substitute their own value for ``name``."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self) -> str:
+        return f"KeyRef({self.name!r})"
+
+
+class ArtifactCodec:
+    """
+    Converts task arguments and results to JSON and back, relativising
+    paths under ``artifact_dir`` and resolving KeyRefs against ``keys``.
+    """
+
+    def __init__(self, artifact_dir: str, keys: Optional[Dict[str, str]] = None):
+        self.artifact_dir = os.path.abspath(artifact_dir)
+        self.keys = keys or {}
+
+    def encode(self, value: Any) -> Any:
+        if isinstance(value, KeyRef):
+            return {"__key__": value.name}
+        if isinstance(value, NewsPayload):
+            return {"__news__": value.to_dict()}
+        if isinstance(value, str) and os.path.isabs(value):
+            relative = os.path.relpath(value, self.artifact_dir)
+            if not relative.startswith(os.pardir):
+                return {"__artifact__": relative.replace(os.sep, "/")}
+            return value
+        if isinstance(value, (list, tuple)):
+            return [self.encode(v) for v in value]
+        if isinstance(value, dict):
+            return {k: self.encode(v) for k, v in value.items()}
+        return value
+
+    def decode(self, value: Any) -> Any:
+        if isinstance(value, list):
+            return [self.decode(v) for v in value]
+        if isinstance(value, dict):
+            if "__key__" in value:
+                return self.keys.get(value["__key__"])
+            if "__news__" in value:
+                return NewsPayload.from_dict(value["__news__"])
+            if "__artifact__" in value:
+                return os.path.join(self.artifact_dir, *value["__artifact__"].split("/"))
+            return {k: self.decode(v) for k, v in value.items()}
+        return value
+
+
+class TaskQueue(abc.ABC):
+    """Backend interface for stage tasks. Tasks are job_queue.Job records."""
+
+    @abc.abstractmethod
+    def submit(self, kind: str, payload: Dict[str, Any], max_attempts: int = TASK_MAX_ATTEMPTS) -> int:
+        ...
+
+    @abc.abstractmethod
+    def lease(self, kinds: Sequence[str], owner: str, lease_seconds: float) -> Optional[Job]:
+        ...
+
+    @abc.abstractmethod
+    def heartbeat(self, task_id: int, owner: str, lease_seconds: float) -> bool:
+        ...
+
+    @abc.abstractmethod
+    def finish(self, task_id: int, owner: str, result: Any = None, failure: Optional[StepFailure] = None) -> None:
+        ...
+
+    @abc.abstractmethod
+    def get(self, task_id: int) -> Optional[Job]:
+        ...
+
+    @abc.abstractmethod
+    def cancel(self, task_id: int, reason: str) -> bool:
+        """Withdraw a task no worker has leased; False if one already has."""
+
+
+class SQLiteTaskQueue(TaskQueue):
+    """TaskQueue on a local JobQueue file, one queue per stage kind."""
+
+    def __init__(self, path: str):
+        self.jobs = JobQueue(path)
+
+    def submit(self, kind: str, payload: Dict[str, Any], max_attempts: int = TASK_MAX_ATTEMPTS) -> int:
+        return self.jobs.enqueue(STAGE_QUEUE_PREFIX + kind, payload, max_attempts=max_attempts)
+
+    def lease(self, kinds: Sequence[str], owner: str, lease_seconds: float) -> Optional[Job]:
+        self.jobs.recover_expired()
+        for kind in kinds:
+            job = self.jobs.claim(STAGE_QUEUE_PREFIX + kind, owner, lease_seconds)
+            if job is not None:
+                return job
+        return None
+
+    def heartbeat(self, task_id: int, owner: str, lease_seconds: float) -> bool:
+        return self.jobs.heartbeat(task_id, owner, lease_seconds)
+
+    def finish(self, task_id: int, owner: str, result: Any = None, failure: Optional[StepFailure] = None) -> None:
+        # Runners retry internally, so a reported failure is final; only a
+        # crashed worker (expired lease) gets the task re-run elsewhere.
+        if failure is None:
+            self.jobs.complete(task_id, owner, result)
+        else:
+            self.jobs.fail(task_id, owner, f"[{failure.failure_class}] {failure.message}", retryable=False)
+
+    def get(self, task_id: int) -> Optional[Job]:
+        self.jobs.recover_expired()
+        return self.jobs.get(task_id)
+
+    def cancel(self, task_id: int, reason: str) -> bool:
+        return self.jobs.cancel(task_id, f"[{TRANSIENT}] {reason}")
+
+
+def open_task_queue(location: str) -> TaskQueue:
+    """
+    Task queue backend for ``location``: a plain file path or
+    ``sqlite:///relative/path`` / ``sqlite:////absolute/path``. Other
+    backends register a URL scheme here.
+    """
+    scheme, sep, rest = location.partition("://")
+    if not sep:
+        return SQLiteTaskQueue(location)
+    if scheme == "sqlite":
+        return SQLiteTaskQueue(rest[1:] if rest.startswith("/") else rest)
+    raise ValueError(f"Unsupported task queue backend '{scheme}' in '{location}'")
+
+
+class RemoteStageError(StepError):
+    """A stage task failed on a worker."""
+
+
+class StageRunner:
+    """
+    Calls stage runners by name. Without a queue they run in this process;
+    with one, each call becomes a task and blocks until a worker finishes it.
+    A task that sits in the queue for ``queue_timeout`` seconds without a
+    worker holding it (none serves its kind, or they all died) is withdrawn
+    and fails as transient.
+    """
+
+    def __init__(self, ops: Dict[str, Callable[..., Any]], queue: Optional[TaskQueue] = None,
+                 codec: Optional[ArtifactCodec] = None, poll_interval: float = 1.0,
+                 queue_timeout: float = DEFAULT_LEASE_SECONDS * TASK_MAX_ATTEMPTS,
+                 logger: Optional[logging.Logger] = None):
+        self.ops = ops
+        self.queue = queue
+        self.codec = codec
+        self.poll_interval = poll_interval
+        self.queue_timeout = queue_timeout
+        self.logger = logger or logging.getLogger(__name__)
+
+    def call(self, op: str, *args: Any, kind: str = "cpu", **kwargs: Any) -> Any:
+        if self.queue is None:
+            return self.ops[op](*args, **kwargs)
+
+        tracer = perf_spans.current_tracer()
+        payload = {
+            "op": op,
+            "args": self.codec.encode(list(args)),
+            "kwargs": self.codec.encode(kwargs),
+            "run_id": tracer.run_id if tracer else None,
+            "stage": perf_spans.current_stage() or op,
+        }
+        task_id = self.queue.submit(kind, payload)
+        self.logger.info(f"[DISPATCH] {payload['stage']} -> task {task_id} on the '{kind}' queue.")
+        deadline = time.monotonic() + self.queue_timeout
+        while True:
+            task = self.queue.get(task_id)
+            if task.state == RUNNING:
+                # A worker holds the lease and heartbeats; wait as long as it keeps going.
+                deadline = time.monotonic() + self.queue_timeout
+            elif task.state not in (SUCCEEDED, DEAD) and time.monotonic() >= deadline:
+                if self.queue.cancel(task_id, f"no '{kind}' worker ran it within {self.queue_timeout:g}s"):
+                    raise RemoteStageError(f"Task {task_id} ({payload['stage']}) was not picked up by any '{kind}' "
+                                           f"worker within {self.queue_timeout:g}s", failure_class=TRANSIENT)
+                continue
+            if task.state == SUCCEEDED:
+                self.logger.info(f"[DISPATCH] Task {task_id} ({payload['stage']}) finished by {task.result['worker']}.")
+                return self.codec.decode(task.result["value"])
+            if task.state == DEAD:
+                match = _ERROR_PATTERN.match(task.last_error or "")
+                raise RemoteStageError(f"Task {task_id} ({payload['stage']}) failed: {task.last_error}",
+                                       failure_class=match.group(1) if match else None)
+            time.sleep(self.poll_interval)
+
+
+class StageWorker:
+    """Leases stage tasks of the given kinds and runs them with ``ops``."""
+
+    def __init__(self, queue: TaskQueue, ops: Dict[str, Callable[..., Any]], codec: ArtifactCodec,
+                 kinds: Sequence[str] = STAGE_KINDS, lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                 poll_interval: float = 2.0, logger: Optional[logging.Logger] = None):
+        self.queue = queue
+        self.ops = ops
+        self.codec = codec
+        self.kinds = list(kinds)
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.logger = logger or logging.getLogger(__name__)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _keep_lease(self, task_id: int, done: threading.Event) -> None:
+        while not done.wait(self.lease_seconds / 3):
+            if not self.queue.heartbeat(task_id, self.owner, self.lease_seconds):
+                self.logger.warning(f"[WORKER] Lost the lease on task {task_id}.")
+                return
+
+    def run_one(self) -> bool:
+        """Lease and run one task. Returns False if none was ready."""
+        task = self.queue.lease(self.kinds, self.owner, self.lease_seconds)
+        if task is None:
+            return False
+
+        payload = task.payload
+        self.logger.info(f"[WORKER] Running task {task.id}: {payload['stage']} ({payload['op']})")
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._keep_lease, args=(task.id, done), daemon=True)
+        heartbeat.start()
+        tracer = perf_spans.Tracer(run_id=payload.get("run_id"))
+        try:
+            with tracer.span(f"{payload['stage']} (worker)", kind=task.queue[len(STAGE_QUEUE_PREFIX):],
+                             worker=self.owner):
+                value = self.ops[payload["op"]](*self.codec.decode(payload["args"]),
+                                                **self.codec.decode(payload["kwargs"]))
+        except BaseException as e:
+            if isinstance(e, KeyboardInterrupt):
+                raise
+            failure = StepFailure.from_exception(e)
+            if isinstance(e, SystemExit):
+                # The runner gave up after its own retries and exited with the failure's code.
+                failure.failure_class = CLASS_BY_EXIT_CODE.get(e.code, failure.failure_class)
+            self.logger.error(f"[WORKER] Task {task.id} failed [{failure.failure_class}]: {failure.message}")
+            self.queue.finish(task.id, self.owner, failure=failure)
+            return True
+        finally:
+            done.set()
+            heartbeat.join()
+
+        self.queue.finish(task.id, self.owner, result={"value": self.codec.encode(value), "worker": self.owner})
+        self.logger.info(f"[WORKER] Task {task.id} done.")
+        return True
+
+    def serve(self) -> None:
+        self.logger.info(f"[WORKER] {self.owner} serving {', '.join(self.kinds)} stages "
+                         f"(artifacts in {self.codec.artifact_dir}).")
+        while not self._stop.is_set():
+            if not self.run_one():
+                self._stop.wait(self.poll_interval)
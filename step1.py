@@ -1,6 +1,6 @@
 # To get the latest and trending news (its tittle, its description and the tags)
 
-from google import genai
+from gemini_client import get_client
 from google.genai.types import GenerateContentConfig
 # import os
 import datetime
@@ -42,8 +42,8 @@ def safe_generate_content(client, model, prompt, max_retries=5):
 
 def generate_trending_news_content(api_key):
     """Generate information about the latest trending news using Google Gemini."""
-    # Configure the Gemini API client
-    client = genai.Client(api_key=api_key)
+    # Shared Gemini client (reused across calls)
+    client = get_client(api_key)
     
     # Current date context to help the model generate timely content
     current_date = get_formatted_date()
@@ -1,4 +1,4 @@
-import requests
+import http_client
 import argparse
 import json
 import time
@@ -14,7 +14,7 @@ def get_latest_news(api_key, max_retries=3):
     
     for attempt in range(max_retries):
         try:
-            response = requests.get(url, params=params, timeout=10)
+            response = http_client.get("newsapi", url, params=params, timeout=10)
             response.raise_for_status()  # Raise HTTP errors
             data = response.json()
             
@@ -45,7 +45,7 @@ def scrape_google_news():
     }
     
     try:
-        response = requests.get(url, headers=headers, timeout=10)
+        response = http_client.get("google_news", url, headers=headers, timeout=10)
         response.raise_for_status()
         soup = BeautifulSoup(response.text, "html.parser")
         
@@ -64,11 +64,13 @@ def scrape_google_news():
     except Exception as e:
         raise Exception(f"Google News scraping failed: {str(e)}")
     
-news_data = scrape_google_news()
-output = "news_data.json"
-with open(output, "w") as f:
-    json.dump(news_data, f, indent=2)
-    
+# The pipeline gets Google News through news_sources; scrape only when run directly.
+if __name__ == "__main__":
+    news_data = scrape_google_news()
+    output = "news_data.json"
+    with open(output, "w") as f:
+        json.dump(news_data, f, indent=2)
+
 
     
 # def get_news_safely(api_key):
@@ -1,12 +1,12 @@
 # getting the latest news headlines using NewsData.io and proccessing it through Gemini API to generate a YouTube video description, hashtags, and a hook.
 
 import sys
-import requests
 import os
 import json
 import re
 import time
 import argparse
+import asyncio
 
 # --- FIX: Set UTF-8 encoding for proper Unicode support on Windows ---
 if sys.platform == "win32":
@@ -14,20 +14,17 @@ if sys.platform == "win32":
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
 # --- Import caching and rate limiting utilities ---
-from api_utils import get_cache, get_rate_limiter, call_with_cache_and_limits
-
-# --- Import Gemini API (try new SDK first, fallback to old) ---
-try:
-    # New SDK (0.8.5+)
-    from google import genai
-    from google.genai.types import GenerateContentConfig
-    GEMINI_SDK_VERSION = "new"
-except ImportError:
-    # Old SDK (0.8.5 and earlier)
-    import google.generativeai as genai
-    GenerateContentConfig = None
-    GEMINI_SDK_VERSION = "old"
-    print("[INFO] Using old Gemini SDK version")
+from api_utils import (get_cache, get_rate_limiter, call_with_cache_and_limits,
+                       async_call_with_cache_and_limits, gather_bounded)
+
+# --- Shared Gemini client registry (handles both SDK versions) ---
+from gemini_client import generate_text, generate_text_async
+from pipeline_types import NewsPayload, StepError
+from news_sources import configured_sources, fetch_newsdata, gather_articles
+from news_store import article_key, get_news_store
+from step_failures import PERMANENT, run_step_main
+from story_index import get_story_index, similarity, simhash
+from story_ranking import RankingWeights, StoryRanker
 
 # Gemini API system instruction
 GEMINI_SYSTEM_INSTRUCTION = """You are a helpful and professional content assistant specialized in optimizing YouTube video content. Your job is to generate concise, engaging, and YouTube-compliant content for creators. Follow YouTube's Community Guidelines strictly while avoiding hate speech, violence, adult content, or misleading claims.
@@ -51,28 +48,9 @@ def gemini_generate(api_key, prompt, model="gemini-1.5-flash", retries=3, delay=
     rate_limiter = get_rate_limiter()
 
     def api_call():
-        """Actual API call function - works with both SDK versions."""
+        """Actual API call function - uses the shared client for either SDK version."""
         try:
-            if GEMINI_SDK_VERSION == "new":
-                # New SDK syntax
-                client = genai.Client(api_key=api_key)
-                response = client.models.generate_content(
-                    model=model,
-                    contents=prompt,
-                    config=GenerateContentConfig(
-                        system_instruction=GEMINI_SYSTEM_INSTRUCTION,
-                    ),
-                )
-            else:
-                # Old SDK syntax
-                genai.configure(api_key=api_key)
-                model_obj = genai.GenerativeModel(
-                    model_name=model,
-                    system_instruction=GEMINI_SYSTEM_INSTRUCTION
-                )
-                response = model_obj.generate_content(prompt)
-
-            return response.text.strip() if response and hasattr(response, 'text') else None
+            return generate_text(api_key, model, prompt, system_instruction=GEMINI_SYSTEM_INSTRUCTION)
         except Exception as e:
             print(f"[API ERROR] {type(e).__name__}: {e}")
             raise
@@ -84,7 +62,9 @@ def gemini_generate(api_key, prompt, model="gemini-1.5-flash", retries=3, delay=
         api_name="gemini",
         input_text=prompt,
         api_call_func=api_call,
-        max_retries=retries
+        max_retries=retries,
+        model=model,
+        system_instruction=GEMINI_SYSTEM_INSTRUCTION
     )
 
     if result:
@@ -93,20 +73,44 @@ def gemini_generate(api_key, prompt, model="gemini-1.5-flash", retries=3, delay=
         print(f"[ERROR] Gemini API failed after {retries} attempts")
         return None
 
+async def gemini_generate_async(api_key, prompt, model="gemini-1.5-flash", retries=3):
+    """
+    Asyncio variant of gemini_generate. Shares the same cache and rate limiter,
+    so concurrent prompts still respect the per-model quota.
+    """
+    cache = get_cache()
+    rate_limiter = get_rate_limiter()
+
+    async def api_call():
+        """Actual async API call - uses the shared client for either SDK version."""
+        try:
+            return await generate_text_async(api_key, model, prompt,
+                                             system_instruction=GEMINI_SYSTEM_INSTRUCTION)
+        except Exception as e:
+            print(f"[API ERROR] {type(e).__name__}: {e}")
+            raise
+
+    result = await async_call_with_cache_and_limits(
+        cache=cache,
+        rate_limiter=rate_limiter,
+        api_name="gemini",
+        input_text=prompt,
+        api_call_func=api_call,
+        max_retries=retries,
+        model=model,
+        system_instruction=GEMINI_SYSTEM_INSTRUCTION
+    )
+
+    if not result:
+        print(f"[ERROR] Gemini API failed after {retries} attempts")
+    return result
+
 def fetch_top_news(api_key, country="in", language="en", limit=5):
-    url = "https://newsdata.io/api/1/latest"
-    params = {
-        "apikey": api_key,
-        "country": country,
-        "language": language
-    }
-    resp = requests.get(url, params=params)
-    data = resp.json()
-    # print(data)
-    return data.get("results", [])[:limit]
+    """Latest NewsData.io articles only (see fetch_news_list for all sources)."""
+    return fetch_newsdata(api_key, country=country, language=language)[:limit]
 
-def process_title_with_gemini(api_key, raw_title):
-    prompt = (
+def build_title_prompt(raw_title):
+    return (
         "You are a helpful assistant. "
         "Rewrite the following news headline to be a YouTube video title that strictly follows these rules:\n"
         "1. Must be under 100 characters.\n"
@@ -117,7 +121,8 @@ def process_title_with_gemini(api_key, raw_title):
         "6. Respond the revised title, nothing else.\n\n"
         f"Original headline:\n{raw_title}"
     )
-    title = gemini_generate(api_key, prompt)
+
+def finalize_title(title, raw_title):
     # --- ADDED SAFETY CHECK ---
     if not title:
         print("[WARNING] Gemini title generation failed. Falling back to the original title.")
@@ -135,6 +140,9 @@ def process_title_with_gemini(api_key, raw_title):
         title_ascii = title_ascii[:100].rstrip()
     return title_ascii
 
+def process_title_with_gemini(api_key, raw_title):
+    return finalize_title(gemini_generate(api_key, build_title_prompt(raw_title)), raw_title)
+
 
 def process_description(text, max_words=1000):
     words = (text or "").split()
@@ -142,8 +150,8 @@ def process_description(text, max_words=1000):
         return " ".join(words[:max_words])
     return " ".join(words)
 
-def generate_summary(api_key, text):
-    prompt = f"""Summarize this text in exactly 100 words for a YouTube description that gains a lot of attention: {text}
+def build_summary_prompt(text):
+    return f"""Summarize this text in exactly 100 words for a YouTube description that gains a lot of attention: {text}
 
     Rules:
     1. Keep strictly 100 words
@@ -152,8 +160,7 @@ def generate_summary(api_key, text):
     4. Don't include any quotes.
     5. Don't include \" or ' characters and its correspinding encodings like &quot; or &#39;"""
 
-    summary = gemini_generate(api_key, prompt)
-
+def finalize_summary(summary, text):
     # Fallback if API fails
     if not summary:
         print("[WARNING] Summary generation failed. Using truncated text as fallback.")
@@ -163,14 +170,17 @@ def generate_summary(api_key, text):
 
     return summary
 
-def generate_hashtags(api_key, text, num_tags=10):
-    prompt = (
+def generate_summary(api_key, text):
+    return finalize_summary(gemini_generate(api_key, build_summary_prompt(text)), text)
+
+def build_hashtags_prompt(text, num_tags=10):
+    return (
         f"Generate {num_tags} relevant, trending, and YouTube-compliant hashtags for the following video description. "
         "Return ONLY the hashtags as a Python list of strings, no explanations or extra text.\n\n"
         f"Description:\n{text}\n"
     )
-    hashtags_text = gemini_generate(api_key, prompt)
 
+def parse_hashtags(hashtags_text, num_tags=10):
     # Handle None response from API
     if not hashtags_text:
         print("[WARNING] Failed to generate hashtags. Using fallback hashtags.")
@@ -193,80 +203,322 @@ def generate_hashtags(api_key, text, num_tags=10):
     print("[WARNING] Could not parse hashtags. Using fallback.")
     return ["#news", "#trending", "#youtube", "#video", "#breaking"]
 
+def generate_hashtags(api_key, text, num_tags=10):
+    return parse_hashtags(gemini_generate(api_key, build_hashtags_prompt(text, num_tags)), num_tags)
 
-def generate_hook(api_key, headline):
-    prompt = f"""Convert this into a 5-word YouTube Shorts hook:
+
+def build_hook_prompt(headline):
+    return f"""Convert this into a 5-word YouTube Shorts hook:
             Headline: '{headline}'
             Examples: 'This changes everything!', 'You won't believe this!'
             Respond ONLY with the hook."""
-    hook = gemini_generate(api_key, prompt)
+
+def finalize_hook(hook):
     # Fallback to safe text (no emoji)
     return hook or "Must Watch This Now!"
 
-def main():
-    # Create argument parser
-    parser = argparse.ArgumentParser(description="Generate trending news information using Google Gemini API")
-    
-    # Add arguments
-    parser.add_argument("--gemini_api_key", required=True, help="Google Gemini API key")
-    parser.add_argument("--newsdata_api_key", required=True, help="Google Gemini API key")
-    parser.add_argument("--output", "-o", default="news_output.json", help="Output file path (default: news_output.txt)")
-    
-    # Parse arguments
-    args = parser.parse_args()
+def generate_hook(api_key, headline):
+    return finalize_hook(gemini_generate(api_key, build_hook_prompt(headline)))
+
+async def generate_metadata_async(api_key, raw_title, description, concurrency=4,
+                                  fields=("title", "description", "tags", "hook")):
+    """
+    Run the individual title, summary, hashtag and hook prompts concurrently
+    (only those listed in ``fields``) and return them as a dict.
+    They are independent of each other, so this takes roughly one round-trip
+    instead of one per field (quota permitting).
+    """
+    prompts = {
+        "title": build_title_prompt(raw_title),
+        "description": build_summary_prompt(description),
+        "tags": build_hashtags_prompt(description),
+        "hook": build_hook_prompt(raw_title),
+    }
+    finalizers = {
+        "title": lambda text: finalize_title(text, raw_title),
+        "description": lambda text: finalize_summary(text, description),
+        "tags": parse_hashtags,
+        "hook": finalize_hook,
+    }
+    fields = [field for field in fields if field in prompts]
+    results = await gather_bounded(
+        [gemini_generate_async(api_key, prompts[field]) for field in fields], limit=concurrency
+    )
+    return {field: finalizers[field](text) for field, text in zip(fields, results)}
+
+
+# JSON schema for the single "story package" call that replaces the
+# separate title/summary/hashtags/hook (and step 2 image prompt) requests.
+STORY_PACKAGE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "title": {"type": "STRING"},
+        "description": {"type": "STRING"},
+        "tags": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "hook": {"type": "STRING"},
+        "image_prompt": {"type": "STRING"},
+    },
+    "required": ["title", "description", "tags", "hook", "image_prompt"],
+}
+
+def build_story_package_prompt(raw_title, description, num_tags=10):
+    return (
+        "Create the complete YouTube Shorts package for the news story below. "
+        "Respond with a JSON object containing exactly these fields:\n"
+        "- title: a YouTube video title under 100 characters, plain ASCII only, no single or double quotes, "
+        "clear and engaging for a general audience, ending with one emoji.\n"
+        "- description: a summary of the story in about 100 words for the YouTube description, simple language, "
+        "key facts only, no hashtags, no quotes and no \" or ' characters or their encodings like &quot; or &#39;.\n"
+        f"- tags: {num_tags} relevant, trending, YouTube-compliant hashtags, each starting with #.\n"
+        "- hook: a 5-word YouTube Shorts hook for the headline, e.g. 'This changes everything!'.\n"
+        "- image_prompt: a single, detailed, vivid descriptive paragraph (not a list of keywords) for a "
+        "photorealistic, emotionally resonant image for the video, with no text in the image, focused on "
+        "the core theme of the story.\n\n"
+        f"Headline:\n{raw_title}\n\nDescription:\n{description}\n"
+    )
 
-    print("Step 1.1: Fetching top 5 latest news from NewsData.io...")
-    news_list = fetch_top_news(args.newsdata_api_key)
-    if not news_list:
-        print("No news fetched.")
-        return
+def validate_story_package(package, raw_title, num_tags=10):
+    """
+    Validate each field of a story package independently.
+    Returns a dict holding only the fields that passed, already normalised.
+    """
+    if not isinstance(package, dict):
+        return {}
+    valid = {}
+
+    title = package.get("title")
+    if isinstance(title, str) and title.strip():
+        title = finalize_title(title, raw_title)
+        if 0 < len(title) <= 100:
+            valid["title"] = title
+
+    summary = package.get("description")
+    if isinstance(summary, str) and 50 <= len(summary.split()) <= 160 and "#" not in summary:
+        valid["description"] = summary.strip()
+
+    tags = package.get("tags")
+    if isinstance(tags, list):
+        tags = [tag.strip() for tag in tags if isinstance(tag, str) and tag.strip()]
+        tags = [tag if tag.startswith("#") else "#" + tag for tag in tags]
+        tags = [tag for tag in tags if re.fullmatch(r"#\w+", tag)]
+        if len(tags) >= 3:
+            valid["tags"] = tags[:num_tags]
+
+    hook = package.get("hook")
+    if isinstance(hook, str) and 1 <= len(hook.split()) <= 10:
+        valid["hook"] = hook.strip().strip('"\'')
+
+    image_prompt = package.get("image_prompt")
+    if isinstance(image_prompt, str) and len(image_prompt.split()) >= 15:
+        valid["image_prompt"] = image_prompt.strip().replace("\n", " ")
+
+    return valid
+
+async def generate_story_package_async(api_key, raw_title, description, model="gemini-1.5-flash", retries=3):
+    """
+    Get title, summary, hashtags, hook and image prompt from one schema-constrained
+    Gemini call (cached as a whole). Only fields that fail validation are
+    regenerated with the individual prompts; a missing image_prompt is left for
+    step 2 to generate.
+    """
+    cache = get_cache()
+    rate_limiter = get_rate_limiter()
+    prompt = build_story_package_prompt(raw_title, description)
+
+    async def api_call():
+        try:
+            return await generate_text_async(api_key, model, prompt,
+                                             system_instruction=GEMINI_SYSTEM_INSTRUCTION,
+                                             response_schema=STORY_PACKAGE_SCHEMA)
+        except Exception as e:
+            print(f"[API ERROR] {type(e).__name__}: {e}")
+            raise
+
+    package_text = await async_call_with_cache_and_limits(
+        cache=cache,
+        rate_limiter=rate_limiter,
+        api_name="gemini_story_package",
+        input_text=prompt,
+        api_call_func=api_call,
+        max_retries=retries,
+        model=model,
+        system_instruction=GEMINI_SYSTEM_INSTRUCTION
+    )
+
+    package = {}
+    if package_text:
+        try:
+            package = json.loads(package_text)
+        except json.JSONDecodeError as e:
+            print(f"[WARNING] Story package is not valid JSON: {e}")
+    story = validate_story_package(package, raw_title)
+
+    missing = [field for field in ("title", "description", "tags", "hook") if field not in story]
+    if missing:
+        print(f"[WARNING] Story package fields failed validation: {', '.join(missing)}. Falling back to individual calls.")
+        story.update(await generate_metadata_async(api_key, raw_title, description, fields=missing))
+    return story
+
+def fetch_news_list(newsdata_api_key, limit=5, news_store=None, fetched=None):
+    """
+    Fetch articles from every configured source at once (NewsData.io, plus
+    NewsAPI when $NEWSAPI_KEY is set, plus Google News) and return them
+    merged as soon as ``limit`` good candidates are in. With ``news_store``
+    only articles that no earlier run has selected from are returned.
+    ``fetched`` collects every article handed out, merged repeats included
+    (see news_sources.gather_articles), for marking them seen afterwards.
+    """
+    sources = configured_sources(newsdata_api_key, newsapi_key=os.getenv("NEWSAPI_KEY"), store=news_store)
+    print(f"Step 1.1: Fetching the latest news from {', '.join(source.name for source in sources)}...")
+    news_list = gather_articles(sources, want=limit, fetched=fetched)
 
     print("\nFetched news headlines and description lengths:")
     for idx, n in enumerate(news_list, 1):
-        desc_len = len((n.get('description') or '').split())
-        # print(f"{idx}. {n.get('title', '')} | Description words: {desc_len}")
-        print(f"{idx}. {n.get('title', '')} | Description words: {desc_len}".encode('ascii', errors='ignore').decode('ascii'))
-
+        # print(f"{idx}. {n.title} | Description words: {n.description_words}")
+        print(f"{idx}. [{n.provider}] {n.title} | Description words: {n.description_words}".encode('ascii', errors='ignore').decode('ascii'))
+    return news_list
 
-    # Select the article with the longest description
-    news_with_desc = [n for n in news_list if n.get("description")]
+def select_top_stories(news_list, count=1, story_index=None, ranker=None, context=()):
+    """
+    Return up to ``count`` articles with a description, best ranked first
+    (see story_ranking.StoryRanker; ``context`` holds other recent articles
+    for its coverage and burstiness signals). Stories already covered by an
+    earlier run (per ``story_index``, see story_index.StoryIndex) are
+    skipped, as are near-duplicates of a story already selected in this call.
+    """
+    news_with_desc = [n for n in news_list if n.description]
     if not news_with_desc:
-        print("No news article with a valid description found.")
-        return
-    selected_news = max(news_with_desc, key=lambda n: len((n.get("description") or "").split()))
-
-    print(f"\nSelected news with the longest description:\nTitle: {selected_news.get('title')}\nDescription length: {len(selected_news.get('description').split())} words")
+        raise StepError("No news article with a valid description found.")
+    ranker = ranker or StoryRanker(RankingWeights.from_env())
+    ranked = ranker.rank(news_with_desc, context)
+    print("\nTop-ranked candidates:")
+    for r in ranked[:5]:
+        print(f"{r.score:.2f} ({', '.join(f'{k} {v:.2f}' for k, v in r.signals.items())}): "
+              f"{r.article.title}".encode('ascii', errors='ignore').decode('ascii'))
+    news_with_desc = [r.article for r in ranked]
+    if story_index is None:
+        return news_with_desc[:count]
+
+    selected, fingerprints = [], []
+    for article in news_with_desc:
+        fingerprint = simhash(article.title, article.description)
+        match = story_index.find_duplicate(article.title, fingerprint=fingerprint)
+        if match is not None:
+            print(f"Skipping already covered story ({match.similarity:.0%} similar to '{match.title}'): "
+                  f"{article.title}".encode('ascii', errors='ignore').decode('ascii'))
+            continue
+        if any(similarity(fingerprint, other) >= story_index.threshold for other in fingerprints):
+            continue
+        selected.append(article)
+        fingerprints.append(fingerprint)
+        if len(selected) == count:
+            break
+    if not selected:
+        # Retrying returns the same candidates; only newer news can help.
+        raise StepError("Every fetched story was already covered by an earlier run.", failure_class=PERMANENT)
+    return selected
+
+def mark_passed_over(news_store, fetched, selected):
+    """
+    Mark the fetched articles that were not selected as seen. Selected ones
+    stay pending until their video is uploaded and the story index has them,
+    so a run that fails later in the pipeline can pick them again.
+    """
+    selected_keys = {article_key(article) for article in selected}
+    news_store.mark_seen(article for article in fetched if article_key(article) not in selected_keys)
 
-    processed_title = process_title_with_gemini(args.gemini_api_key, selected_news.get("title", ""))
+def ranking_context(news_store, ranker):
+    """Stored articles within the ranker's baseline window."""
+    return news_store.recent(time.time() - ranker.baseline_days * 86400)
 
-    description_raw = selected_news.get("description", "")
-    description = process_description(description_raw, 1000)
+async def build_news_payload_async(gemini_api_key, article):
+    """Turn one news_sources.Article into a NewsPayload via the Gemini story package."""
+    description = process_description(article.description, 1000)
 
-    print("\nStep 1.2: Generating YouTube description with Gemini...")
-    summary = generate_summary(args.gemini_api_key, description)
+    story = await generate_story_package_async(gemini_api_key, article.title, description)
+    processed_title, summary, hashtags, hook = story["title"], story["description"], story["tags"], story["hook"]
     if not summary:
         summary = description[:600]
-    print(f"\nGenerated summary:\n{summary}")
+    return NewsPayload(
+        title=processed_title,
+        description=summary,
+        tags=hashtags,
+        hook=hook,
+        image_prompt=story.get("image_prompt"),
+        source={"title": article.title, "description": article.description, "url": article.url},
+    )
 
-    print("\nStep 1.3: Generating hashtags...")
-    hashtags = generate_hashtags(args.gemini_api_key, description)
-    print("Hashtags:", ", ".join(hashtags))
+def run(gemini_api_key, newsdata_api_key, output_file="news_output.json"):
+    """
+    In-process entry point for step 1: fetch news, generate the story package,
+    save it to ``output_file`` and return it as a NewsPayload.
+    """
+    news_store = get_news_store()
+    fetched = []
+    news_list = fetch_news_list(newsdata_api_key, news_store=news_store, fetched=fetched)
 
-    print("\nStep 1.4: Generating YouTube hook with Gemini...")
-    hook = generate_hook(args.gemini_api_key, selected_news.get("title", ""))
-    print("Generated hook:", hook)
+    # Select the best-ranked article that no earlier run has covered
+    story_index = get_story_index()
+    ranker = StoryRanker(RankingWeights.from_env())
+    selected_news = select_top_stories(news_list, 1, story_index=story_index, ranker=ranker,
+                                       context=ranking_context(news_store, ranker))[0]
 
-    output = {
-        "title": processed_title,
-        "description": summary,
-        "tags": hashtags,
-        "hook": hook
-    }
+    print(f"\nSelected top-ranked news:\nTitle: {selected_news.title}\nDescription length: {selected_news.description_words} words")
+
+    print("\nStep 1.2: Generating the story package (title, description, hashtags, hook, image prompt) with Gemini...")
+    news = asyncio.run(build_news_payload_async(gemini_api_key, selected_news))
+    print(f"\nGenerated title: {news.title}")
+    print(f"\nGenerated summary:\n{news.description}")
+    print("Hashtags:", ", ".join(news.tags))
+    print("Generated hook:", news.hook)
+
+    news.save(output_file)
+    mark_passed_over(news_store, fetched, [selected_news])
 
-    with open("news_output.json", "w", encoding="utf-8") as f:
-        json.dump(output, f, ensure_ascii=False, indent=2)
+    print(f"\nAll done! Output saved to {output_file}")
+    return news
+
+def run_batch(gemini_api_key, newsdata_api_key, count, concurrency=4):
+    """
+    Batch entry point for step 1: build NewsPayloads for the top ``count``
+    stories of one NewsData fetch, generating the story packages concurrently.
+    May return fewer than ``count`` payloads if fewer usable articles came back.
+    """
+    news_store = get_news_store()
+    fetched = []
+    news_list = fetch_news_list(newsdata_api_key, limit=max(count, 5), news_store=news_store, fetched=fetched)
+    story_index = get_story_index()
+    ranker = StoryRanker(RankingWeights.from_env())
+    selected = select_top_stories(news_list, count, story_index=story_index, ranker=ranker,
+                                  context=ranking_context(news_store, ranker))
+    print(f"\nSelected {len(selected)} of {count} requested stories.")
+
+    print("\nStep 1.2: Generating story packages with Gemini...")
+
+    async def build_all():
+        return await gather_bounded(
+            [build_news_payload_async(gemini_api_key, article) for article in selected], limit=concurrency
+        )
+
+    stories = asyncio.run(build_all())
+    mark_passed_over(news_store, fetched, selected)
+    for idx, news in enumerate(stories, 1):
+        print(f"{idx}. {news.title}".encode('ascii', errors='ignore').decode('ascii'))
+    return stories
+
+def main():
+    # Create argument parser
+    parser = argparse.ArgumentParser(description="Generate trending news information using Google Gemini API")
+    
+    # Add arguments
+    parser.add_argument("--gemini_api_key", required=True, help="Google Gemini API key")
+    parser.add_argument("--newsdata_api_key", required=True, help="Google Gemini API key")
+    parser.add_argument("--output", "-o", default="news_output.json", help="Output file path (default: news_output.txt)")
+    
+    # Parse arguments
+    args = parser.parse_args()
 
-    print("\nAll done! Output saved to news_output.json")
+    return run(args.gemini_api_key, args.newsdata_api_key, output_file=args.output)
 
 if __name__ == "__main__":
-    main()
+    run_step_main(main)
@@ -1,11 +1,7 @@
 import os
-import json
-import requests
 from concurrent.futures import ThreadPoolExecutor
 import argparse
-import certifi
 import sys
-import time
 
 # --- FIX: Set UTF-8 encoding for proper Unicode support on Windows ---
 if sys.platform == "win32":
@@ -14,21 +10,18 @@ if sys.platform == "win32":
 
 # --- Import caching and rate limiting utilities ---
 from api_utils import get_cache, get_rate_limiter, call_with_cache_and_limits
+import http_client
 
-# --- Import Gemini API (try new SDK first, fallback to old) ---
-try:
-    from google import genai
-    GEMINI_SDK_VERSION = "new"
-except ImportError:
-    import google.generativeai as genai
-    GEMINI_SDK_VERSION = "old"
-    print("[INFO] Using old Gemini SDK version")
+# --- Shared Gemini client registry (handles both SDK versions) ---
+from gemini_client import generate_text
+from pipeline_types import ImagesResult, NewsPayload, StepError
+from step_failures import PERMANENT, QUOTA, TRANSIENT, classify_exception, classify_http_status, run_step_main
 
 def gemini_generate(api_key, title, description):
     """
     Uses the Gemini API to generate a high-quality, descriptive image prompt.
     Uses caching and rate limiting to avoid quota exhaustion.
-    Works with both old and new Google Generative AI SDK versions.
+    Works with both old and new Google Generative AI SDK versions (via gemini_client).
     """
     print("Generating a creative image prompt with Gemini...")
 
@@ -43,22 +36,10 @@ def gemini_generate(api_key, title, description):
     )
 
     def api_call():
-        """Actual API call to Gemini - works with both SDK versions."""
+        """Actual API call to Gemini - uses the shared client for either SDK version."""
         try:
-            if GEMINI_SDK_VERSION == "new":
-                # New SDK syntax
-                client = genai.Client(api_key=api_key)
-                response = client.models.generate_content(
-                    model='gemini-1.5-flash',
-                    contents=prompt_template
-                )
-            else:
-                # Old SDK syntax
-                genai.configure(api_key=api_key)
-                model = genai.GenerativeModel('gemini-1.5-flash')
-                response = model.generate_content(prompt_template)
-
-            return response.text.strip().replace("\n", " ") if response and hasattr(response, 'text') else None
+            text = generate_text(api_key, 'gemini-1.5-flash', prompt_template)
+            return text.replace("\n", " ") if text else None
         except Exception as e:
             print(f"[API ERROR] {type(e).__name__}: {e}")
             raise
@@ -70,7 +51,8 @@ def gemini_generate(api_key, title, description):
         api_name="gemini_image_prompt",
         input_text=f"{title}_{description}",
         api_call_func=api_call,
-        max_retries=3
+        max_retries=3,
+        model='gemini-1.5-flash'
     )
 
     if creative_prompt:
@@ -82,13 +64,16 @@ def gemini_generate(api_key, title, description):
         return f"A photorealistic image representing the news story titled '{title}'"
 
 # --- Read News and Generate Prompt ---
+def image_prompt_for(news, gemini_api_key):
+    """Return the image prompt for a NewsPayload, asking Gemini only if step 1 didn't provide one."""
+    # Step 1's story package usually already contains the image prompt
+    if news.image_prompt:
+        print(f"Using image prompt from step 1: {news.image_prompt}")
+        return news.image_prompt
+    return gemini_generate(gemini_api_key, news.title, news.description)
+
 def get_image_prompt(news_file, gemini_api_key):
-    with open(news_file, 'r', encoding='utf-8') as f:
-        news = json.load(f)
-    title = news.get('title', '')
-    description = news.get('description', '')
-    prompt = gemini_generate(gemini_api_key, title, description)
-    return prompt
+    return image_prompt_for(NewsPayload.load(news_file), gemini_api_key)
 
 # --- Generate Image via Imagerouter.io ---
 def generate_image(prompt, api_key, idx, save_folder):
@@ -108,12 +93,13 @@ def generate_image(prompt, api_key, idx, save_folder):
     }
 
     print(f"Requesting image {idx+1} from ImageRouter...")
-    response = requests.post(url, json=payload, headers=headers, verify=certifi.where())
+    response = http_client.post("imagerouter", url, json=payload, headers=headers)
     
     if response.status_code != 200:
         print(f"Error: API request failed for image {idx+1} with status code {response.status_code}.")
         print(f"Response: {response.text}")
-        return None
+        raise StepError(f"ImageRouter returned {response.status_code} for image {idx+1}",
+                        failure_class=classify_http_status(response.status_code))
 
     data = response.json()
     images = data.get('data', [])
@@ -127,7 +113,7 @@ def generate_image(prompt, api_key, idx, save_folder):
         print(f"No valid image URL found for image {idx+1}")
         return None
     
-    img_response = requests.get(image_url)
+    img_response = http_client.get("image_download", image_url)
     if img_response.status_code == 200:
         os.makedirs(save_folder, exist_ok=True)
         img_path = os.path.join(save_folder, f"image_{idx+1}.png")
@@ -139,31 +125,56 @@ def generate_image(prompt, api_key, idx, save_folder):
         print(f"Failed to download image {idx+1} from {image_url}")
         return None
 
+def run(gemini_api_key, imagerouter_api_key, news, save_folder="generated_images", num_images=5):
+    """
+    In-process entry point for step 2: generate ``num_images`` images for the
+    NewsPayload ``news`` into ``save_folder`` and return an ImagesResult.
+    """
+    prompt = image_prompt_for(news, gemini_api_key)
+    return generate_images(prompt, imagerouter_api_key, save_folder, num_images)
+
+def generate_images(prompt, imagerouter_api_key, save_folder="generated_images", num_images=5):
+    """Generate ``num_images`` images for ``prompt`` concurrently and return an ImagesResult."""
+    paths = []
+    failure_classes = []
+    with ThreadPoolExecutor(max_workers=num_images) as executor:
+        futures = [
+            executor.submit(generate_image, prompt, imagerouter_api_key, i, save_folder)
+            for i in range(num_images)
+        ]
+        for future in futures:
+            try:
+                path = future.result()
+                if path:
+                    paths.append(path)
+            except Exception as e:
+                print(f"An error occurred in one of the image generation threads: {e}")
+                failure_classes.append(classify_exception(e))
+
+    print(f"\nImage generation process completed. Check the '{save_folder}' folder.")
+    if not paths:
+        # Only a permanent failure on every request (e.g. 403 access_denied) is worth aborting on
+        if failure_classes and all(c == PERMANENT for c in failure_classes):
+            failure_class = PERMANENT
+        elif QUOTA in failure_classes:
+            failure_class = QUOTA
+        else:
+            failure_class = TRANSIENT
+        raise StepError(f"No images were generated into '{save_folder}'.", failure_class=failure_class)
+    if len(paths) < num_images:
+        print(f"[WARNING] Only {len(paths)} of {num_images} images were generated.")
+    return ImagesResult(folder=save_folder, paths=paths, requested=num_images)
+
 # --- Main Execution ---
 def main():
     parser = argparse.ArgumentParser(description="Generates images based on news data using Imagerouter.io and Gemini API.")
     parser.add_argument("--gemini_api_key", required=True, help="Google Gemini API key")
     parser.add_argument("--imagerouter_api_key", required=True, help="Imagerouter.io API key")
     parser.add_argument("--news_file", default="news_output.json", help="Path to the news JSON file (default: news_output.json)")
+    parser.add_argument("--save_folder", default="generated_images", help="Folder to save the images in (default: generated_images)")
     args = parser.parse_args()
 
-    prompt = get_image_prompt(args.news_file, args.gemini_api_key)
-    
-    SAVE_FOLDER = "generated_images"
-    NUM_IMAGES = 5
-
-    with ThreadPoolExecutor(max_workers=NUM_IMAGES) as executor:
-        futures = [
-            executor.submit(generate_image, prompt, args.imagerouter_api_key, i, SAVE_FOLDER)
-            for i in range(NUM_IMAGES)
-        ]
-        for future in futures:
-            try:
-                future.result()
-            except Exception as e:
-                print(f"An error occurred in one of the image generation threads: {e}")
-            
-    print(f"\nImage generation process completed. Check the '{SAVE_FOLDER}' folder.")
+    return run(args.gemini_api_key, args.imagerouter_api_key, NewsPayload.load(args.news_file), save_folder=args.save_folder)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run_step_main(main)
@@ -2,6 +2,8 @@ import os
 import random
 import argparse
 from moviepy.editor import ImageClip, concatenate_videoclips
+from pipeline_types import StepError, VideoResult
+from step_failures import PERMANENT, run_step_main
 
 def get_image_files(image_folder):
     """Return a sorted list of image file paths from the given folder."""
@@ -65,6 +67,17 @@ def create_video_from_images(image_folder, output_video, video_duration=60, segm
     else:
         print("Video creation failed; images were not deleted.")
 
+def run(image_folder, output_video="generated_video.mp4", video_duration=60, segment_duration=10):
+    """In-process entry point for step 3: render the slideshow and return a VideoResult."""
+    try:
+        create_video_from_images(image_folder, output_video, video_duration, segment_duration)
+    except ValueError as e:
+        # No images to render; rerunning this step alone cannot fix that
+        raise StepError(str(e), failure_class=PERMANENT)
+    if not os.path.exists(output_video):
+        raise StepError(f"Video file '{output_video}' was not created.")
+    return VideoResult(path=output_video)
+
 def main():
     parser = argparse.ArgumentParser(description="Create a 1-minute video from images, shuffling every 10 seconds.")
     parser.add_argument("--image_folder", default="generated_images", help="Folder containing images (default: generated_images)")
@@ -73,12 +86,7 @@ def main():
     parser.add_argument("--segment_duration", type=int, default=10, help="Shuffle order every N seconds (default: 10)")
     args = parser.parse_args()
 
-    create_video_from_images(
-        image_folder=args.image_folder,
-        output_video=args.output_video,
-        video_duration=args.video_duration,
-        segment_duration=args.segment_duration
-    )
+    return run(args.image_folder, args.output_video, args.video_duration, args.segment_duration)
 
 if __name__ == "__main__":
-    main()
+    run_step_main(main)
@@ -5,6 +5,23 @@ import whisperx
 import torch
 import argparse
 import subprocess
+import threading
+from pipeline_types import StepError, VideoResult
+from step_failures import run_step_main
+
+# Intermediate file names, created in the run's scratch directory (``work_dir``);
+# final_pipeline's DAG runs the sub-stages below separately with its own paths.
+TEMP_AUDIO = "temp_speech.mp3"
+TEMP_VIDEO = "temp_video_with_speech.mp4"
+TEMP_SRT = "temp_captions.srt"
+INTERMEDIATE_OUTPUT = "final_no_ending.mp4"
+DEFAULT_ENDING_IMAGE = os.path.join("pipeline_images", "endingImgaeEnhanced.png")
+TEMP_FILES = [TEMP_AUDIO, TEMP_VIDEO, TEMP_SRT, INTERMEDIATE_OUTPUT]
+
+
+def temp_files_in(work_dir=None):
+    """TEMP_FILES placed in ``work_dir`` (the current directory if None)."""
+    return [os.path.join(work_dir, name) if work_dir else name for name in TEMP_FILES]
 
 
 def text_to_speech_elevenlabs(text, output_audio_path, api_key, voice_id):
@@ -30,13 +47,32 @@ def add_audio_to_video(video_path, audio_path, output_path):
     final.write_videofile(output_path, codec="libx264", audio_codec="aac")
     print(f"Output video saved to: {output_path}")
 
+# Loaded WhisperX models, kept warm across calls when the step runs in-process.
+# The lock keeps concurrent batch stories from loading or sharing a model at once.
+_whisper_models = {}
+_align_models = {}
+_whisper_lock = threading.RLock()
+
+def get_whisper_model(name, device):
+    with _whisper_lock:
+        if (name, device) not in _whisper_models:
+            _whisper_models[(name, device)] = whisperx.load_model(name, device, compute_type="float32")
+        return _whisper_models[(name, device)]
+
+def get_align_model(language_code, device):
+    with _whisper_lock:
+        if (language_code, device) not in _align_models:
+            _align_models[(language_code, device)] = whisperx.load_align_model(language_code=language_code, device=device)
+        return _align_models[(language_code, device)]
+
 def generate_srt_with_whisperx(audio_path, srt_path):
     device = "cuda" if torch.cuda.is_available() else "cpu"
-    model = whisperx.load_model("small", device, compute_type="float32") # "large-v2" is the model name, you can change it to "base", "small", "medium", etc. based on your needs
     audio = whisperx.load_audio(audio_path)
-    result = model.transcribe(audio, language="en")
-    model_a, metadata = whisperx.load_align_model(language_code="en", device=device)
-    result = whisperx.align(result["segments"], model_a, metadata, audio, device)
+    with _whisper_lock:
+        model = get_whisper_model("small", device) # "large-v2" is the model name, you can change it to "base", "small", "medium", etc. based on your needs
+        result = model.transcribe(audio, language="en")
+        model_a, metadata = get_align_model("en", device)
+        result = whisperx.align(result["segments"], model_a, metadata, audio, device)
     with open(srt_path, "w", encoding="utf-8") as f:
         for i, seg in enumerate(result["segments"], 1):
             start = seg["start"]
@@ -53,10 +89,21 @@ def format_srt_time(seconds):
     millisecs = int((seconds % 1) * 1000)
     return f"{hours:02d}:{minutes:02d}:{secs:02d},{millisecs:03d}"
 
+def escape_filter_value(value):
+    """
+    Escape ``value`` for use as a filter option inside an ffmpeg -vf graph:
+    first for the option value, then for the graph description (see "Notes
+    on filtergraph escaping" in the ffmpeg-filters docs). Needed for absolute
+    paths with drive letters, quotes or commas.
+    """
+    for special in ("\\':", "\\'[],;"):
+        value = "".join("\\" + c if c in special else c for c in value)
+    return value
+
 def burn_captions_ffmpeg(video_path, srt_path, output_path):
     ffmpeg_cmd = [
         "ffmpeg", "-i", video_path,
-        "-vf", f"subtitles={srt_path}:force_style='Fontsize=18,PrimaryColour=&Hffffff,OutlineColour=&H000000,Outline=2,Alignment=2'",
+        "-vf", f"subtitles={escape_filter_value(srt_path)}:force_style='Fontsize=18,PrimaryColour=&Hffffff,OutlineColour=&H000000,Outline=2,Alignment=2'",
         "-c:a", "copy", "-y", output_path
     ]
     subprocess.run(ffmpeg_cmd, check=True)
@@ -76,6 +123,36 @@ def append_ending_image_to_video(main_video_path, ending_image_path, output_vide
     final.write_videofile(output_video_path, codec="libx264", audio_codec="aac")
     print(f"Appended ending image to create: {output_video_path}")
 
+def cleanup_temp_files(paths=TEMP_FILES):
+    for f in paths:
+        if os.path.exists(f):
+            os.remove(f)
+
+def run(video, text, output, api_key, voice_id, ending_image_path=DEFAULT_ENDING_IMAGE, work_dir=None):
+    """
+    In-process entry point for step 4: narrate ``text`` over ``video``, burn in
+    captions, append the ending image and return a VideoResult for ``output``.
+    Intermediate files go to ``work_dir``.
+    """
+    temp_files = temp_files_in(work_dir)
+    temp_audio, temp_video, temp_srt, intermediate_output = temp_files
+    try:
+        # synthesize speech and add audio to video
+        text_to_speech_elevenlabs(text, temp_audio, api_key, voice_id)
+        add_audio_to_video(video, temp_audio, temp_video)
+        generate_srt_with_whisperx(temp_audio, temp_srt)
+        burn_captions_ffmpeg(temp_video, temp_srt, intermediate_output)
+
+        # Append the ending image
+        append_ending_image_to_video(intermediate_output, ending_image_path, output, duration=2.5)
+    finally:
+        # Clean up
+        cleanup_temp_files(temp_files)
+
+    if not os.path.exists(output):
+        raise StepError(f"{output} was not created.")
+    return VideoResult(path=output)
+
 def main():
     parser = argparse.ArgumentParser(description="Add ElevenLabs speech and WhisperX captions to a video, with an ending image.")
     parser.add_argument("--video", required=True, help="Input video file")
@@ -84,27 +161,10 @@ def main():
     
     parser.add_argument("--api_key", required=True, help="ElevenLabs API key")
     parser.add_argument("--voice_id", required=True, help="ElevenLabs voice ID")
+    parser.add_argument("--work_dir", default=None, help="Directory for intermediate files (default: current directory)")
     args = parser.parse_args()
 
-    temp_audio = "temp_speech.mp3"
-    temp_video = "temp_video_with_speech.mp4"
-    temp_srt = "temp_captions.srt"
-    intermediate_output = "final_no_ending.mp4"
-    ending_image_path = os.path.join("pipeline_images", "endingImgaeEnhanced.png")
-
-    # synthesize speech and add audio to video
-    text_to_speech_elevenlabs(args.text, temp_audio, args.api_key, args.voice_id)
-    add_audio_to_video(args.video, temp_audio, temp_video)
-    generate_srt_with_whisperx(temp_audio, temp_srt)
-    burn_captions_ffmpeg(temp_video, temp_srt, intermediate_output)
-
-    # Append the ending image
-    append_ending_image_to_video(intermediate_output, ending_image_path, args.output, duration=2.5)
-
-    # Clean up
-    for f in [temp_audio, temp_video, temp_srt, intermediate_output]:
-        if os.path.exists(f):
-            os.remove(f)
+    return run(args.video, args.text, args.output, args.api_key, args.voice_id, work_dir=args.work_dir)
 
 if __name__ == "__main__":
-    main()
+    run_step_main(main)
@@ -9,6 +9,8 @@ from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload
 from google_auth_oauthlib.flow import InstalledAppFlow
+from pipeline_types import StepError, UploadResult
+from step_failures import PERMANENT, run_step_main
 
 
 # --- Constants ---
@@ -126,51 +128,53 @@ def upload_video_as_short(youtube, video_file, title, description, tags, categor
 
 # --- Main Execution ---
 
-def main():
-    parser = argparse.ArgumentParser(description='Uploads a video to YouTube as a Short using provided metadata.')
-    parser.add_argument('--file', required=True, help='Path to the video file to upload (must be <= 60s and vertical).')
-    parser.add_argument('--title', required=True, help='The title of the video.')
-    parser.add_argument('--description', required=True, help='The description of the video.')
-    parser.add_argument('--tags', required=True, help='A comma-separated string of tags.')
-    parser.add_argument('--category', default='22', help='YouTube category ID (default: 22 - People & Blogs).')
-    parser.add_argument('--privacy', default='public', choices=['private', 'public', 'unlisted'], help='Privacy status (default: public).')
-    args = parser.parse_args()
-
+def run(file, title, description, tags, category="22", privacy="public"):
+    """In-process entry point for step 5: upload ``file`` as a Short and return an UploadResult."""
     # 1. Validate Video File
-    if not os.path.exists(args.file):
-        print(f"Error: Video file not found at '{args.file}'")
-        return
+    if not os.path.exists(file):
+        raise StepError(f"Error: Video file not found at '{file}'", failure_class=PERMANENT)
 
     # 2. Check Video Duration for Shorts
-    duration = get_video_duration(args.file)
+    duration = get_video_duration(file)
     if duration == -1:
-        return
-        
+        raise StepError(f"Error: Could not read the duration of '{file}'")
+
     print(f"Validating video... Duration: {duration:.2f} seconds.")
     if duration > 60:
         print("Warning: Video is longer than 60 seconds. YouTube may not classify it as a Short.")
         # We still proceed with the upload as requested.
 
-    # 3. Prepare Tags
-    # Convert comma-separated string from argument to a list of strings
-    tags_list = [tag.strip() for tag in args.tags.split(',')]
-
-    # 4. Authenticate and Upload
+    # 3. Authenticate and Upload
     print("\nAuthenticating with YouTube...")
     youtube = get_authenticated_service()
-
-    # hashtags = " ".join(tag for tag in args.tags)
-    # final_description = args.description + "\n\n\n" + hashtags
-
+    if youtube is None:
+        raise StepError("Error: No valid YouTube credentials.", failure_class=PERMANENT)
 
     video_id = upload_video_as_short(
-        youtube, args.file, args.title, args.description, tags_list, args.category, args.privacy
+        youtube, file, title, description, list(tags), category, privacy
     )
 
     if video_id:
         print(f"\nVideo uploaded successfully! Watch your Short at: https://www.youtube.com/shorts/{video_id}")
     else:
-        print("\nUpload failed. Please check the error messages above.")
+        raise StepError("\nUpload failed. Please check the error messages above.")
+    return UploadResult(video_id=video_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Uploads a video to YouTube as a Short using provided metadata.')
+    parser.add_argument('--file', required=True, help='Path to the video file to upload (must be <= 60s and vertical).')
+    parser.add_argument('--title', required=True, help='The title of the video.')
+    parser.add_argument('--description', required=True, help='The description of the video.')
+    parser.add_argument('--tags', required=True, help='A comma-separated string of tags.')
+    parser.add_argument('--category', default='22', help='YouTube category ID (default: 22 - People & Blogs).')
+    parser.add_argument('--privacy', default='public', choices=['private', 'public', 'unlisted'], help='Privacy status (default: public).')
+    args = parser.parse_args()
+
+    # Convert comma-separated string from argument to a list of strings
+    tags_list = [tag.strip() for tag in args.tags.split(',')]
+
+    return run(args.file, args.title, args.description, tags_list, args.category, args.privacy)
 
 if __name__ == "__main__":
-    main()
+    run_step_main(main)
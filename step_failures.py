@@ -0,0 +1,213 @@
+"""
+Machine-readable failure classes for pipeline steps and the retry policy
+built on them.
+
+A failing step reports one of four classes:
+
+- ``transient``: network blips, 5xx, timeouts. Retry with a short backoff.
+- ``quota``: 429 / rate or credit limits. Back off for the server-requested
+  delay (or a long exponential one), fail over to an alternate key where the
+  stage has one, and abort once a hard-quota circuit breaker is open.
+- ``permanent``: bad or missing credentials, 401/403/404, invalid input.
+  Retrying cannot help, so abort immediately.
+- ``partial``: the step produced usable but incomplete output (e.g. 3 of 5
+  images). Accept it and continue.
+
+Step scripts report the class through their exit code (see EXIT_CODES) and,
+when the orchestrator sets $STEP_RESULT_FILE, a small JSON result file with
+the message and any retry-after hint. In-process steps raise StepError
+with ``failure_class`` set; other exceptions are classified heuristically.
+"""
+
+import json
+import os
+import re
+import sys
+import traceback
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from api_utils import parse_retry_delay
+from pipeline_types import StepError
+
+TRANSIENT = "transient"
+QUOTA = "quota"
+PERMANENT = "permanent"
+PARTIAL = "partial"
+
+# Exit codes used by the step scripts; 1 (uncaught error) is treated as transient.
+EXIT_CODES = {TRANSIENT: 75, QUOTA: 76, PERMANENT: 77, PARTIAL: 78}
+CLASS_BY_EXIT_CODE = {code: failure_class for failure_class, code in EXIT_CODES.items()}
+
+RESULT_FILE_ENV = "STEP_RESULT_FILE"
+
+_QUOTA_PATTERN = re.compile(r"\b429\b|RESOURCE_EXHAUSTED|quota|rate.?limit|too many requests", re.IGNORECASE)
+_PERMANENT_PATTERN = re.compile(
+    r"\b(401|403|404)\b|access_denied|unauthori[sz]ed|forbidden|invalid.?api.?key|api key not valid|"
+    r"(?:invalid|missing|bad|no) credentials|credentials (?:are )?(?:invalid|missing|not found)|token\.json|"
+    r"PERMISSION_DENIED",
+    re.IGNORECASE,
+)
+
+
+def classify_http_status(status: Optional[int]) -> str:
+    if status == 429:
+        return QUOTA
+    if status in (400, 401, 402, 403, 404, 422):
+        return PERMANENT
+    return TRANSIENT
+
+
+def _status_of(error: BaseException) -> Optional[int]:
+    for candidate in (error, getattr(error, "response", None), getattr(error, "resp", None)):
+        if candidate is None:
+            continue
+        for attr in ("status_code", "status", "code"):
+            value = getattr(candidate, attr, None)
+            if isinstance(value, int) and 100 <= value < 600:
+                return value
+            if isinstance(value, str) and value.isdigit():
+                return int(value)
+    return None
+
+
+def _text_of(error: BaseException) -> str:
+    """Message plus any response body the error carries (SDK errors often keep the reason there)."""
+    parts = [str(error)]
+    body = getattr(error, "body", None)
+    if body is not None:
+        parts.append(json.dumps(body, default=str) if isinstance(body, (dict, list)) else str(body))
+    response_text = getattr(getattr(error, "response", None), "text", None)
+    if isinstance(response_text, str):
+        parts.append(response_text)
+    return " ".join(parts)
+
+
+def classify_exception(error: BaseException) -> str:
+    """
+    Failure class of an exception raised by a step. Quota signals in the
+    message or body win over the HTTP status, because some providers
+    (ElevenLabs) report a spent quota as a 401 with ``quota_exceeded``.
+    """
+    if isinstance(error, StepError) and error.failure_class:
+        return error.failure_class
+    text = _text_of(error)
+    if _QUOTA_PATTERN.search(text):
+        return QUOTA
+    status = _status_of(error)
+    if status is not None and status != 500:
+        return classify_http_status(status)
+    if isinstance(error, (FileNotFoundError, PermissionError)) or _PERMANENT_PATTERN.search(text):
+        return PERMANENT
+    return TRANSIENT
+
+
+def retry_after_of(error: BaseException) -> Optional[float]:
+    """Server-requested retry delay carried by a quota error, if any."""
+    if isinstance(error, StepError) and error.retry_after is not None:
+        return error.retry_after
+    return parse_retry_delay(error)
+
+
+@dataclass
+class StepFailure:
+    failure_class: str
+    message: str
+    retry_after: Optional[float] = None
+
+    @classmethod
+    def from_exception(cls, error: BaseException) -> "StepFailure":
+        return cls(classify_exception(error), f"{type(error).__name__}: {error}", retry_after_of(error))
+
+
+def write_result_file(failure: StepFailure) -> None:
+    path = os.environ.get(RESULT_FILE_ENV)
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"failure_class": failure.failure_class, "message": failure.message,
+                       "retry_after": failure.retry_after}, f)
+
+
+def read_result_file(path: str, returncode: int) -> StepFailure:
+    """Failure reported by a step process: its result file if present, else its exit code."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return StepFailure(data["failure_class"], data.get("message", ""), data.get("retry_after"))
+    except (OSError, ValueError, KeyError):
+        return StepFailure(CLASS_BY_EXIT_CODE.get(returncode, TRANSIENT), f"exit code {returncode}")
+
+
+def run_step_main(main: Callable[[], Any]) -> None:
+    """
+    Entry point wrapper for the step scripts: run ``main`` and turn any
+    failure into the matching exit code (and result file).
+    """
+    try:
+        result = main()
+    except SystemExit:
+        raise
+    except BaseException as e:
+        if isinstance(e, KeyboardInterrupt):
+            raise
+        failure = StepFailure.from_exception(e)
+        traceback.print_exc()
+        print(f"[STEP FAILED] class={failure.failure_class} {failure.message}", file=sys.stderr)
+        write_result_file(failure)
+        sys.exit(EXIT_CODES[failure.failure_class])
+    if getattr(result, "partial", False):
+        failure = StepFailure(PARTIAL, "step produced partial output")
+        write_result_file(failure)
+        sys.exit(EXIT_CODES[PARTIAL])
+
+
+@dataclass
+class RetryDecision:
+    action: str  # "retry", "failover", "abort" or "accept"
+    delay: float = 0.0
+
+
+def decide(failure: StepFailure, attempt: int, max_retries: int, base_delay: float = 5.0,
+           can_failover: bool = False, max_quota_wait: float = 600.0) -> RetryDecision:
+    """
+    Next action after ``attempt`` (0-based) failed with ``failure``:
+    partial output is accepted, permanent failures abort, quota failures
+    fail over when an alternate is available and otherwise back off for the
+    server's retry-after (or 60s, 120s, ...), transient failures back off
+    5s, 10s, 20s, ...
+    """
+    if failure.failure_class == PARTIAL:
+        return RetryDecision("accept")
+    if failure.failure_class == PERMANENT:
+        return RetryDecision("abort")
+    if failure.failure_class == QUOTA and can_failover:
+        return RetryDecision("failover")
+    if attempt >= max_retries - 1:
+        return RetryDecision("abort")
+    if failure.failure_class == QUOTA:
+        delay = failure.retry_after if failure.retry_after is not None else 60.0 * (2 ** attempt)
+        if delay > max_quota_wait:
+            return RetryDecision("abort")
+        return RetryDecision("retry", delay)
+    return RetryDecision("retry", base_delay * (2 ** attempt))
+
+
+if __name__ == "__main__":
+    # Self-check of the classification rules: python step_failures.py
+    class _FakeApiError(Exception):
+        """Shaped like elevenlabs.core.ApiError."""
+
+        def __init__(self, status_code: int, body: Any):
+            super().__init__(f"status_code: {status_code}, body: {body}")
+            self.status_code = status_code
+            self.body = body
+
+    quota_401 = _FakeApiError(401, {"detail": {"status": "quota_exceeded",
+                                               "message": "This request exceeds your quota of 10000."}})
+    assert classify_exception(quota_401) == QUOTA
+    assert decide(StepFailure.from_exception(quota_401), 0, 3, can_failover=True).action == "failover"
+    assert classify_exception(_FakeApiError(401, {"detail": {"status": "invalid_api_key"}})) == PERMANENT
+    assert classify_exception(_FakeApiError(503, "Service Unavailable")) == TRANSIENT
+    assert classify_exception(RuntimeError("Refreshing credentials timed out")) == TRANSIENT
+    assert classify_exception(RuntimeError("Invalid credentials supplied")) == PERMANENT
+    print("step_failures: classification checks passed")
@@ -0,0 +1,239 @@
+"""
+Persistent index of stories the pipeline has already covered.
+
+Each story is fingerprinted with a 64-bit SimHash of its normalised title
+and description (word unigrams and bigrams, title words weighted double),
+so rewordings of the same story from another outlet, or a later update of
+it, land within a few bits of each other. Similarity is
+``1 - hamming_distance / 64``.
+
+Lookups use banded LSH: the fingerprint is split into ``max_distance + 1``
+bands, and by the pigeonhole principle any fingerprint within
+``max_distance`` bits shares at least one band exactly. Only the few
+entries in matching band buckets are compared, so a lookup touches a tiny
+fraction of the index and stays well under a millisecond with tens of
+thousands of entries. Fingerprints live in SQLite and are loaded into
+the in-memory band tables when the index is opened.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_STORY_INDEX_DB = os.path.join(".story_index", "stories.sqlite3")
+DEFAULT_DUPLICATE_THRESHOLD = 0.9
+DEFAULT_MAX_AGE_DAYS = 30
+FINGERPRINT_BITS = 64
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with "
+    "after over says said new".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased words of ``text`` without stopwords and single characters."""
+    return [t for t in _TOKEN.findall((text or "").lower()) if t not in _STOPWORDS and len(t) > 1]
+
+
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def simhash(title: str, description: str = "") -> int:
+    """64-bit SimHash fingerprint of a story."""
+    weights: Dict[str, int] = {}
+    for text, weight in ((title, 2), (description, 1)):
+        words = tokenize(text)
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            weights[feature] = weights.get(feature, 0) + weight
+    if not weights:
+        return 0
+    totals = [0] * FINGERPRINT_BITS
+    for feature, weight in weights.items():
+        h = _feature_hash(feature)
+        for bit in range(FINGERPRINT_BITS):
+            totals[bit] += weight if (h >> bit) & 1 else -weight
+    return sum(1 << bit for bit, total in enumerate(totals) if total > 0)
+
+
+def similarity(a: int, b: int) -> float:
+    return 1.0 - (a ^ b).bit_count() / FINGERPRINT_BITS
+
+
+def _to_signed(value: int) -> int:
+    """SQLite integers are signed 64-bit."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+@dataclass
+class StoryMatch:
+    story_id: int
+    title: str
+    similarity: float
+    created: float
+
+
+class StoryIndex:
+    """
+    SimHash index of processed stories. ``threshold`` is the similarity at
+    or above which a story counts as a duplicate.
+    """
+
+    def __init__(self, path: str = DEFAULT_STORY_INDEX_DB, threshold: float = DEFAULT_DUPLICATE_THRESHOLD,
+                 max_age_days: float = DEFAULT_MAX_AGE_DAYS):
+        if not 0 < threshold <= 1:
+            raise ValueError(f"Duplicate threshold must be in (0, 1], got {threshold}")
+        self.threshold = threshold
+        self.max_distance = int((1 - threshold) * FINGERPRINT_BITS + 1e-9)
+        self.max_age = max_age_days * 86400
+        self._bands = self._band_layout(self.max_distance + 1)
+        # (band, band value) -> {story id: fingerprint}
+        self._buckets: Dict[Tuple[int, int], Dict[int, int]] = {}
+        self._entries: Dict[int, Tuple[int, str, float]] = {}
+        self._lock = threading.Lock()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS stories (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   fingerprint INTEGER NOT NULL,
+                   title TEXT NOT NULL,
+                   url TEXT,
+                   created REAL NOT NULL
+               )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_stories_created ON stories(created)")
+        self.prune()
+        for story_id, fingerprint, title, created in self._conn.execute(
+                "SELECT id, fingerprint, title, created FROM stories"):
+            self._insert(story_id, _to_unsigned(fingerprint), title, created)
+
+    @staticmethod
+    def _band_layout(count: int) -> List[Tuple[int, int]]:
+        """(shift, mask) of ``count`` nearly equal bit bands covering the fingerprint."""
+        count = max(1, min(count, FINGERPRINT_BITS))
+        layout, start = [], 0
+        for i in range(count):
+            width = FINGERPRINT_BITS // count + (1 if i < FINGERPRINT_BITS % count else 0)
+            layout.append((start, (1 << width) - 1))
+            start += width
+        return layout
+
+    def _band_keys(self, fingerprint: int) -> Iterable[Tuple[int, int]]:
+        return ((i, (fingerprint >> shift) & mask) for i, (shift, mask) in enumerate(self._bands))
+
+    def _insert(self, story_id: int, fingerprint: int, title: str, created: float) -> None:
+        self._entries[story_id] = (fingerprint, title, created)
+        for key in self._band_keys(fingerprint):
+            self._buckets.setdefault(key, {})[story_id] = fingerprint
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def find_duplicate(self, title: str, description: str = "",
+                       fingerprint: Optional[int] = None) -> Optional[StoryMatch]:
+        """The most similar indexed story at or above the threshold, if any."""
+        fingerprint = simhash(title, description) if fingerprint is None else fingerprint
+        oldest = time.time() - self.max_age
+        best: Optional[StoryMatch] = None
+        max_distance = self.max_distance
+        with self._lock:
+            matches = {
+                story_id
+                for key in self._band_keys(fingerprint)
+                for story_id, other in self._buckets.get(key, {}).items()
+                if (fingerprint ^ other).bit_count() <= max_distance
+            }
+            for story_id in matches:
+                other, other_title, created = self._entries[story_id]
+                if created < oldest:
+                    continue
+                score = similarity(fingerprint, other)
+                if best is None or score > best.similarity:
+                    best = StoryMatch(story_id, other_title, score, created)
+        return best
+
+    def add(self, title: str, description: str = "", url: Optional[str] = None) -> int:
+        """Record a processed story and return its fingerprint."""
+        fingerprint = simhash(title, description)
+        created = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO stories (fingerprint, title, url, created) VALUES (?, ?, ?, ?)",
+                (_to_signed(fingerprint), title, url, created),
+            )
+            self._insert(cursor.lastrowid, fingerprint, title, created)
+        return fingerprint
+
+    def prune(self) -> int:
+        """Delete stories older than ``max_age_days``; they no longer count as duplicates."""
+        oldest = time.time() - self.max_age
+        with self._lock:
+            expired = [row[0] for row in self._conn.execute("SELECT id FROM stories WHERE created < ?", (oldest,))]
+            self._conn.execute("DELETE FROM stories WHERE created < ?", (oldest,))
+            for story_id in expired:
+                fingerprint = self._entries.pop(story_id, (None,))[0]
+                if fingerprint is not None:
+                    for key in self._band_keys(fingerprint):
+                        self._buckets.get(key, {}).pop(story_id, None)
+        return len(expired)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_story_index: Optional[StoryIndex] = None
+
+
+def get_story_index() -> StoryIndex:
+    """
+    Process-wide index at $STORY_INDEX_DB (default .story_index/stories.sqlite3)
+    with the threshold from $STORY_DUPLICATE_THRESHOLD (default 0.9).
+    """
+    global _story_index
+    if _story_index is None:
+        _story_index = StoryIndex(
+            os.environ.get("STORY_INDEX_DB", DEFAULT_STORY_INDEX_DB),
+            threshold=float(os.environ.get("STORY_DUPLICATE_THRESHOLD", DEFAULT_DUPLICATE_THRESHOLD)),
+        )
+    return _story_index
+
+
+if __name__ == "__main__":
+    # Lookup benchmark: python story_index.py [entries]
+    import random
+    import sys
+    import tempfile
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    vocabulary = [f"word{i}" for i in range(5000)]
+    with tempfile.TemporaryDirectory() as tmp:
+        index = StoryIndex(os.path.join(tmp, "bench.sqlite3"))
+        # SimHash bits of unrelated stories are close to uniformly random.
+        with index._lock:
+            for i in range(count):
+                index._insert(-i - 1, random.getrandbits(FINGERPRINT_BITS), "", time.time())
+
+        lookups = 2000
+        queries = [simhash(" ".join(random.sample(vocabulary, 8)), " ".join(random.sample(vocabulary, 32)))
+                   for _ in range(lookups)]
+        started = time.perf_counter()
+        for fingerprint in queries:
+            index.find_duplicate("", fingerprint=fingerprint)
+        print(f"Lookup: {(time.perf_counter() - started) / lookups * 1e6:.0f} us on average "
+              f"over {lookups} lookups ({len(index)} entries, {len(index._bands)} bands)")
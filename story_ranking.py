@@ -0,0 +1,237 @@
+"""
+Vectorised ranking of candidate stories for step 1.
+
+Each candidate article gets four signals in [0, 1], computed for all
+candidates at once with numpy:
+
+- recency: exponential decay of the article's age (half-life
+  ``half_life_hours``).
+- coverage: how many distinct outlets ran the same story. Titles are
+  MinHash-signed over their words and banded, so differently worded
+  headlines about one story still meet in a band bucket; the outlets per
+  bucket are counted across the candidates and the context articles.
+- burstiness: how much more often the article's title words appear in
+  the last ``burst_window_hours`` than in the older context articles
+  (the rolling baseline, e.g. the last week of news_store articles).
+- quality: description length up to ``target_words`` words, with a
+  penalty for descriptions the provider truncated.
+
+The score is the weighted sum of the signals (RankingWeights, configurable
+through $STORY_RANKING_WEIGHTS such as ``recency=1,coverage=2``).
+"""
+
+import os
+import re
+import time
+from dataclasses import dataclass, fields
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from news_sources import Article
+from story_index import tokenize
+
+SIGNALS = ("recency", "coverage", "burstiness", "quality")
+_PRIME = (1 << 31) - 1
+_TRUNCATED = re.compile(r"(\.\.\.|…|\[\+?\d+ chars\]|\[…\])\s*$")
+
+
+@dataclass
+class RankingWeights:
+    recency: float = 1.0
+    coverage: float = 1.0
+    burstiness: float = 1.0
+    quality: float = 1.0
+
+    @classmethod
+    def parse(cls, spec: str) -> "RankingWeights":
+        """Weights from ``"name=value,..."``; names left out keep their default."""
+        weights = cls()
+        for part in filter(None, (p.strip() for p in spec.split(","))):
+            name, sep, value = part.partition("=")
+            name = name.strip()
+            if not sep or name not in SIGNALS:
+                raise ValueError(f"Invalid ranking weight '{part}'; expected <signal>=<number> with a signal "
+                                 f"from {', '.join(SIGNALS)}")
+            setattr(weights, name, float(value))
+        return weights
+
+    @classmethod
+    def from_env(cls) -> "RankingWeights":
+        return cls.parse(os.environ.get("STORY_RANKING_WEIGHTS", ""))
+
+    def as_array(self) -> np.ndarray:
+        return np.array([getattr(self, f.name) for f in fields(self)], dtype=np.float64)
+
+
+@dataclass
+class RankedArticle:
+    article: Article
+    score: float
+    signals: Dict[str, float]
+
+
+def _identity(article: Article) -> Tuple[str, str]:
+    return article.provider, article.article_id or article.url or article.title
+
+
+def _normalise(values: np.ndarray) -> np.ndarray:
+    top = values.max(initial=0.0)
+    return values / top if top > 0 else np.zeros_like(values)
+
+
+class StoryRanker:
+    """Scores candidate articles on the four signals and sorts them by their weighted sum."""
+
+    def __init__(self, weights: Optional[RankingWeights] = None, half_life_hours: float = 6.0,
+                 burst_window_hours: float = 6.0, baseline_days: float = 7.0, target_words: int = 60,
+                 num_hashes: int = 12, band_size: int = 2, seed: int = 1):
+        if num_hashes % band_size:
+            raise ValueError(f"num_hashes ({num_hashes}) must be a multiple of band_size ({band_size})")
+        self.weights = weights or RankingWeights()
+        self.half_life = half_life_hours * 3600
+        self.burst_window = burst_window_hours * 3600
+        self.baseline_days = baseline_days
+        self.target_words = target_words
+        self.band_size = band_size
+        rng = np.random.default_rng(seed)
+        self._hash_a = rng.integers(1, _PRIME, size=num_hashes, dtype=np.int64)
+        self._hash_b = rng.integers(0, _PRIME, size=num_hashes, dtype=np.int64)
+
+    def _title_terms(self, articles: Sequence[Article]) -> Tuple[np.ndarray, np.ndarray, int]:
+        """(document index, term id) of every distinct title word, and the vocabulary size."""
+        vocabulary: Dict[str, int] = {}
+        docs: List[int] = []
+        terms: List[int] = []
+        for i, article in enumerate(articles):
+            ids = {vocabulary.setdefault(word, len(vocabulary)) for word in tokenize(article.title)}
+            docs.extend([i] * len(ids))
+            terms.extend(ids)
+        return np.array(docs, dtype=np.int64), np.array(terms, dtype=np.int64), len(vocabulary)
+
+    def _coverage(self, docs: np.ndarray, terms: np.ndarray, vocabulary: int,
+                  articles: Sequence[Article]) -> np.ndarray:
+        """Distinct outlets per story, i.e. sharing a MinHash band bucket with each article."""
+        count = len(articles)
+        term_hashes = (np.arange(vocabulary, dtype=np.int64)[:, None] * self._hash_a + self._hash_b) % _PRIME
+        # Articles without title words get a unique signature of their own.
+        signatures = np.repeat(-np.arange(1, count + 1, dtype=np.int64)[:, None], len(self._hash_a), axis=1)
+        if len(docs):
+            starts = np.flatnonzero(np.r_[True, docs[1:] != docs[:-1]])
+            signatures[docs[starts]] = np.minimum.reduceat(term_hashes[terms], starts, axis=0)
+
+        outlets: Dict[str, int] = {}
+        outlet_ids = np.array([outlets.setdefault(a.source or a.provider, len(outlets)) for a in articles],
+                              dtype=np.int64)
+        coverage = np.ones(count, dtype=np.int64)
+        bands = signatures.astype(np.uint64).reshape(count, -1, self.band_size)
+        for band in range(bands.shape[1]):
+            keys = bands[:, band, 0]
+            for column in range(1, self.band_size):
+                keys = keys * np.uint64(1000003) ^ bands[:, band, column]
+            _, groups = np.unique(keys, return_inverse=True)
+            pairs = np.unique(groups * len(outlets) + outlet_ids)
+            outlets_per_group = np.bincount(pairs // len(outlets), minlength=groups.max() + 1)
+            coverage = np.maximum(coverage, outlets_per_group[groups])
+        return coverage
+
+    def _burstiness(self, docs: np.ndarray, terms: np.ndarray, vocabulary: int, recent: np.ndarray,
+                    candidates: int) -> np.ndarray:
+        """Mean log-ratio of each title word's recent rate to its baseline rate (0 without a baseline)."""
+        baseline_docs = len(recent) - int(recent.sum())
+        if not baseline_docs or not len(docs):
+            return np.zeros(candidates)
+        in_recent = recent[docs]
+        recent_df = np.bincount(terms[in_recent], minlength=vocabulary)
+        baseline_df = np.bincount(terms[~in_recent], minlength=vocabulary)
+        burst = (np.log((recent_df + 0.5) / (recent.sum() + 1.0))
+                 - np.log((baseline_df + 0.5) / (baseline_docs + 1.0)))
+        # A word only one recent article uses is not a trend.
+        burst[recent_df < 2] = 0.0
+        burst = np.maximum(burst, 0.0)
+        mask = docs < candidates
+        totals = np.bincount(docs[mask], weights=burst[terms[mask]], minlength=candidates)
+        counts = np.bincount(docs[mask], minlength=candidates)
+        return totals / np.maximum(counts, 1)
+
+    def signals(self, candidates: Sequence[Article], context: Sequence[Article] = (),
+                now: Optional[float] = None) -> Dict[str, np.ndarray]:
+        """Each signal of every candidate, in candidate order."""
+        now = time.time() if now is None else now
+        # The context usually comes from the same store as the candidates.
+        candidate_keys = {_identity(a) for a in candidates}
+        articles = list(candidates) + [a for a in context if _identity(a) not in candidate_keys]
+        count = len(candidates)
+
+        published = np.array([np.nan if a.published_at is None else a.published_at for a in articles])
+        age = np.clip(now - published, 0.0, None)
+        # Undated candidates count as half a half-life old; undated context as recent news.
+        recency = np.where(np.isnan(age[:count]), 0.5, np.exp2(-np.nan_to_num(age[:count]) / self.half_life))
+        recent = np.isnan(age) | (age <= self.burst_window)
+
+        docs, terms, vocabulary = self._title_terms(articles)
+        coverage = self._coverage(docs, terms, vocabulary, articles)[:count]
+        burstiness = self._burstiness(docs, terms, vocabulary, recent, count)
+
+        words = np.array([a.description_words for a in candidates], dtype=np.float64)
+        truncated = np.array([bool(_TRUNCATED.search(a.description)) for a in candidates], dtype=bool)
+        quality = np.minimum(words / self.target_words, 1.0) * np.where(truncated, 0.7, 1.0)
+
+        return {
+            "recency": recency,
+            "coverage": _normalise(np.log(coverage.astype(np.float64))),
+            "burstiness": _normalise(burstiness),
+            "quality": quality,
+        }
+
+    def rank(self, candidates: Sequence[Article], context: Sequence[Article] = (),
+             now: Optional[float] = None) -> List[RankedArticle]:
+        """
+        ``candidates`` best first. ``context`` articles (other recent
+        articles, e.g. from news_store) only inform coverage and the
+        burstiness baseline; they are never ranked themselves.
+        """
+        if not candidates:
+            return []
+        signals = self.signals(candidates, context, now)
+        matrix = np.stack([signals[name] for name in SIGNALS], axis=1)
+        scores = matrix @ self.weights.as_array()
+        order = np.argsort(-scores, kind="stable")
+        return [
+            RankedArticle(candidates[i], float(scores[i]), dict(zip(SIGNALS, matrix[i].tolist())))
+            for i in order
+        ]
+
+
+if __name__ == "__main__":
+    # Ranking benchmark: python story_ranking.py [candidates] [context articles]
+    import random
+    import sys
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    context_count = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    vocabulary = [f"word{i}" for i in range(5000)]
+    outlets = [f"outlet{i}" for i in range(200)]
+    now = time.time()
+    stories = [random.sample(vocabulary, 8) for _ in range(max(count // 4, 1))]
+
+    def make_article(i: int, max_age_days: float) -> Article:
+        # Outlets reword a shared story: most of its words plus a few of their own.
+        words = random.sample(random.choice(stories), 6) + random.sample(vocabulary, 2)
+        return Article(
+            title=" ".join(words),
+            description=" ".join(random.choices(vocabulary, k=random.randint(0, 120))),
+            source=random.choice(outlets),
+            provider="newsdata",
+            published_at=now - random.uniform(0, max_age_days * 86400),
+            article_id=str(i),
+        )
+
+    candidates = [make_article(i, 1) for i in range(count)]
+    context = [make_article(count + i, 7) for i in range(context_count)]
+    ranker = StoryRanker()
+    started = time.perf_counter()
+    ranked = ranker.rank(candidates, context, now=now)
+    elapsed = time.perf_counter() - started
+    print(f"Ranked {len(ranked)} candidates against {len(context)} context articles in {elapsed * 1000:.0f} ms")
+    print(f"Top score {ranked[0].score:.3f}: " + ", ".join(f"{k}={v:.2f}" for k, v in ranked[0].signals.items()))
@@ -1,11 +1,11 @@
 import os
-from google import genai
+from gemini_client import get_client
 import time
 
 def generate_image_from_description(description, api_key, output_path="generated_images"):
     """Generate an image using Google's Imagen 3 model based on a text description."""
-    # Configure the Gemini API client
-    client = genai.Client(api_key=api_key)
+    # Shared Gemini client (reused across calls)
+    client = get_client(api_key)
     
     # Create output directory if it doesn't exist
     os.makedirs(output_path, exist_ok=True)
@@ -4,7 +4,7 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload
 # from google.oauth2.credentials import Credentials
-from google import genai
+from gemini_client import get_client
 
 # Constants
 SCOPES = ["https://www.googleapis.com/auth/youtube.upload"]
@@ -29,11 +29,11 @@ def sanitize_youtube_metadata(text):
 
 def generate_content(video_path, genai_api_key):
     """Generate video title, description and tags using Google Gemini."""
-    # Configure the Gemini API client
+    # Shared Gemini client (reused across calls)
     # genai.configure(api_key=genai_api_key)
     
-    # Create a client
-    client = genai.Client(api_key=genai_api_key)
+    # Get the shared client
+    client = get_client(genai_api_key)
     
     # Generate a title for the video
     title_prompt = f"Generate 1 catchy, SEO-friendly title for a video file named '{os.path.basename(video_path)}'. Keep it under 100 characters. Dont give options."
@@ -0,0 +1,84 @@
+"""
+Run-scoped working directories.
+
+Every pipeline run gets its own workspace, so several runs (or daemons) on
+one host never overwrite each other's news JSON, images or videos::
+
+    runs/<run_id>/                      news JSON, final videos, cache stats
+    <scratch root>/<run_id>/            images, slideshow, TTS audio, SRT and
+                                        the other intermediates
+
+The scratch directory defaults to ``runs/<run_id>/scratch`` but can live on
+tmpfs (``/dev/shm``) to keep intermediate I/O off the persistent disk. It
+is removed when the run finishes; the persistent directories of the most
+recent runs are kept for inspection and older ones are pruned.
+"""
+
+import logging
+import os
+import shutil
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional
+
+DEFAULT_WORKSPACE_ROOT = "runs"
+TMPFS_ROOT = "/dev/shm"
+
+
+def tmpfs_scratch_root(logger: Optional[logging.Logger] = None) -> Optional[str]:
+    """Scratch root on tmpfs, or None (scratch stays on disk) if this host has no /dev/shm."""
+    if os.path.isdir(TMPFS_ROOT) and os.access(TMPFS_ROOT, os.W_OK):
+        return os.path.join(TMPFS_ROOT, "pipeline-runs")
+    (logger or logging.getLogger(__name__)).warning(
+        f"{TMPFS_ROOT} is not available; keeping scratch files on disk.")
+    return None
+
+
+@dataclass
+class RunWorkspace:
+    """The persistent and scratch directories of one run."""
+    run_id: str
+    dir: str
+    scratch: str
+
+    @classmethod
+    def create(cls, run_id: str, root: str = DEFAULT_WORKSPACE_ROOT,
+               scratch_root: Optional[str] = None) -> "RunWorkspace":
+        run_dir = os.path.abspath(os.path.join(root, run_id))
+        scratch = os.path.abspath(os.path.join(scratch_root, run_id) if scratch_root else os.path.join(run_dir, "scratch"))
+        workspace = cls(run_id=run_id, dir=run_dir, scratch=scratch)
+        workspace.ensure()
+        return workspace
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RunWorkspace":
+        return cls(run_id=data["run_id"], dir=data["dir"], scratch=data["scratch"])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    def ensure(self) -> None:
+        """Create both directories (again, e.g. when resuming after a reboot cleared tmpfs)."""
+        os.makedirs(self.dir, exist_ok=True)
+        os.makedirs(self.scratch, exist_ok=True)
+
+    def path(self, name: str) -> str:
+        """Path of a file kept after the run."""
+        return os.path.join(self.dir, name)
+
+    def scratch_path(self, name: str) -> str:
+        """Path of an intermediate file removed when the run finishes."""
+        return os.path.join(self.scratch, name)
+
+    def cleanup(self) -> None:
+        shutil.rmtree(self.scratch, ignore_errors=True)
+
+
+def prune_workspaces(root: str = DEFAULT_WORKSPACE_ROOT, keep: int = 10, exclude: Optional[str] = None) -> None:
+    """Keep only the ``keep`` most recently modified run directories under ``root``."""
+    if not os.path.isdir(root):
+        return
+    entries = [os.path.join(root, name) for name in os.listdir(root)
+               if name != exclude and os.path.isdir(os.path.join(root, name))]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    for old in entries[max(keep - (1 if exclude else 0), 0):]:
+        shutil.rmtree(old, ignore_errors=True)